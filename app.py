@@ -1,15 +1,21 @@
+import json
 import streamlit as st
 import pandas as pd
 import numpy as np
-from streamlit_echarts import st_pyecharts
+from streamlit_echarts import st_echarts
 from modules.rag_engine import RAGEngine
 from modules.training_manager import BatchTrainer
-from utils.plot_executor import PlotExecutor
+from config.settings import QUERY_LIMITS_CONFIG, CHART_CACHE_CONFIG, DOWNSAMPLE_CONFIG
+from modules import tracing
+from modules.analysis import summarize_frame, format_pre_analysis, format_categorical_vocabulary
+from utils.chart_cache import get_chart_cache, code_hash, dataframe_fingerprint
+from utils.downsample import downsample_frame
 
 # ----------------- 新的、更简单的图表构建器 -----------------
-def build_simple_chart(df: pd.DataFrame, title: str):
+def build_simple_chart(df: pd.DataFrame, title: str, stats: dict = None):
     """
     根据给定的数据框，自动选择合适的图表类型并构建图表。
+    时间序列超过 DOWNSAMPLE_CONFIG["max_points"] 个点时先降采样；传入 stats 时写入降采样统计。
     """
     from pyecharts import options as opts
     from pyecharts.charts import Bar, Line
@@ -59,6 +65,10 @@ def build_simple_chart(df: pd.DataFrame, title: str):
     if time_col:
         chart = Line(init_opts=opts.InitOpts(width="100%", height="500px"))
         df_copy = df_copy.sort_values(by=time_col)
+        if DOWNSAMPLE_CONFIG.get("enabled", True):
+            df_copy, downsample_info = downsample_frame(df_copy, time_col, metric_cols)
+            if downsample_info and stats is not None:
+                stats["downsample"] = downsample_info
         chart.add_xaxis(df_copy[time_col].dt.strftime('%Y-%m-%d %H:%M').tolist())
         
         yaxis_count = 0
@@ -77,6 +87,54 @@ def build_simple_chart(df: pd.DataFrame, title: str):
     return chart
 
 
+def build_simple_chart_options(df: pd.DataFrame, title: str):
+    """
+    build_simple_chart 的缓存版本，返回 {"options": 图表 options 的 JSON 字符串, "downsample": 降采样统计}，
+    无法作图时 options 为空。数据未变化时，页面重跑直接复用已构建的 options；
+    降采样配置（开关、点数预算、方法）参与缓存键，配置变化后重新构建。
+    """
+    def build():
+        stats = {}
+        chart = build_simple_chart(df, title, stats)
+        return {"options": chart.dump_options() if chart else "", "downsample": stats.get("downsample")}
+
+    if not CHART_CACHE_CONFIG.get("enabled", True):
+        return build()
+    cache = get_chart_cache()
+    downsample_key = (DOWNSAMPLE_CONFIG.get("enabled", True), DOWNSAMPLE_CONFIG.get("max_points"),
+                      DOWNSAMPLE_CONFIG.get("method"), DOWNSAMPLE_CONFIG.get("minmax_ratio"))
+    key = ("simple_chart", code_hash(build_simple_chart), title, downsample_key, dataframe_fingerprint(df))
+    built = cache.get(key)
+    if built is None:
+        built = build()
+        cache.put(key, built)
+    return built
+
+
+def render_trace_panel(traces):
+    """调试模式下的延迟分解：按步骤展示每个阶段的耗时、字节数与 token 数"""
+    for label, trace in traces:
+        if trace is None:
+            continue
+        spans = trace.breakdown()
+        st.markdown(f"**{label}** — 总耗时 {trace.duration_ms:.0f} ms")
+        rows = []
+        for span in spans[1:]:
+            row = {"阶段": span["name"], "开始(ms)": span["start_ms"], "耗时(ms)": span["duration_ms"]}
+            row.update({key: value for key, value in span["attributes"].items() if key != "model"})
+            if span["error"]:
+                row["错误"] = span["error"]
+            rows.append(row)
+        if rows:
+            timing_df = pd.DataFrame(rows)
+            st.bar_chart(timing_df.set_index("阶段")["耗时(ms)"])
+            st.dataframe(timing_df, use_container_width=True, hide_index=True)
+        tokens = trace.totals("llm.prompt_tokens")
+        if tokens:
+            st.caption(f"LLM token：输入 {tokens}（缓存命中 {trace.totals('llm.cached_prompt_tokens')}），"
+                       f"输出 {trace.totals('llm.completion_tokens')}")
+
+
 # ----------------- 应用主逻辑 -----------------
 st.set_page_config(page_title="NL2SQL RAG Demo", layout="wide")
 
@@ -90,9 +148,13 @@ rag_engine = st.session_state.rag_engine
 trainer = st.session_state.trainer
 
 # 初始化所有查询相关的session state
-for key in ['generated_sql', 'current_question', 'refined_question', 'query_result', 'query_error', 'analysis_report']:
+for key in ['generated_sql', 'current_question', 'refined_question', 'query_result', 'query_error', 'analysis_report',
+            'sql_guard', 'sql_generation']:
     if key not in st.session_state:
         st.session_state[key] = "" if key in ['generated_sql', 'current_question', 'refined_question'] else None
+# 当前问题各步骤的追踪，[(步骤名, Trace), ...]
+if "traces" not in st.session_state:
+    st.session_state.traces = []
 
 
 # 创建标签页
@@ -127,8 +189,15 @@ with tabs[0]:
                             "上行数据业务流量", "下行数据业务流量", "系统内切换成功率"
                         ]
                         
-                        # 调用LLM进行问题解构
-                        refined = rag_engine.llm.refine_question(question.strip(), available_metrics)
+                        # 调用LLM进行问题解构，流式显示识别过程
+                        intent_box = st.empty()
+                        with tracing.start_trace("refine_question") as trace:
+                            refined = rag_engine.llm.refine_question(
+                                question.strip(), available_metrics,
+                                on_token=lambda text: intent_box.markdown(text + "▌")
+                            )
+                        st.session_state.traces = [("意图识别", trace)]
+                        intent_box.empty()
                         st.session_state.refined_question = refined
                         st.session_state.current_question = question.strip() # 保存原始问题
                         
@@ -168,13 +237,24 @@ with tabs[0]:
                     # 更新session state中的润色问题，以备后续使用
                     st.session_state.refined_question = final_question_for_sql
                     
-                    result = rag_engine.generate_sql_only(final_question_for_sql)
+                    sql_box = st.empty()
+                    result = rag_engine.generate_sql_only(
+                        final_question_for_sql,
+                        on_token=lambda text: sql_box.code(text, language="sql")
+                    )
                     st.session_state.generated_sql = result["sql"]
+                    # 保留生成结果，SQL执行后据此更新语义缓存
+                    st.session_state.sql_generation = result
+                    st.session_state.traces = [item for item in st.session_state.traces if item[0] == "意图识别"]
+                    st.session_state.traces.append(("SQL生成", result.get("trace")))
+                    if result.get("cache_hit"):
+                        st.toast(f"♻️ 复用了相似问题的SQL（相似度 {result['similarity']:.3f}）")
                     
                     # 清理后续状态
                     st.session_state.query_result = None
                     st.session_state.query_error = None
                     st.session_state.analysis_report = None
+                    st.session_state.sql_guard = None
                     st.rerun()
                 except Exception as e:
                     st.error(f"SQL生成失败：{str(e)}")
@@ -198,13 +278,40 @@ with tabs[0]:
             if st.button("▶️ SQL执行", type="primary", use_container_width=True, disabled=not edited_sql.strip()):
                 with st.spinner("正在执行查询..."):
                     try:
-                        df = rag_engine.db.execute_query(edited_sql)
-                        st.session_state.query_result = df
+                        with tracing.start_trace("execute_sql") as trace:
+                            # 执行前的代价检查；SQL未被手动修改时，regenerate 策略可按原问题重新生成
+                            unedited = edited_sql.strip() == st.session_state.generated_sql.strip()
+                            review = rag_engine.review_sql(edited_sql, st.session_state.refined_question if unedited else None)
+                            st.session_state.sql_guard = review
+                            if review["action"] != "reject":
+                                # 流式读取：首块到达即展示预览，其余分块继续加载
+                                preview = st.empty()
+                                chunks = []
+                                loaded_rows = 0
+                                with tracing.span("sql.execute") as span:
+                                    for chunk in rag_engine.db.iter_query(review["sql"], use_cache=True):
+                                        chunks.append(chunk)
+                                        loaded_rows += len(chunk)
+                                        if len(chunks) == 1:
+                                            span.set("sql.first_chunk_ms", round(span.duration_ms, 1))
+                                            preview.dataframe(chunk.head(QUERY_LIMITS_CONFIG["preview_rows"]), use_container_width=True)
+                                        else:
+                                            preview.caption(f"已加载 {loaded_rows} 行...")
+                                    span.set("sql.rows", loaded_rows)
+                                preview.empty()
+                        st.session_state.traces = [item for item in st.session_state.traces if item[0] != "SQL执行"]
+                        st.session_state.traces.append(("SQL执行", trace))
+                        st.session_state.query_result = None if review["action"] == "reject" else rag_engine.db.concat_chunks(chunks)
                         st.session_state.query_error = None
                         st.session_state.analysis_report = None
+                        # 只有未经修改、也未被代价检查改写的生成SQL才写入语义缓存
+                        if unedited and review["action"] in ("allow", "unchecked") and st.session_state.sql_generation:
+                            rag_engine.record_execution(st.session_state.sql_generation, success=True)
                     except Exception as e:
                         st.session_state.query_result = None
                         st.session_state.query_error = str(e)
+                        if edited_sql.strip() == st.session_state.generated_sql.strip() and st.session_state.sql_generation:
+                            rag_engine.record_execution(st.session_state.sql_generation, success=False)
         
         with btn_col2:
             if st.button("💾 保存到训练", type="secondary", use_container_width=True, disabled=not edited_sql.strip()):
@@ -214,15 +321,39 @@ with tabs[0]:
                 else:
                     st.warning("缺少原始问题或SQL")
 
+    if debug_mode and st.session_state.traces:
+        with st.expander("⏱️ 延迟分解", expanded=True):
+            render_trace_panel(st.session_state.traces)
+
     # --- 后续显示区域 ---
     if st.session_state.query_error:
         st.error(f"❌ SQL执行错误: {st.session_state.query_error}")
+
+    guard = st.session_state.sql_guard
+    if guard:
+        if guard["action"] == "reject":
+            st.error(f"🛡️ SQL代价检查未通过，{guard['message']}")
+        elif guard["action"] in ("rewrite", "regenerate"):
+            st.warning(f"🛡️ {guard['message']}")
+            with st.expander("实际执行的SQL"):
+                st.code(guard["sql"], language="sql")
+        elif guard["action"] == "allow":
+            st.caption(f"🛡️ SQL代价检查：{guard['message']}")
+        elif debug_mode:
+            st.caption(f"🛡️ {guard['message']}")
+        if debug_mode and guard["estimate"] is not None:
+            with st.expander("执行计划估算"):
+                st.dataframe(pd.DataFrame(guard["estimate"]["tables"]), use_container_width=True)
     
     if st.session_state.query_result is not None:
         result_df = st.session_state.query_result
         if not result_df.empty:
             st.divider()
             st.subheader("查询结果")
+            if result_df.attrs.get("from_cache"):
+                st.caption("⚡ 结果来自查询缓存（数据未更新）")
+            if result_df.attrs.get("truncated"):
+                st.warning(f"⚠️ 结果集超过上限，仅加载了前 {len(result_df)} 行。请增加过滤条件或聚合后再查询。")
             st.dataframe(result_df, use_container_width=True)
             
             # AI 智能数据可视化
@@ -232,36 +363,13 @@ with tabs[0]:
             if st.button("🔬 生成智能分析报告", type="primary"):
                 with st.spinner("AI正在执行深度分析..."):
                     try:
-                        # --- 数据预处理和摘要生成 ---
-                        dimension_cols = ['开始时间', '省份', '地市', '区县', '乡镇', '村区', 'station_name', 'cell_name', 'frequency_band']
-                        existing_dims = [col for col in dimension_cols if col in result_df.columns]
-                        metric_cols = [col for col in result_df.select_dtypes(include=np.number).columns if col not in existing_dims]
-                        
-                        pre_analysis_summary = ""
-                        overall_avg_series = None
-                        if existing_dims and metric_cols:
-                            grouped_analysis_df = result_df.groupby(existing_dims)[metric_cols].mean().round(4)
-                            overall_avg_series = result_df[metric_cols].mean().round(4)
-                            std_dev_series = result_df[metric_cols].std().round(4)
-                            coeff_var_series = (std_dev_series / overall_avg_series).abs().round(4)
-                            
-                            st.session_state.overall_avg_series = overall_avg_series # 保存全局平均值以供后续使用
-
-                            pre_analysis_summary = f"""
-**Pre-computed Analysis Summary:**
-1. Grouped Averages:
-{grouped_analysis_df.to_string()}
-2. Overall Averages (for baseline comparison):
-{overall_avg_series.to_string()}
-3. Coefficient of Variation (Volatility, for metric selection):
-{coeff_var_series.to_string()}
-"""
-                        
-                        categorical_summary = ""
-                        for col in result_df.select_dtypes(include=['object', 'category']).columns:
-                            unique_values = result_df[col].unique()
-                            display_values = list(unique_values[:10]) + ['...'] if len(unique_values) > 10 else list(unique_values)
-                            categorical_summary += f"- Column '{col}' contains: {display_values}\n"
+                        # --- 数据预处理和摘要生成（一次分组聚合得到全部统计量） ---
+                        summary = summarize_frame(result_df)
+                        pre_analysis_summary = format_pre_analysis(summary)
+                        if summary["grouped"] is not None:
+                            # 保存全局平均值以供后续使用
+                            st.session_state.overall_avg_series = summary["overall"]["mean"].astype(float).round(4)
+                        categorical_summary = format_categorical_vocabulary(summary)
                         
                         df_info = f"""
 **Original Data Info:**
@@ -270,13 +378,25 @@ Columns and Types: {result_df.dtypes.to_dict()}
 Categorical Vocabulary: {categorical_summary if categorical_summary else "None"}
 """
                         
-                        # 调用LLM进行文本分析
+                        # 调用LLM进行文本分析，报告的每个部分生成完毕即先行展示
+                        live_report = st.empty()
+                        live_sections = live_report.container()
+
+                        def render_section(key, insight):
+                            if isinstance(insight, dict):
+                                with live_sections:
+                                    st.markdown(f"#### {insight.get('title', key.replace('_', ' ').title())}")
+                                    if insight.get('explanation'):
+                                        st.caption(insight['explanation'])
+
                         st.session_state.analysis_report = rag_engine.llm.analyze_telecom_data(
                             df_info=df_info,
                             pre_analysis_summary=pre_analysis_summary, # <--- 确保这个参数被传递
                             user_question=st.session_state.current_question,
-                            query_result_sample=result_df.head(3).to_string()
+                            query_result_sample=result_df.head(3).to_string(),
+                            on_section=render_section
                         )
+                        live_report.empty()
 
                     except Exception as e:
                         st.error(f"数据分析失败: {str(e)}")
@@ -310,8 +430,27 @@ Categorical Vocabulary: {categorical_summary if categorical_summary else "None"}
                                         with st.expander("查看图表生成的SQL"):
                                             st.code(chart_sql, language='sql')
 
-                                    chart_df = rag_engine.db.execute_query(chart_sql)
-                                    st.session_state[chart_data_key] = chart_df
+                                    if sql_result.get("error"):
+                                        st.error(f"图表SQL生成失败: {sql_result['error']}")
+                                        st.session_state[chart_data_key] = pd.DataFrame()
+                                    else:
+                                        # 与主查询相同，执行前先做代价检查
+                                        review = rag_engine.review_sql(chart_sql, new_question)
+                                        if review["action"] == "reject":
+                                            st.error(f"🛡️ 图表SQL代价检查未通过，{review['message']}")
+                                            st.session_state[chart_data_key] = pd.DataFrame()
+                                        else:
+                                            if review["action"] in ("rewrite", "regenerate"):
+                                                st.warning(f"🛡️ {review['message']}")
+                                            try:
+                                                chart_df = rag_engine.db.execute_query(review["sql"], stream=True, use_cache=True)
+                                            except Exception:
+                                                rag_engine.record_execution(sql_result, success=False)
+                                                raise
+                                            # 改写或重新生成过的SQL不写入语义缓存（原SQL未通过检查）
+                                            if review["action"] in ("allow", "unchecked"):
+                                                rag_engine.record_execution(sql_result, success=True)
+                                            st.session_state[chart_data_key] = chart_df
 
                                 except Exception as e:
                                     st.error(f"图表数据生成失败: {e}")
@@ -320,9 +459,13 @@ Categorical Vocabulary: {categorical_summary if categorical_summary else "None"}
                         if chart_data_key in st.session_state:
                             chart_df = st.session_state[chart_data_key]
                             if chart_df is not None and not chart_df.empty:
-                                chart_obj = build_simple_chart(chart_df, insight.get('title', ''))
-                                if chart_obj:
-                                    st_pyecharts(chart_obj, height="500px")
+                                built_chart = build_simple_chart_options(chart_df, insight.get('title', ''))
+                                if built_chart["options"]:
+                                    st_echarts(options=json.loads(built_chart["options"]), height="500px")
+                                    downsample_info = built_chart["downsample"]
+                                    if debug_mode and downsample_info:
+                                        st.caption(f"降采样（{downsample_info['method']}）：{downsample_info['original_rows']:,} → "
+                                                   f"{downsample_info['rows']:,} 个点，保留 {downsample_info['ratio']:.1%}")
                                 else:
                                     st.warning("无法为此数据自动生成图表。")
                             elif chart_df is not None: # 如果是空的DataFrame
@@ -504,7 +647,20 @@ with st.sidebar:
         st.metric("向量库文档数", db_info.get('count', 0))
     except:
         st.metric("向量库文档数", "未连接")
-    
+
+    pool_status = rag_engine.db.get_pool_status()
+    st.metric("数据库连接", f"{pool_status['checked_out']}/{pool_status['size']}",
+              help=f"等待: {pool_status['waits']} 次, 取连接超时: {pool_status['pool_timeouts']} 次, 查询超时: {pool_status['query_timeouts']} 次")
+
+    if rag_engine.semantic_cache is not None:
+        sql_cache_stats = rag_engine.semantic_cache.get_stats()
+        st.metric("SQL语义缓存命中率", f"{sql_cache_stats['hit_rate']:.0%}",
+                  help=f"节省LLM耗时: {sql_cache_stats['saved_seconds']} 秒, 平均查找: {sql_cache_stats['avg_lookup_ms']} ms")
+
+    if rag_engine.embedder.cache is not None:
+        cache_stats = rag_engine.embedder.cache.get_stats()
+        st.metric("Embedding缓存命中率", f"{cache_stats['hit_rate']:.0%}", help=f"缓存条目: {cache_stats['entries']}")
+
     # 添加测试数据按钮
     st.divider()
     if st.button("添加测试数据"):
@@ -584,7 +740,7 @@ ORDER BY `数据业务流量` DESC""", language='sql')
         if confirm:
             try:
                 # 清空向量数据库
-                trainer.vector_db.clear_all()
+                trainer.clear_all()
                 st.success("向量库已清空！")
                 st.rerun()
             except Exception as e:
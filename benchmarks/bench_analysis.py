@@ -0,0 +1,100 @@
+"""
+预分析摘要基准：构造百万行级的 KPI 查询结果（时间 × 省份/地市/小区 × 若干指标），
+分别统计 modules.analysis（一次分组聚合）与原先 app.py 中内联实现的耗时。
+原实现会把全部分组结果 to_string，大结果集上极慢，默认只在 --legacy 时运行。
+
+用法:
+    python benchmarks/bench_analysis.py --rows 1000000
+    python benchmarks/bench_analysis.py --rows 200000 --legacy
+"""
+import sys
+import os
+import json
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from modules.analysis import summarize_frame, format_pre_analysis, format_categorical_vocabulary
+
+DIMENSION_COLS = ['开始时间', '省份', '地市', '区县', '乡镇', '村区', 'station_name', 'cell_name', 'frequency_band']
+
+
+def build_frame(rows, cells, metrics, seed):
+    """按小区 × 15 分钟粒度生成 KPI 结果，维度列为普通字符串列（与 read_sql 的结果一致）"""
+    rng = np.random.default_rng(seed)
+    periods = max(1, rows // cells)
+    cell_ids = np.repeat(np.arange(cells), periods)[:rows]
+    cities = np.array([f"地市{i:02d}" for i in range(21)])
+    frame = {
+        "开始时间": np.tile(pd.date_range("2024-06-01", periods=periods, freq="15min").to_numpy(), cells)[:rows],
+        "省份": np.full(rows, "广东"),
+        "地市": cities[cell_ids % len(cities)],
+        "cell_name": np.array([f"CELL_{i:05d}" for i in range(cells)])[cell_ids],
+        "frequency_band": np.array(["700M", "1.8G", "2.6G", "3.5G"])[cell_ids % 4],
+    }
+    for i in range(metrics):
+        frame[f"指标{i + 1}"] = rng.gamma(2.0, 10.0, rows).round(4)
+    return pd.DataFrame(frame)
+
+
+def legacy_summary(result_df):
+    """app.py 中原先的内联实现（保留作对照）"""
+    existing_dims = [col for col in DIMENSION_COLS if col in result_df.columns]
+    metric_cols = [col for col in result_df.select_dtypes(include=np.number).columns if col not in existing_dims]
+    grouped_analysis_df = result_df.groupby(existing_dims)[metric_cols].mean().round(4)
+    overall_avg_series = result_df[metric_cols].mean().round(4)
+    std_dev_series = result_df[metric_cols].std().round(4)
+    coeff_var_series = (std_dev_series / overall_avg_series).abs().round(4)
+    text = f"{grouped_analysis_df.to_string()}\n{overall_avg_series.to_string()}\n{coeff_var_series.to_string()}"
+    for col in result_df.select_dtypes(include=['object', 'category']).columns:
+        unique_values = result_df[col].unique()
+        text += str(list(unique_values[:10]))
+    return text
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": round(min(samples), 1), "median_ms": round(float(np.median(samples)), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预分析摘要基准")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cells", type=int, default=2000)
+    parser.add_argument("--metrics", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--legacy", action="store_true", help="同时运行原内联实现作对照")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    df = build_frame(args.rows, args.cells, args.metrics, args.seed)
+
+    def run():
+        summary = summarize_frame(df)
+        return format_pre_analysis(summary) + format_categorical_vocabulary(summary)
+
+    summary = summarize_frame(df)
+    reference = df[summary["metrics"]]
+    report = {
+        "rows": len(df),
+        "groups": len(summary["grouped"]) if summary["grouped"] is not None else 0,
+        "analysis": timed(run, args.repeat),
+        # 由分组结果合并出的整体统计与直接计算的差异
+        "max_abs_error": {
+            "mean": float((summary["overall"]["mean"].astype(float) - reference.mean()).abs().max()),
+            "std": float((summary["overall"]["std"].astype(float) - reference.std()).abs().max())
+        }
+    }
+    if args.legacy:
+        report["legacy"] = timed(lambda: legacy_summary(df), 1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+指标名匹配的微基准：对比逐个 `name in question` 与 Aho-Corasick 自动机在不同指标规模下的耗时。
+用法: python benchmarks/bench_metric_matcher.py
+"""
+import sys
+import os
+import random
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+from modules.metric_matcher import MetricMatcher
+
+METRICS_YAML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "all_metrics.yaml")
+PREFIXES = ["上行", "下行", "VoNR", "ViNR", "LTE", "NR", "小区级", "基站级", "华为", "中兴", "爱立信", "诺基亚"]
+
+
+def load_names():
+    with open(METRICS_YAML, 'r', encoding='utf-8') as f:
+        return [m['name'] for m in yaml.safe_load(f).get('metrics', [])]
+
+
+def synthesize(base_names, size):
+    """以真实指标名为基础，加上厂商/制式前缀和编号扩展到指定规模"""
+    rng = random.Random(42)
+    names = list(dict.fromkeys(base_names))
+    while len(names) < size:
+        names.append(f"{rng.choice(PREFIXES)}{rng.choice(base_names)}{len(names)}")
+    return names[:size]
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    base_names = load_names()
+    question = "**核心意图**: 对比湖北省十堰市和咸宁市的网络性能表现。**分析维度**: `省份`, `地市` **关键指标**: `无线接通率`, `无线掉线率`, `上行数据业务流量`, `数据业务流量`"
+    print(f"{'指标数':>8} {'构建(ms)':>10} {'逐个in(us)':>12} {'自动机(us)':>12} {'加速比':>8}")
+    for size in [100, 1000, 5000, 20000]:
+        names = synthesize(base_names, size)
+        start = time.perf_counter()
+        matcher = MetricMatcher({name: name for name in names})
+        build_ms = (time.perf_counter() - start) * 1e3
+        naive_us = timeit(lambda: [name for name in names if name in question], 50)
+        ac_us = timeit(lambda: matcher.find(question), 50)
+        print(f"{size:>8} {build_ms:>10.1f} {naive_us:>12.1f} {ac_us:>12.1f} {naive_us / ac_us:>7.1f}x")
+    print("匹配结果:", MetricMatcher({name: name for name in base_names}).find(question))
+
+
+if __name__ == "__main__":
+    main()
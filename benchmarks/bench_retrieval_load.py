@@ -0,0 +1,136 @@
+"""
+检索链路压测：使用进程内替身（modules.providers，延迟分布与错误率取自 PROVIDER_CONFIG，可用参数覆盖），
+以多线程并发调用 RAGEngine.generate_sql_only，统计吞吐、延迟分位数、错误数及各类缓存命中情况。
+随机种子固定，相同参数下结果可复现（仅受机器性能影响）。
+
+- 检索阶段线程池按并发数定容（RAGEngine.stage_workers），避免默认的 8 线程池成为瓶颈
+- LLM 替身只返回能通过字段校验的SQL示例，错误数只反映注入的故障；延迟分位数只统计成功的请求，
+  失败请求按原因（注入故障 / 字段校验 / 其他）单独计数
+
+用法:
+    python benchmarks/bench_retrieval_load.py --requests 5000 --concurrency 64 --zero-latency
+    python benchmarks/bench_retrieval_load.py --requests 500 --concurrency 16 --embedding-error-rate 0.05
+"""
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from modules.providers import create_llm, create_embedder, create_reranker, default_llm_response
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS_CSV = os.path.join(REPO_DIR, "quest-an.csv")
+METRICS_YAML = os.path.join(REPO_DIR, "all_metrics.yaml")
+VARIANTS = ["", "，按天汇总", "，只看广东", "，最近一周", "，按地市展开", "，取前10名"]
+
+
+def build_engine(args, workdir):
+    from modules.rag_engine import RAGEngine
+    from modules.training_manager import BatchTrainer
+    from modules.vector_store import LocalChromaDB
+
+    zero = {"distribution": "fixed", "median_ms": 0} if args.zero_latency else None
+    overrides = {kind: ({"latency": zero} if zero else {}) for kind in ("llm", "embedding", "rerank")}
+    overrides["embedding"]["error_rate"] = args.embedding_error_rate
+    overrides["llm"]["error_rate"] = args.llm_error_rate
+
+    embedder = create_embedder("fake", **overrides["embedding"])
+    vector_db = LocalChromaDB(path=os.path.join(workdir, "chroma"))
+    # 入库时不注入错误，保证语料完整
+    trainer = BatchTrainer(embedder=create_embedder("fake", latency={"median_ms": 0}), vector_db=vector_db,
+                           manifest_path=os.path.join(workdir, "manifest.json"))
+    trainer.train_from_metrics_yaml(METRICS_YAML)
+    pairs = pd.read_csv(QUESTIONS_CSV, encoding='utf-8-sig')
+    trainer.train_from_qa_pairs([{"question": q, "sql": s} for q, s in zip(pairs["question"], pairs["sql"])])
+
+    engine = RAGEngine(llm=create_llm("fake", **overrides["llm"]), embedder=embedder,
+                       reranker=create_reranker("fake", **overrides["rerank"]), vector_db=vector_db,
+                       metrics_yaml_path=METRICS_YAML,
+                       semantic_cache_path=os.path.join(workdir, "semantic_cache.sqlite3"),
+                       executor=ThreadPoolExecutor(max_workers=RAGEngine.stage_workers(args.concurrency)))
+    # 替身跳过会被字段校验拒绝的示例（引用了指标定义之外的计数器），错误只来自注入的故障
+    engine.llm.responder = functools.partial(
+        default_llm_response, accept_sql=lambda sql: engine._validate_sql_fields(sql) is None
+    )
+    return engine, list(pairs["question"])
+
+
+def error_kind(error):
+    """失败原因分类：注入的故障 / SQL字段校验 / 其他"""
+    if "模拟错误" in error:
+        return "injected"
+    if error.startswith("SQL contains undefined fields"):
+        return "validation"
+    return "other"
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {}
+    latencies = np.asarray(seconds) * 1000
+    return {p: round(float(np.percentile(latencies, q)), 2) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索链路压测（本地替身）")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--zero-latency", action="store_true", help="替身不模拟延迟，测纯本地开销上限")
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--no-cache", action="store_true", help="关闭语义SQL缓存")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="text2sql_load_")
+    engine, questions = build_engine(args, workdir)
+    rng = random.Random(args.seed)
+    workload = [f"{rng.choice(questions)}{rng.choice(VARIANTS)}" for _ in range(args.requests)]
+
+    def one(question):
+        start = time.perf_counter()
+        result = engine.generate_sql_only(question, use_cache=not args.no_cache)
+        # 压测不执行SQL：生成成功即视为执行成功，写入语义缓存（与线上执行成功后写入的路径一致）
+        engine.record_execution(result, success=not result.get("error"))
+        return time.perf_counter() - start, result.get("error"), bool(result.get("cache_hit"))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one, workload))
+    elapsed = time.perf_counter() - start
+    engine.executor.shutdown(wait=False)
+
+    errors = {"total": 0, "injected": 0, "validation": 0, "other": 0}
+    for _, error, _ in outcomes:
+        if error:
+            errors["total"] += 1
+            errors[error_kind(error)] += 1
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "stage_workers": type(engine).stage_workers(args.concurrency),
+        "elapsed_s": round(elapsed, 3),
+        "qps": round(args.requests / elapsed, 1),
+        "latency_ms": latency_summary([o[0] for o in outcomes if not o[1]]),
+        "error_latency_ms": latency_summary([o[0] for o in outcomes if o[1]]),
+        "errors": errors,
+        "semantic_hit_rate": round(sum(o[2] for o in outcomes) / len(outcomes), 4),
+        "providers": {
+            "llm": engine.llm.get_stats(),
+            "embedding": engine.embedder.get_stats(),
+            "rerank": engine.reranker.get_stats()
+        }
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
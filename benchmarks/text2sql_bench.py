@@ -0,0 +1,354 @@
+"""
+Text2SQL 端到端离线基准：用 quest-an.csv 中的标准问答对驱动 RAGEngine（检索 -> 重排 -> 提示词 -> LLM -> 执行），
+统计各阶段延迟分位数、提示词 token、缓存命中率、执行准确率（结果集等价）和检索召回率，输出可跨版本对比的 JSON 报告。
+
+- 数据库使用 SQLite 夹具（btsbase/kpibase 同构表，随机种子生成数据），无需 MySQL
+- 嵌入、重排、LLM 使用 modules.providers 中的进程内替身（零延迟）：嵌入为词元哈希的确定性向量，
+  重排为 BM25，LLM 直接返回提示词中第一条 SQL 示例，衡量的是检索链路能否把正确示例送进提示词。
+  --llm claude 时调用真实模型
+- 默认留一法（leave-one-out）：评测某个问题时，从向量库中移除它自己的问答对。此时替身 LLM 无法生成标准SQL，
+  执行准确率不再反映检索质量，改用检索召回率衡量：标准问答对的"近邻"（留一法下为标准SQL最相似的其他问答对，
+  --split none 时为其自身）是否进入了提示词的SQL示例
+- --repeat 2 时第二轮可观察语义缓存、嵌入缓存的命中效果
+
+用法:
+    python benchmarks/text2sql_bench.py --output bench_report.json
+    python benchmarks/text2sql_bench.py --baseline bench_report.json   # 与上次报告对比，准确率或召回率下降时返回非零退出码
+"""
+import sys
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import yaml
+from modules.db_connector import MySQLConnector
+from modules.providers import FakeLLM, FakeEmbedding, FakeReranker, LatencyModel
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS_CSV = os.path.join(REPO_DIR, "quest-an.csv")
+METRICS_YAML = os.path.join(REPO_DIR, "all_metrics.yaml")
+COUNTER_PATTERN = re.compile(r'[KR]\d{4}_\d{3}')
+SQL_TOKEN_PATTERN = re.compile(r"'[^']*'|[\w\u4e00-\u9fff]+")
+
+PROVINCES = {"广东": ["广州", "深圳", "佛山"], "江苏": ["南京", "苏州", "无锡"],
+             "浙江": ["杭州", "宁波", "温州"], "四川": ["成都", "绵阳", "宜宾"]}
+BANDS = ["band28", "band41", "n78", "n1"]
+
+
+class SQLiteFixture:
+    """实现 RAGEngine 用到的 execute_query 接口，SQL 在 SQLite 夹具库上执行"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def execute_query(self, sql, params=None, timeout_ms=None, stream=False, use_cache=False):
+        with sqlite3.connect(self.path) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def get_schema_info(self):
+        with sqlite3.connect(self.path) as conn:
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+            ddl_list = []
+            for table in tables:
+                columns = [{"COLUMN_NAME": row[1], "DATA_TYPE": row[2].lower(), "COLUMN_COMMENT": ""}
+                           for row in conn.execute(f"PRAGMA table_info(`{table}`)")]
+                ddl_list.append(MySQLConnector._build_ddl(table, "", columns))
+        return ddl_list
+
+
+def load_pairs():
+    df = pd.read_csv(QUESTIONS_CSV, encoding='utf-8-sig')
+    return [{"question": q.strip(), "sql": s.strip()} for q, s in zip(df["question"], df["sql"])]
+
+
+def build_fixture(path, pairs, stations=40, cells_per_station=3, days=7, seed=7):
+    """生成 btsbase/kpibase 夹具；kpibase 包含标准SQL和指标公式引用到的全部计数器"""
+    rng = random.Random(seed)
+    counters = set()
+    for pair in pairs:
+        counters.update(COUNTER_PATTERN.findall(pair["sql"]))
+    if os.path.exists(METRICS_YAML):
+        with open(METRICS_YAML, 'r', encoding='utf-8') as f:
+            for metric in (yaml.safe_load(f) or {}).get('metrics', []):
+                counters.update(COUNTER_PATTERN.findall(metric.get('formula', '')))
+    counters = sorted(counters)
+
+    bts_rows = []
+    for s in range(stations):
+        province = rng.choice(list(PROVINCES))
+        city = rng.choice(PROVINCES[province])
+        band = rng.choice(BANDS)
+        for c in range(cells_per_station):
+            bts_rows.append((f"{s}_{c}", f"站点{s}", f"小区{s}_{c}", province, city, band))
+    kpi_rows = []
+    for cell_id, *_ in bts_rows:
+        for day in range(days):
+            kpi_rows.append((cell_id, f"2025-01-{day + 1:02d}", *(rng.randint(0, 10000) for _ in counters)))
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE btsbase (`ID` varchar, `station_name` varchar, `cell_name` varchar, "
+                     "`省份` varchar, `地市` varchar, `frequency_band` varchar)")
+        counter_defs = "".join(f", `{name}` bigint" for name in counters)
+        conn.execute(f"CREATE TABLE kpibase (`ID` varchar, `开始时间` varchar{counter_defs})")
+        conn.executemany("INSERT INTO btsbase VALUES (?, ?, ?, ?, ?, ?)", bts_rows)
+        conn.executemany(f"INSERT INTO kpibase VALUES ({', '.join('?' * (2 + len(counters)))})", kpi_rows)
+
+
+def gold_neighbours(pairs, held_out):
+    """
+    每个问题的"近邻"问答对（问题文本集合）：held_out 为 True 时取标准SQL词元 Jaccard 相似度最高的其他问答对
+    （并列时全部计入），否则为问题自身
+    """
+    if not held_out:
+        return {pair["question"]: {pair["question"]} for pair in pairs}
+    tokens = {pair["question"]: set(t.lower() for t in SQL_TOKEN_PATTERN.findall(pair["sql"])) for pair in pairs}
+    neighbours = {}
+    for question, own in tokens.items():
+        scores = {other: len(own & theirs) / len(own | theirs)
+                  for other, theirs in tokens.items() if other != question and (own | theirs)}
+        best = max(scores.values(), default=0.0)
+        neighbours[question] = {other for other, score in scores.items() if score == best and best > 0}
+    return neighbours
+
+
+def frames_equivalent(expected, actual, decimals=4):
+    """执行准确率判定：行集合相同（忽略行顺序与列名，数值按小数位取整后比较）"""
+    if expected.shape[1] != actual.shape[1]:
+        return False
+
+    def normalize(df):
+        rows = []
+        for row in df.itertuples(index=False):
+            rows.append(tuple(round(float(v), decimals) if isinstance(v, (int, float, np.number)) and not pd.isna(v)
+                              else (None if pd.isna(v) else str(v)) for v in row))
+        return sorted(rows, key=repr)
+
+    return normalize(expected) == normalize(actual)
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    arr = np.asarray(values) * 1000
+    return {"p50_ms": round(float(np.percentile(arr, 50)), 2), "p95_ms": round(float(np.percentile(arr, 95)), 2),
+            "p99_ms": round(float(np.percentile(arr, 99)), 2), "mean_ms": round(float(arr.mean()), 2),
+            "count": len(values)}
+
+
+def summarize(records, engine):
+    """汇总一轮的结果；分区阶段（如 vector_search:qa）并发执行，按同类阶段的最大值计入"""
+    stages = {}
+    for record in records:
+        per_stage = {}
+        for name, seconds in record["timings"].items():
+            base = name.split(":")[0]
+            per_stage[base] = max(per_stage.get(base, 0.0), seconds)
+        for base, seconds in per_stage.items():
+            stages.setdefault(base, []).append(seconds)
+
+    prompt_tokens = [r["prompt_tokens"] for r in records if r["prompt_tokens"]]
+    evaluated = [r for r in records if r["gold_ok"]]
+    # 语义缓存命中时不经过检索，不计入召回率
+    retrieved = [r for r in records if r["neighbour_hit"] is not None]
+    summary = {
+        "latency": {
+            "total": percentiles([r["total_seconds"] for r in records]),
+            "stages": {name: percentiles(values) for name, values in sorted(stages.items())}
+        },
+        "tokens": {
+            "prompt_total_mean": round(float(np.mean([t["total"] for t in prompt_tokens])), 1) if prompt_tokens else 0,
+            "prompt_by_section_mean": {
+                section: round(float(np.mean([t.get(section, 0) for t in prompt_tokens])), 1)
+                for section in ("static", "formulas", "context", "examples")
+            } if prompt_tokens else {},
+            "llm_prompt_total": sum(r["llm_prompt_tokens"] for r in records),
+            "llm_cached_prompt_total": sum(r["llm_cached_prompt_tokens"] for r in records),
+            "completion_total": sum(r["completion_tokens"] for r in records)
+        },
+        "cache": {
+            "semantic_hit_rate": round(sum(r["cache_hit"] for r in records) / len(records), 4) if records else 0.0
+        },
+        "accuracy": {
+            "evaluated": len(evaluated),
+            "execution_accuracy": round(sum(r["correct"] for r in evaluated) / len(evaluated), 4) if evaluated else 0.0,
+            "errors": sum(1 for r in records if r["error"])
+        },
+        "retrieval": {
+            "evaluated": len(retrieved),
+            "neighbour_recall": round(sum(r["neighbour_hit"] for r in retrieved) / len(retrieved), 4) if retrieved else 0.0
+        }
+    }
+    if engine.semantic_cache is not None:
+        summary["cache"]["semantic_cache"] = engine.semantic_cache.get_stats()
+    if getattr(engine.embedder, "cache", None) is not None:
+        summary["cache"]["embedding_cache"] = engine.embedder.cache.get_stats()
+    summary["cache"]["rerank"] = engine.reranker.get_stats()
+    return summary
+
+
+def run(args):
+    from modules.rag_engine import RAGEngine
+    from modules.training_manager import BatchTrainer
+    from modules.vector_store import LocalChromaDB
+
+    pairs = load_pairs()
+    if args.limit:
+        pairs = pairs[:args.limit]
+    workdir = tempfile.mkdtemp(prefix="text2sql_bench_")
+    fixture_path = os.path.join(workdir, "fixture.sqlite3")
+    build_fixture(fixture_path, pairs)
+    db = SQLiteFixture(fixture_path)
+
+    embedder = FakeEmbedding(dimensions=256)
+    vector_db = LocalChromaDB(path=os.path.join(workdir, "chroma"))
+    trainer = BatchTrainer(embedder=embedder, vector_db=vector_db,
+                           manifest_path=os.path.join(workdir, "manifest.json"))
+    trainer.train_from_metrics_yaml(METRICS_YAML)
+    trainer.train_from_ddl(db.get_schema_info())
+    trainer.train_from_qa_pairs(pairs)
+
+    if args.llm == "claude":
+        from modules.llm_manager import ClaudeLLM
+        llm = ClaudeLLM()
+    else:
+        llm = FakeLLM(latency=LatencyModel(median_ms=args.llm_latency * 1000))
+    engine = RAGEngine(llm=llm, embedder=embedder, reranker=FakeReranker(), vector_db=vector_db, db=db,
+                       metrics_yaml_path=METRICS_YAML,
+                       semantic_cache_path=os.path.join(workdir, "semantic_cache.sqlite3"))
+
+    gold_results = {}
+    for pair in pairs:
+        try:
+            gold_results[pair["question"]] = db.execute_query(pair["sql"])
+        except Exception as e:
+            print(f"[BENCH] 标准SQL无法在夹具上执行，不计入准确率: {pair['question']} ({e})")
+
+    neighbours = gold_neighbours(pairs, held_out=args.split == "loo")
+    report = {
+        "config": {"split": args.split, "repeat": args.repeat, "llm": args.llm, "questions": len(pairs),
+                   "llm_latency": args.llm_latency},
+        "passes": [],
+        "questions": []
+    }
+    for pass_no in range(1, args.repeat + 1):
+        records = []
+        for pair in pairs:
+            question = pair["question"]
+            held_out = args.split == "loo"
+            if held_out:
+                vector_db.delete_documents([vector_db._generate_id(question)])
+            start = time.perf_counter()
+            result = engine.ask(question)
+            total_seconds = time.perf_counter() - start
+            if held_out:
+                vector_db.add_embeddings_bulk([question], [embedder.embed(question)],
+                                              [{"type": "qa", "sql": pair["sql"]}])
+
+            trace = result.get("trace")
+            expected = gold_results.get(question)
+            actual = result.get("result")
+            correct = (expected is not None and isinstance(actual, pd.DataFrame) and not result.get("error")
+                       and frames_equivalent(expected, actual))
+            examples = result.get("example_questions")
+            neighbour_hit = None
+            if examples is not None and neighbours[question]:
+                neighbour_hit = bool(neighbours[question] & set(examples))
+            records.append({
+                "pass": pass_no,
+                "question": question,
+                "sql": result.get("sql"),
+                "correct": bool(correct),
+                "neighbour_hit": neighbour_hit,
+                "gold_ok": expected is not None,
+                "cache_hit": bool(result.get("cache_hit")),
+                "error": result.get("error"),
+                "total_seconds": total_seconds,
+                "timings": result.get("timings", {}),
+                "prompt_tokens": result.get("prompt_tokens"),
+                # token 用量取自追踪：真实模型为接口返回值，替身为估算值
+                "llm_prompt_tokens": trace.totals("llm.prompt_tokens") if trace else 0,
+                "llm_cached_prompt_tokens": trace.totals("llm.cached_prompt_tokens") if trace else 0,
+                "completion_tokens": trace.totals("llm.completion_tokens") if trace else 0
+            })
+        summary = summarize(records, engine)
+        summary["pass"] = pass_no
+        report["passes"].append(summary)
+        report["questions"].extend(
+            {key: (round(value * 1000, 2) if key == "total_seconds" else value)
+             for key, value in record.items() if key not in ("timings", "prompt_tokens", "trace")}
+            for record in records
+        )
+        print(f"[BENCH] 第 {pass_no} 轮: 执行准确率 {summary['accuracy']['execution_accuracy']:.2%}, "
+              f"近邻召回率 {summary['retrieval']['neighbour_recall']:.2%}, "
+              f"总耗时 p50 {summary['latency']['total'].get('p50_ms')}ms / p95 {summary['latency']['total'].get('p95_ms')}ms, "
+              f"语义缓存命中率 {summary['cache']['semantic_hit_rate']:.2%}")
+    engine.executor.shutdown(wait=False)
+    return report
+
+
+def compare(report, baseline, latency_tolerance=0.2):
+    """
+    与基线报告对比首轮结果：执行准确率或近邻召回率下降、p95 总耗时超出容差时视为回退，返回回退项列表。
+    留一法下替身 LLM 的执行准确率恒为 0，检索质量的回退由近邻召回率反映
+    """
+    regressions = []
+    if report["config"].get("split") != baseline["config"].get("split"):
+        print(f"[BENCH] 警告: 基线的 split 为 {baseline['config'].get('split')}，与本次 "
+              f"{report['config'].get('split')} 不同，对比结果仅供参考")
+    current, previous = report["passes"][0], baseline["passes"][0]
+    acc, prev_acc = current["accuracy"]["execution_accuracy"], previous["accuracy"]["execution_accuracy"]
+    print(f"[BENCH] 执行准确率: {prev_acc:.2%} -> {acc:.2%}")
+    if acc < prev_acc:
+        regressions.append("execution_accuracy")
+    if "retrieval" in current and "retrieval" in previous:
+        recall, prev_recall = current["retrieval"]["neighbour_recall"], previous["retrieval"]["neighbour_recall"]
+        print(f"[BENCH] 近邻召回率: {prev_recall:.2%} -> {recall:.2%}")
+        if recall < prev_recall:
+            regressions.append("neighbour_recall")
+    p95, prev_p95 = current["latency"]["total"].get("p95_ms", 0), previous["latency"]["total"].get("p95_ms", 0)
+    print(f"[BENCH] 总耗时 p95: {prev_p95}ms -> {p95}ms")
+    if prev_p95 and p95 > prev_p95 * (1 + latency_tolerance):
+        regressions.append("latency_p95")
+    tokens, prev_tokens = current["tokens"]["prompt_total_mean"], previous["tokens"]["prompt_total_mean"]
+    print(f"[BENCH] 平均提示词 token: {prev_tokens} -> {tokens}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text2SQL 离线基准")
+    parser.add_argument("--split", choices=["loo", "none"], default="loo",
+                        help="loo: 留一法，评测时移除该问题自身的问答对；none: 全部问答对入库")
+    parser.add_argument("--repeat", type=int, default=2, help="重复轮数，第二轮起可观察缓存效果")
+    parser.add_argument("--llm", choices=["stub", "claude"], default="stub")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="LLM 替身的模拟延迟（秒）")
+    parser.add_argument("--limit", type=int, default=0, help="只评测前 N 个问题")
+    parser.add_argument("--output", default="", help="JSON 报告输出路径")
+    parser.add_argument("--baseline", default="", help="用于对比的历史 JSON 报告")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"[BENCH] 报告已写入 {args.output}")
+    else:
+        print(json.dumps(report["passes"], ensure_ascii=False, indent=2, default=str))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f))
+        if regressions:
+            print(f"[BENCH] 检测到回退: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
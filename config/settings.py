@@ -3,7 +3,11 @@ import os
 LLM_CONFIG = {
     "api_key": os.getenv("OP_API_KEY"),
     "base_url": "https://openrouter.ai/api/v1",
-    "model": "anthropic/claude-opus-4"
+    "model": "anthropic/claude-opus-4",
+    # 客户端自身不重试：限流（429）由 RAGEngine._call_llm 在释放并发名额后退避重试，避免重试次数叠加
+    "max_retries": 0,
+    # 流式输出回调界面的最小间隔（秒）
+    "stream_callback_interval": 0.05
 }
 
 EMBEDDING_CONFIG = {
@@ -11,11 +15,106 @@ EMBEDDING_CONFIG = {
     "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
     "model": "text-embedding-v4",
     "dimensions": 1024,
-    "encoding_format": "float"
+    "encoding_format": "float",
+    # 批量嵌入：DashScope text-embedding-v4 单次请求最多 10 条
+    "batch_size": 10,
+    "max_workers": 4,
+    "max_retries": 3,
+    "retry_backoff": 1.0
+}
+
+# 外部服务后端：remote 使用 OpenRouter / DashScope；fake 使用进程内确定性替身（压测、离线基准）
+# 替身延迟分布 distribution 可选 fixed / uniform / lognormal，error_rate 为模拟的失败比例
+# （LLM 可设 error_status: 429 模拟限流）
+PROVIDER_CONFIG = {
+    "backend": os.getenv("TEXT2SQL_PROVIDER", "remote"),
+    "fake": {
+        "seed": 42,
+        "retry_backoff": 0.0,
+        "llm": {"latency": {"distribution": "lognormal", "median_ms": 800, "sigma": 0.5}, "error_rate": 0.0},
+        "embedding": {"latency": {"distribution": "lognormal", "median_ms": 40, "sigma": 0.4}, "error_rate": 0.0},
+        "rerank": {"latency": {"distribution": "lognormal", "median_ms": 120, "sigma": 0.4}, "error_rate": 0.0}
+    }
+}
+
+# 链路追踪：每次请求记录各阶段耗时、字节数、token 数；export_path 非空时以 OTLP/JSON 追加导出
+TRACING_CONFIG = {
+    "enabled": True,
+    "export_path": os.getenv("TEXT2SQL_TRACE_EXPORT", ""),
+    "service_name": "text2sql"
+}
+
+# 向量缓存：相同 (模型, 维度, 文本) 的嵌入结果直接从本地读取
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "path": "./embedding_cache.sqlite3",
+    "memory_size": 2048,
+    "max_entries": 200000
+}
+
+# 检索流水线：各阶段并发执行，带单阶段超时（秒）和整体时间预算（秒）
+PIPELINE_CONFIG = {
+    "max_workers": 8,
+    "budget_seconds": 20,
+    "stage_timeouts": {
+        "embedding": 10,
+        "vector_search": 5,
+        "lexical_search": 5,
+        "rerank": 3
+    }
+}
+
+# 批量问答（ask_many）：问题级并发数、LLM 并发上限及限流（HTTP 429）退避参数
+BATCH_CONFIG = {
+    "concurrency": 8,
+    "llm_concurrency": 4,
+    "max_retries": 5,
+    "backoff_base": 1.0,
+    "backoff_max": 30.0
+}
+
+# 语义SQL缓存：相似问题（涉及指标一致、日期/数字/地名等字面量相同）直接复用执行成功过的SQL；
+# 条目 ttl_seconds 后过期，复用的SQL执行失败时删除
+SEMANTIC_CACHE_CONFIG = {
+    "enabled": True,
+    "path": "./semantic_cache.sqlite3",
+    "similarity_threshold": 0.97,
+    "max_entries": 5000,
+    "ttl_seconds": 7 * 24 * 3600
 }
 
 RERANK_CONFIG = {
-    "model": "gte-rerank-v2"
+    "model": "gte-rerank-v2",
+    "enabled": True,
+    "candidate_k": 50,            # 先宽召回的候选数量，再重排
+    "cache_size": 10000,          # (问题, 文档) 分数缓存条数
+    "latency_budget_ms": 1500,    # 近期 p95 超出该值时跳过在线重排，改用词法打分
+    "latency_window": 50,
+    "probe_interval": 20
+}
+
+# 混合检索：向量检索 + BM25 词法检索，按倒数排名融合（RRF）
+# type_quotas: 按文档类型分区检索，各类型并发查询并按配额取数，上下文总条数固定；置空则不分区
+RETRIEVAL_CONFIG = {
+    "hybrid": True,
+    "rrf_k": 60,
+    "type_quotas": {
+        "qa": 3,
+        "ddl": 2,
+        "metric_formula": 2,
+        "doc": 3
+    }
+}
+
+# SQL生成提示词：各部分的 token 预算（估算值），prompt_cache 为 True 时静态指令块标记为可缓存前缀
+PROMPT_CONFIG = {
+    "budgets": {
+        "formulas": 1500,
+        "context": 2500,
+        "examples": 1500
+    },
+    "min_truncated_tokens": 50,
+    "prompt_cache": True
 }
 
 MYSQL_CONFIG = {
@@ -26,6 +125,93 @@ MYSQL_CONFIG = {
     "database": "newdbone"
 }
 
+# MySQL 连接池与超时设置
+MYSQL_POOL_CONFIG = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,          # 等待空闲连接的秒数
+    "pool_recycle": 3600,        # 小于 MySQL wait_timeout，避免使用已被服务端关闭的连接
+    "pool_pre_ping": True,
+    "connect_timeout": 10,
+    "query_timeout_ms": 120000   # 单条 SELECT 的最长执行时间（MAX_EXECUTION_TIME），0 表示不限制
+}
+
+# 查询结果的流式读取与上限，防止超大结果集撑爆内存
+QUERY_LIMITS_CONFIG = {
+    "chunk_size": 5000,
+    "max_rows": 500000,
+    "max_bytes": 512 * 1024 * 1024,
+    "preview_rows": 1000
+}
+
+# 查询结果缓存：kpibase 有新数据入库（最大开始时间变化）时自动失效
+RESULT_CACHE_CONFIG = {
+    "enabled": True,
+    "path": "./result_cache.sqlite3",
+    "ttl_seconds": 6 * 3600,
+    "max_bytes": 1024 * 1024 * 1024,
+    "freshness_sql": "SELECT MAX(`开始时间`) FROM kpibase",
+    "freshness_check_interval": 60
+}
+
+# LLM 生成的作图代码在预启动的子进程池中执行：单次作图的墙钟超时（秒）、CPU 时间（秒）与内存上限（MB），
+# 超时或崩溃的进程会被终止并重新启动；enabled 为 False 时在当前进程内执行（无隔离）
+PLOT_SANDBOX_CONFIG = {
+    "enabled": True,
+    "workers": 2,
+    "timeout_seconds": 15,
+    "cpu_seconds": 15,
+    "memory_mb": 2048,
+    "startup_timeout_seconds": 30,
+    "start_method": "spawn",
+    "max_syntax_fixes": 3
+}
+
+# 已渲染图表缓存：键为 (作图代码哈希, 数据指纹)，超过 max_bytes 时按 LRU 淘汰；
+# sample_rows 为计算数据指纹时抽样的行数
+CHART_CACHE_CONFIG = {
+    "enabled": True,
+    "max_bytes": 64 * 1024 * 1024,
+    "sample_rows": 1000
+}
+
+# 时间序列图表降采样：超过 max_points 个点时按序列选点（method: minmaxlttb / lttb / minmax），
+# minmax_ratio 为 minmaxlttb 预选点数相对预算的倍数
+DOWNSAMPLE_CONFIG = {
+    "enabled": True,
+    "max_points": 2000,
+    "method": "minmaxlttb",
+    "minmax_ratio": 4
+}
+
+# 智能分析报告的预分析摘要：维度列、文本列词表的 top_k、转换为 category 的基数上限、摘要中列出的分组数上限
+ANALYSIS_CONFIG = {
+    "dimension_cols": ['开始时间', '省份', '地市', '区县', '乡镇', '村区', 'station_name', 'cell_name', 'frequency_band'],
+    "top_k": 10,
+    "max_cardinality": 5000,
+    "max_group_rows": 200
+}
+
+# SQL执行前的代价检查：先 EXPLAIN FORMAT=JSON 估算扫描行数，对 guarded_tables 的全表扫描（且未按 time_column 过滤）
+# 或预计扫描行数超过 max_rows_examined 的语句，按 action 处理：
+#   rewrite    自动注入最近 default_window_days 天的时间窗口（kpibase 在 LEFT JOIN 一侧时加在 ON 条件中），
+#              kpibase 全表扫描时另加 LIMIT default_limit，重新估算仍超限则拒绝
+#   regenerate 带上原因让 LLM 重新生成（最多 max_regenerations 次），仍不达标时按 rewrite 处理
+#   reject     直接拒绝执行
+# 无法获取执行计划时（如非 MySQL 数据源）不拦截
+SQL_GUARD_CONFIG = {
+    "enabled": True,
+    "guarded_tables": ["kpibase"],
+    "time_column": "开始时间",
+    "max_rows_examined": 20_000_000,
+    "action": "rewrite",
+    "default_window_days": 7,
+    "default_limit": 100000,
+    "max_regenerations": 1
+}
+
 CHROMA_DB_PATH = "./chroma_db"
+# 训练清单与向量库放在同一目录，清空向量库时一并删除
+TRAINING_MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, "training_manifest.json")
 
 
@@ -0,0 +1,176 @@
+"""
+查询结果的预分析摘要（智能分析报告的输入）：
+- 维度列按基数上限转换为 category 类型，分组时只需一次编码
+- 一次分组聚合同时得到各组的 mean/std/min/max/count（组号一次排序得出，统计量用 bincount/reduceat），
+  整体统计由完整的指标列计算（维度为空值的行不参与分组，但计入整体）
+- 文本列用 value_counts 取出现最多的 top-k 个取值，不再对每列做 unique()
+"""
+import numpy as np
+import pandas as pd
+from config.settings import ANALYSIS_CONFIG
+
+STATS = ["mean", "std", "min", "max", "count"]
+
+
+def to_categorical(df, columns, max_cardinality=None):
+    """
+    将文本类型的维度列转换为 category；取值个数超过 max_cardinality 的列保持原样
+    （高基数列转换收益小，且类别表本身占用内存）。返回转换后的新数据框，原数据框不变。
+    """
+    max_cardinality = max_cardinality or ANALYSIS_CONFIG.get("max_cardinality", 5000)
+    converted = {}
+    for col in columns:
+        series = df[col]
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+        categorical = series.astype("category")
+        if len(categorical.cat.categories) <= max_cardinality:
+            converted[col] = categorical
+    return df.assign(**converted) if converted else df
+
+
+def _group_ids(frame, dims):
+    """
+    各维度分别编码后按混合进制合成一个整数键，一次排序得到每行的组号。
+    返回 (组号, 行掩码, 分组索引, 按组排序的行顺序, 各组起始位置)，组的顺序与 groupby(sort=True) 一致；
+    组合键可能溢出时返回 None。
+    """
+    codes, uniques = [], []
+    for col in dims:
+        col_codes, col_uniques = pd.factorize(frame[col], sort=True)
+        codes.append(col_codes)
+        uniques.append(col_uniques)
+    sizes = [max(len(u), 1) for u in uniques]
+    if np.prod([float(n) for n in sizes]) >= 2 ** 62:
+        return None
+
+    # 任一维度为空值的行不参与分组（与 groupby 默认的 dropna=True 一致）
+    mask = np.ones(len(frame), dtype=bool)
+    for col_codes in codes:
+        mask &= col_codes >= 0
+    combined = np.zeros(int(mask.sum()), dtype=np.int64)
+    for col_codes, n in zip(codes, sizes):
+        combined = combined * n + col_codes[mask]
+
+    order = np.argsort(combined, kind="stable")
+    sorted_keys = combined[order]
+    is_start = np.empty(len(sorted_keys), dtype=bool)
+    is_start[:1] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=is_start[1:])
+    ids = np.empty(len(combined), dtype=np.int64)
+    ids[order] = np.cumsum(is_start) - 1
+
+    # 组合键按进制拆回各维度的编码，构造分组索引
+    remaining = sorted_keys[is_start]
+    level_codes = []
+    for n in reversed(sizes):
+        level_codes.append(remaining % n)
+        remaining = remaining // n
+    level_codes.reverse()
+    if len(dims) == 1:
+        index = pd.Index(uniques[0].take(level_codes[0]), name=dims[0])
+    else:
+        index = pd.MultiIndex(levels=uniques, codes=level_codes, names=dims)
+    return ids, mask, index, order, np.flatnonzero(is_start)
+
+
+def grouped_stats(frame, dims, metrics):
+    """
+    按维度分组一次计算各指标的 mean/std/min/max/count（bincount 与 reduceat，均为向量化运算），
+    结果与 frame.groupby(dims, observed=True)[metrics].agg(STATS) 相同（count 为浮点数）。
+    """
+    grouping = _group_ids(frame, dims)
+    if grouping is None:
+        return frame.groupby(dims, observed=True, sort=True)[metrics].agg(STATS)
+    ids, mask, index, order, starts = grouping
+    n_groups = len(index)
+
+    # 结果直接写入一块连续内存，构造 DataFrame 时不再合并、复制各列
+    data = np.empty((len(metrics) * len(STATS), n_groups), dtype=np.float64)
+    for i, metric in enumerate(metrics):
+        mean, std, minimum, maximum, count = data[i * len(STATS):(i + 1) * len(STATS)]
+        values = frame[metric].to_numpy(dtype=np.float64, na_value=np.nan)[mask]
+        valid = ~np.isnan(values)
+        valid_ids = ids[valid]
+        count[:] = np.bincount(valid_ids, minlength=n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean[:] = np.bincount(valid_ids, weights=values[valid], minlength=n_groups) / count
+            deviation = values[valid] - mean[valid_ids]
+            std[:] = np.sqrt(np.bincount(valid_ids, weights=deviation * deviation, minlength=n_groups) / (count - 1))
+        std[count < 2] = np.nan
+        if n_groups:
+            # fmin/fmax 忽略空值，组内全为空值时结果为空值
+            sorted_values = values[order]
+            minimum[:] = np.fmin.reduceat(sorted_values, starts)
+            maximum[:] = np.fmax.reduceat(sorted_values, starts)
+    columns = pd.MultiIndex.from_product([metrics, STATS])
+    return pd.DataFrame(data.T, index=index, columns=columns, copy=False)
+
+
+def summarize_frame(df, dimension_cols=None, top_k=None, max_cardinality=None):
+    """
+    计算预分析摘要，返回:
+    {
+        "dimensions": 存在的维度列, "metrics": 数值指标列,
+        "grouped": 按维度分组的统计（列为 (指标, 统计量) 的 MultiIndex；没有维度或指标时为 None）,
+        "overall": 各指标的整体 mean/std/min/max/count/cv,
+        "categories": {文本列: {"top": 出现最多的取值及次数, "nunique": 取值个数}}
+    }
+    """
+    dimension_cols = dimension_cols or ANALYSIS_CONFIG.get("dimension_cols", [])
+    top_k = top_k or ANALYSIS_CONFIG.get("top_k", 10)
+    dims = [col for col in dimension_cols if col in df.columns]
+    metrics = [col for col in df.select_dtypes(include=np.number).columns if col not in dims]
+    frame = to_categorical(df, dims, max_cardinality)
+
+    grouped = None
+    if dims and metrics:
+        grouped = grouped_stats(frame, dims, metrics)
+    # 整体统计直接由完整的指标列计算：维度列为空值的行不参与分组，但仍计入整体
+    if metrics:
+        overall = frame[metrics].agg(STATS).T
+    else:
+        overall = pd.DataFrame(columns=STATS)
+    if len(overall):
+        overall["cv"] = (overall["std"].astype(float) / overall["mean"].astype(float)).abs()
+
+    categories = {}
+    for col in frame.select_dtypes(include=['object', 'category', 'string']).columns:
+        counts = frame[col].value_counts(sort=True)
+        categories[col] = {"top": counts.head(top_k), "nunique": len(counts)}
+
+    return {"dimensions": dims, "metrics": metrics, "grouped": grouped, "overall": overall,
+            "categories": categories}
+
+
+def format_pre_analysis(summary, max_group_rows=None):
+    """生成提交给 LLM 的预分析摘要文本；分组较多时只列出前 max_group_rows 组"""
+    if summary["grouped"] is None:
+        return ""
+    max_group_rows = max_group_rows or ANALYSIS_CONFIG.get("max_group_rows", 200)
+    grouped = summary["grouped"]
+    means = grouped.xs("mean", axis=1, level=1).head(max_group_rows).round(4)
+    group_note = f"\n(共 {len(grouped)} 组，仅列出前 {max_group_rows} 组)" if len(grouped) > max_group_rows else ""
+    overall = summary["overall"]
+    return f"""
+**Pre-computed Analysis Summary:**
+1. Grouped Averages:
+{means.to_string()}{group_note}
+2. Overall Averages (for baseline comparison):
+{overall["mean"].astype(float).round(4).to_string()}
+3. Coefficient of Variation (Volatility, for metric selection):
+{overall["cv"].round(4).to_string()}
+4. Overall Statistics (std / min / max / count):
+{overall[["std", "min", "max", "count"]].astype(float).round(4).to_string()}
+"""
+
+
+def format_categorical_vocabulary(summary):
+    """文本列的取值词表（按出现次数取前 top_k 个）"""
+    lines = []
+    for col, info in summary["categories"].items():
+        values = list(info["top"].index)
+        if info["nunique"] > len(values):
+            values.append(f"... (共 {info['nunique']} 个取值)")
+        lines.append(f"- Column '{col}' contains: {values}\n")
+    return "".join(lines)
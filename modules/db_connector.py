@@ -1,6 +1,20 @@
+import re
+import json
+import time
+import threading
 import pandas as pd
-from sqlalchemy import create_engine
-from config.settings import MYSQL_CONFIG
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError, OperationalError
+from config.settings import MYSQL_CONFIG, MYSQL_POOL_CONFIG, QUERY_LIMITS_CONFIG, RESULT_CACHE_CONFIG
+from modules.result_cache import QueryResultCache
+
+# MySQL 语句超过 max_execution_time 被中断时的错误码
+ER_QUERY_TIMEOUT = 3024
+
+
+class QueryTimeoutError(Exception):
+    """查询超过执行时间上限被服务端中断"""
+
 
 class MySQLConnector:
     def __init__(self):
@@ -11,66 +25,328 @@ class MySQLConnector:
             f"@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}"
         )
         
+        self.query_timeout_ms = MYSQL_POOL_CONFIG.get("query_timeout_ms", 0)
+        self.max_connections = MYSQL_POOL_CONFIG.get("pool_size", 5) + max(MYSQL_POOL_CONFIG.get("max_overflow", 10), 0)
+        connect_args = {"connect_timeout": MYSQL_POOL_CONFIG.get("connect_timeout", 10)}
+        if self.query_timeout_ms:
+            # 客户端读超时作为兜底，略大于服务端的执行时间上限
+            connect_args["read_timeout"] = self.query_timeout_ms // 1000 + 30
+
         # 创建 SQLAlchemy 引擎
-        self.engine = create_engine(db_uri)
+        self.engine = create_engine(
+            db_uri,
+            pool_size=MYSQL_POOL_CONFIG.get("pool_size", 5),
+            max_overflow=MYSQL_POOL_CONFIG.get("max_overflow", 10),
+            pool_timeout=MYSQL_POOL_CONFIG.get("pool_timeout", 30),
+            pool_recycle=MYSQL_POOL_CONFIG.get("pool_recycle", 3600),
+            pool_pre_ping=MYSQL_POOL_CONFIG.get("pool_pre_ping", True),
+            connect_args=connect_args
+        )
+
+        # 连接池统计
+        self._stats_lock = threading.Lock()
+        self._pool_stats = {
+            "connects": 0, "checkouts": 0, "waits": 0, "wait_seconds": 0.0,
+            "pool_timeouts": 0, "query_timeouts": 0
+        }
+        event.listen(self.engine, "connect", self._on_connect)
+        event.listen(self.engine, "checkout", self._on_checkout)
         
         # 不再需要 self.conn
         # self.conn = pymysql.connect(...)
 
-    def execute_query(self, sql, params=None):
-        # 使用 SQLAlchemy 引擎执行查询，这是 Pandas 推荐的方式
-        # 警告会消失
-        df = pd.read_sql(sql, self.engine, params=params)
+        # 表结构缓存: {表名: (指纹, 结构信息)}
+        self._schema_cache = {}
+
+        # 查询结果缓存
+        self.result_cache = None
+        self._freshness = (None, 0.0)
+        if RESULT_CACHE_CONFIG.get("enabled"):
+            try:
+                self.result_cache = QueryResultCache(
+                    RESULT_CACHE_CONFIG["path"],
+                    ttl_seconds=RESULT_CACHE_CONFIG.get("ttl_seconds", 3600),
+                    max_bytes=RESULT_CACHE_CONFIG.get("max_bytes", 1024 * 1024 * 1024)
+                )
+            except Exception as e:
+                print(f"查询结果缓存初始化失败，将不使用缓存: {e}")
+
+    def _on_connect(self, dbapi_conn, connection_record):
+        """新建物理连接时设置会话级的执行时间上限"""
+        self._count("connects")
+        if self.query_timeout_ms:
+            cursor = dbapi_conn.cursor()
+            try:
+                cursor.execute(f"SET SESSION max_execution_time = {int(self.query_timeout_ms)}")
+            finally:
+                cursor.close()
+
+    def _on_checkout(self, dbapi_conn, connection_record, connection_proxy):
+        self._count("checkouts")
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._pool_stats[key] += value
+
+    @staticmethod
+    def _apply_timeout_hint(sql, timeout_ms):
+        """为单条 SELECT 注入 MAX_EXECUTION_TIME 优化器提示，覆盖会话默认值"""
+        if not timeout_ms:
+            return sql
+        return re.sub(r'^(\s*SELECT)\b', rf'\1 /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */', sql,
+                      count=1, flags=re.IGNORECASE)
+
+    def _connect(self):
+        """从连接池取连接，并记录等待情况"""
+        saturated = self.engine.pool.checkedout() >= self.max_connections
+        start = time.perf_counter()
+        try:
+            conn = self.engine.connect()
+        except PoolTimeoutError:
+            self._count("pool_timeouts")
+            raise
+        if saturated:
+            self._count("waits")
+            self._count("wait_seconds", time.perf_counter() - start)
+        return conn
+
+    def _raise_if_timeout(self, error):
+        orig = getattr(error, "orig", None)
+        if orig is not None and getattr(orig, "args", None) and orig.args[0] == ER_QUERY_TIMEOUT:
+            self._count("query_timeouts")
+            raise QueryTimeoutError(f"查询超过执行时间上限被中断: {orig.args[1] if len(orig.args) > 1 else orig}") from error
+
+    def execute_query(self, sql, params=None, timeout_ms=None, stream=False, use_cache=False):
+        """
+        执行查询并返回 DataFrame。
+        timeout_ms: 单条语句的执行时间上限（毫秒），不传则使用连接池配置的会话默认值。
+        stream: 为 True 时使用服务端游标分块读取，并受行数/字节上限约束，
+                超出上限时 df.attrs["truncated"] 为 True。
+        use_cache: 是否使用查询结果缓存（仅用于业务查询，元数据查询不要开启）。
+        """
+        if stream:
+            return self.concat_chunks(self.iter_query(sql, params=params, timeout_ms=timeout_ms, use_cache=use_cache))
+
+        if use_cache and self.result_cache is not None:
+            freshness = self._data_freshness()
+            cached = self.result_cache.get(sql, params, freshness)
+            if cached is not None:
+                return cached
+            df = self.execute_query(sql, params=params, timeout_ms=timeout_ms)
+            self._store_result(sql, params, freshness, df)
+            return df
+
+        sql = self._apply_timeout_hint(sql, timeout_ms)
+        try:
+            # 使用 SQLAlchemy 连接执行查询，这是 Pandas 推荐的方式
+            with self._connect() as conn:
+                df = pd.read_sql(sql, conn, params=params)
+        except OperationalError as e:
+            self._raise_if_timeout(e)
+            raise
+        return df
+
+    def _data_freshness(self):
+        """数据新鲜度标记（kpibase 最大开始时间），按配置的间隔缓存，避免每次查询都访问数据库"""
+        value, checked_at = self._freshness
+        now = time.time()
+        if now - checked_at < RESULT_CACHE_CONFIG.get("freshness_check_interval", 60):
+            return value
+        try:
+            df = self.execute_query(RESULT_CACHE_CONFIG["freshness_sql"])
+            value = str(df.iloc[0, 0]) if not df.empty else None
+        except Exception as e:
+            print(f"获取数据新鲜度失败，仅依赖TTL失效: {e}")
+            value = None
+        self._freshness = (value, now)
+        return value
+
+    def latest_data_time(self):
+        """kpibase 的最大开始时间（字符串，按新鲜度检查间隔缓存）；获取失败时为 None"""
+        return self._data_freshness()
+
+    def explain(self, sql, params=None, timeout_ms=None):
+        """返回 SELECT 语句的执行计划（EXPLAIN FORMAT=JSON 解析后的 dict），不实际执行查询"""
+        sql = sql.strip().rstrip(';')
+        df = self.execute_query(f"EXPLAIN FORMAT=JSON {sql}", params=params, timeout_ms=timeout_ms)
+        return json.loads(df.iloc[0, 0])
+
+    def _store_result(self, sql, params, freshness, df):
+        try:
+            self.result_cache.put(sql, df, params=params, freshness=freshness)
+        except Exception as e:
+            print(f"写入查询结果缓存失败: {e}")
+
+    def iter_query(self, sql, params=None, chunk_size=None, max_rows=None, max_bytes=None, timeout_ms=None,
+                   use_cache=False):
+        """
+        使用服务端游标（SSCursor）流式执行查询，逐块产出 DataFrame。
+        累计行数或内存占用达到上限时提前停止，最后一块的 attrs["truncated"] 为 True。
+        max_rows / max_bytes 不传时使用 QUERY_LIMITS_CONFIG，传 0 表示不限制。
+        use_cache 为 True 时先查结果缓存，命中则一次性产出缓存结果；完整读取后写入缓存
+        （被上限截断的结果不写入：缓存键不含上限，否则之后不限制或上限更大的查询会拿到不完整的结果）。
+        """
+        if not (use_cache and self.result_cache is not None):
+            yield from self._stream_query(sql, params, chunk_size, max_rows, max_bytes, timeout_ms)
+            return
+
+        freshness = self._data_freshness()
+        cached = self.result_cache.get(sql, params, freshness)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        for chunk in self._stream_query(sql, params, chunk_size, max_rows, max_bytes, timeout_ms):
+            chunks.append(chunk)
+            yield chunk
+        if any(chunk.attrs.get("truncated") for chunk in chunks):
+            return
+        self._store_result(sql, params, freshness, self.concat_chunks(chunks))
+
+    def _stream_query(self, sql, params, chunk_size, max_rows, max_bytes, timeout_ms):
+        chunk_size = chunk_size or QUERY_LIMITS_CONFIG["chunk_size"]
+        # 上限为 0 表示不限制；未传时使用配置值
+        if max_rows is None:
+            max_rows = QUERY_LIMITS_CONFIG["max_rows"]
+        if max_bytes is None:
+            max_bytes = QUERY_LIMITS_CONFIG["max_bytes"]
+        sql = self._apply_timeout_hint(sql, timeout_ms)
+
+        total_rows = 0
+        total_bytes = 0
+        try:
+            with self._connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                for chunk in pd.read_sql(sql, conn, params=params, chunksize=chunk_size):
+                    truncated = bool(max_rows) and len(chunk) > max_rows - total_rows
+                    if truncated:
+                        chunk = chunk.iloc[:max_rows - total_rows]
+                    total_rows += len(chunk)
+                    total_bytes += int(chunk.memory_usage(deep=True).sum())
+                    if max_bytes and total_bytes >= max_bytes:
+                        truncated = True
+                    chunk.attrs["truncated"] = truncated
+                    if truncated:
+                        print(f"查询结果超过上限，已截断: {total_rows} 行, {total_bytes / 1024 / 1024:.1f} MB")
+                        # 未读完的服务端游标在关闭时会把剩余结果全部读完，直接作废连接以立即停止
+                        conn.invalidate()
+                        yield chunk
+                        return
+                    yield chunk
+        except OperationalError as e:
+            self._raise_if_timeout(e)
+            raise
+
+    @staticmethod
+    def concat_chunks(chunks):
+        """合并 iter_query 产出的分块，保留截断标记"""
+        chunks = list(chunks)
+        if not chunks:
+            return pd.DataFrame()
+        df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+        df.attrs["truncated"] = any(chunk.attrs.get("truncated") for chunk in chunks)
         return df
+
+    def get_pool_status(self):
+        """连接池状态与统计（用于监控）"""
+        pool = self.engine.pool
+        with self._stats_lock:
+            stats = dict(self._pool_stats)
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin()
+        })
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        return stats
     
-    def get_schema_info(self):
-        """获取数据库的完整结构信息"""
-        # 获取所有表
+    def get_schema_info(self, refresh=False):
+        """
+        获取数据库的完整结构信息。
+        结果按表缓存，以 CREATE_TIME/UPDATE_TIME 作为指纹，再次调用时只重新读取发生变化的表。
+        """
+        if refresh:
+            self._schema_cache.clear()
+
+        # 获取所有表及其指纹
         tables_query = """
-        SELECT TABLE_NAME, TABLE_COMMENT 
+        SELECT TABLE_NAME, TABLE_COMMENT, CREATE_TIME, UPDATE_TIME
         FROM information_schema.TABLES 
         WHERE TABLE_SCHEMA = %(db_name)s
         """
-        tables_df = self.execute_query(tables_query, params={"db_name": MYSQL_CONFIG["database"]})
-        
-        schema_info = []
-        for _, table in tables_df.iterrows():
-            table_name = table['TABLE_NAME']
-            table_comment = table['TABLE_COMMENT'] or ''
-            
-            # 获取表的列信息
-            columns_query = """
-            SELECT COLUMN_NAME, DATA_TYPE, COLUMN_COMMENT 
-            FROM information_schema.COLUMNS 
-            WHERE TABLE_SCHEMA = %(db_name)s AND TABLE_NAME = %(tbl_name)s
-            ORDER BY ORDINAL_POSITION
-            """
-            columns_df = self.execute_query(
-                columns_query, 
-                params={"db_name": MYSQL_CONFIG["database"], "tbl_name": table_name}
+        tables = self.execute_query(tables_query, params={"db_name": MYSQL_CONFIG["database"]}).to_dict('records')
+
+        fingerprints = {}
+        for table in tables:
+            fingerprints[table['TABLE_NAME']] = (
+                f"{table['CREATE_TIME']}|{table['UPDATE_TIME']}|{table['TABLE_COMMENT'] or ''}"
             )
-            
-            # 构建DDL语句
-            ddl = f"CREATE TABLE `{table_name}` ("
-            column_defs = []
-            for _, col in columns_df.iterrows():
-                col_def = f"`{col['COLUMN_NAME']}` {col['DATA_TYPE']}"
-                if col['COLUMN_COMMENT']:
-                    col_def += f" COMMENT '{col['COLUMN_COMMENT']}'"
-                column_defs.append(col_def)
-            
-            ddl += ", ".join(column_defs) + ")"
-            if table_comment:
-                ddl += f" COMMENT='{table_comment}'"
-            
-            schema_info.append({
-                "table_name": table_name,
-                "table_comment": table_comment,
-                "ddl": ddl,
-                "columns": columns_df.to_dict('records')
-            })
-        
-        return schema_info
+
+        changed = [name for name, fp in fingerprints.items()
+                   if self._schema_cache.get(name, (None, None))[0] != fp]
+        if changed:
+            columns_by_table = self._fetch_columns(changed, all_tables=len(changed) == len(fingerprints))
+            for table in tables:
+                table_name = table['TABLE_NAME']
+                if table_name not in changed:
+                    continue
+                table_comment = table['TABLE_COMMENT'] or ''
+                columns = columns_by_table.get(table_name, [])
+                self._schema_cache[table_name] = (
+                    fingerprints[table_name],
+                    {
+                        "table_name": table_name,
+                        "table_comment": table_comment,
+                        "ddl": self._build_ddl(table_name, table_comment, columns),
+                        "columns": columns
+                    }
+                )
+
+        # 清理已删除的表
+        for table_name in list(self._schema_cache):
+            if table_name not in fingerprints:
+                del self._schema_cache[table_name]
+
+        return [self._schema_cache[table['TABLE_NAME']][1] for table in tables]
+
+    def _fetch_columns(self, table_names, all_tables=False):
+        """一次查询取回多张表的列信息，并在内存中按表分组"""
+        params = {"db_name": MYSQL_CONFIG["database"]}
+        table_filter = ""
+        if not all_tables:
+            placeholders = []
+            for i, table_name in enumerate(table_names):
+                params[f"tbl_{i}"] = table_name
+                placeholders.append(f"%(tbl_{i})s")
+            table_filter = f"AND TABLE_NAME IN ({', '.join(placeholders)})"
+
+        columns_query = f"""
+        SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_COMMENT 
+        FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = %(db_name)s {table_filter}
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """
+        columns_by_table = {}
+        for col in self.execute_query(columns_query, params=params).to_dict('records'):
+            table_name = col.pop('TABLE_NAME')
+            columns_by_table.setdefault(table_name, []).append(col)
+        return columns_by_table
+
+    @staticmethod
+    def _build_ddl(table_name, table_comment, columns):
+        """构建DDL语句"""
+        column_defs = []
+        for col in columns:
+            col_def = f"`{col['COLUMN_NAME']}` {col['DATA_TYPE']}"
+            if col['COLUMN_COMMENT']:
+                col_def += f" COMMENT '{col['COLUMN_COMMENT']}'"
+            column_defs.append(col_def)
+
+        ddl = f"CREATE TABLE `{table_name}` (" + ", ".join(column_defs) + ")"
+        if table_comment:
+            ddl += f" COMMENT='{table_comment}'"
+        return ddl
     
     def get_sample_data(self, table_name, limit=5):
         """获取表的样例数据"""
@@ -0,0 +1,159 @@
+import sqlite3
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+class EmbeddingCache:
+    """
+    内容寻址的向量缓存：键为 (模型, 维度, 文本哈希)。
+    内存中维护一个 LRU 热区，磁盘上使用 SQLite 持久化，超过条数上限时按最近访问时间淘汰。
+    磁盘条数只在打开时 COUNT 一次，之后随写入、淘汰在内存中增减，写入时不再扫描全表。
+    """
+
+    def __init__(self, path, model, dimensions, memory_size=2048, max_entries=200000):
+        self.model = model
+        self.dimensions = dimensions
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self.conn.commit()
+        self._count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text):
+        raw = f"{self.model}\x00{self.dimensions}\x00{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts):
+        """批量查询，返回与输入等长的列表，未命中的位置为 None"""
+        keys = [self._key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[i] = self._memory[key]
+                    self.stats["memory_hits"] += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                found = {}
+                missing_keys = list(missing)
+                # SQLite 单条语句的参数个数有限，分批查询
+                for start in range(0, len(missing_keys), 500):
+                    chunk = missing_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self.conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+                now = time.time()
+                if found:
+                    self.conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+                    self.conn.commit()
+
+                for key, positions in missing.items():
+                    if key in found:
+                        self._remember(key, found[key])
+                        self.stats["disk_hits"] += len(positions)
+                        for i in positions:
+                            results[i] = found[key]
+                    else:
+                        self.stats["misses"] += len(positions)
+        return results
+
+    def get(self, text):
+        return self.get_many([text])[0]
+
+    def _existing_keys(self, keys):
+        """按主键查询已在磁盘上的键（分批，避免超出 SQLite 参数个数上限）"""
+        existing = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            existing.update(row[0] for row in self.conn.execute(
+                f"SELECT key FROM embeddings WHERE key IN ({placeholders})", chunk
+            ))
+        return existing
+
+    def put_many(self, texts, embeddings):
+        """写入缓存；全零向量代表嵌入失败，不写入"""
+        now = time.time()
+        rows = {}
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                if not embedding or not any(embedding):
+                    continue
+                key = self._key(text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector.tolist())
+                rows[key] = (key, vector.tobytes(), now)
+            if not rows:
+                return
+            new_count = len(rows) - len(self._existing_keys(list(rows)))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", list(rows.values())
+            )
+            self._count += new_count
+            self._evict()
+            self.conn.commit()
+
+    def put(self, text, embedding):
+        self.put_many([text], [embedding])
+
+    def _evict(self):
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            deleted = self.conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            ).rowcount
+            self._count -= deleted
+            self.stats["evictions"] += deleted
+
+    def get_stats(self):
+        """返回命中统计（用于调试）"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = self._count
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.commit()
+            self._count = 0
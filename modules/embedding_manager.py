@@ -1,6 +1,15 @@
 from openai import OpenAI
-from config.settings import EMBEDDING_CONFIG
+from config.settings import EMBEDDING_CONFIG, EMBEDDING_CACHE_CONFIG
+from modules.embedding_cache import EmbeddingCache
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import time
+from modules import tracing
+
+
+class EmbeddingError(Exception):
+    """嵌入服务调用失败（已重试）"""
+
 
 class QwenEmbedding:
     def __init__(self):
@@ -9,25 +18,107 @@ class QwenEmbedding:
             base_url=EMBEDDING_CONFIG['base_url']
         )
         self.model = EMBEDDING_CONFIG['model']
+        self.batch_size = EMBEDDING_CONFIG.get("batch_size", 10)
+        self.max_workers = EMBEDDING_CONFIG.get("max_workers", 4)
+        self.max_retries = EMBEDDING_CONFIG.get("max_retries", 3)
+        self.retry_backoff = EMBEDDING_CONFIG.get("retry_backoff", 1.0)
+        self.cache = None
+        if EMBEDDING_CACHE_CONFIG.get("enabled"):
+            try:
+                self.cache = EmbeddingCache(
+                    EMBEDDING_CACHE_CONFIG["path"],
+                    model=self.model,
+                    dimensions=EMBEDDING_CONFIG["dimensions"],
+                    memory_size=EMBEDDING_CACHE_CONFIG.get("memory_size", 2048),
+                    max_entries=EMBEDDING_CACHE_CONFIG.get("max_entries", 200000)
+                )
+            except Exception as e:
+                print(f"Embedding缓存初始化失败，将不使用缓存: {e}")
 
-    def embed(self, text):
-        try:
-            completion = self.client.embeddings.create(
-                model=self.model,
-                input=text,
-                dimensions=EMBEDDING_CONFIG["dimensions"],
-                encoding_format=EMBEDDING_CONFIG["encoding_format"]
-            )
-            embedding = completion.data[0].embedding
-            
+    def _request(self, inputs):
+        """调用嵌入接口，返回与输入顺序一致的向量列表"""
+        completion = self.client.embeddings.create(
+            model=self.model,
+            input=inputs,
+            dimensions=EMBEDDING_CONFIG["dimensions"],
+            encoding_format=EMBEDDING_CONFIG["encoding_format"]
+        )
+        # 接口返回的 data 带有 index，按 index 还原顺序
+        data = sorted(completion.data, key=lambda item: item.index)
+        embeddings = []
+        for item in data:
+            embedding = item.embedding
             # 确保返回的是列表格式
             if isinstance(embedding, np.ndarray):
                 embedding = embedding.tolist()
-            
-            return embedding
-            
+            embeddings.append(embedding)
+        return embeddings
+
+    def embed(self, text):
+        """生成单条向量；失败时抛出 EmbeddingError（不再返回零向量，避免污染检索和向量库）"""
+        span = tracing.current_span()
+        span.add("embedding.input_bytes", len(text.encode("utf-8")))
+        if self.cache is not None:
+            cached = self.cache.get(text)
+            if cached is not None:
+                span.set("embedding.cache_hit", True)
+                return cached
+        try:
+            embedding = self._request([text])[0]
         except Exception as e:
             print(f"Embedding生成失败: {e}")
-            # 返回一个默认向量（用于测试）
-            return [0.0] * EMBEDDING_CONFIG["dimensions"]
+            raise EmbeddingError(str(e)) from e
+        if self.cache is not None:
+            self.cache.put(text, embedding)
+        return embedding
+
+    def _embed_chunk(self, chunk):
+        """带重试地嵌入一个批次，最终失败时抛出 EmbeddingError"""
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                return self._request(chunk)
+            except Exception as e:
+                last_error = e
+                print(f"批量Embedding失败(第{attempt + 1}次): {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+        raise EmbeddingError(f"批量Embedding重试 {self.max_retries} 次后仍失败: {last_error}") from last_error
+
+    def embed_batch(self, texts):
+        """
+        批量生成向量：按接口上限切分批次，多个批次并发请求，返回顺序与输入一致。
+        任一批次重试后仍失败时抛出 EmbeddingError。
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        span = tracing.current_span()
+        span.add("embedding.texts", len(texts))
+        span.add("embedding.input_bytes", sum(len(text.encode("utf-8")) for text in texts))
+
+        if self.cache is not None:
+            embeddings = self.cache.get_many(texts)
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            span.add("embedding.cache_hits", len(texts) - len(missing))
+            if missing:
+                missing_texts = [texts[i] for i in missing]
+                fresh = self._embed_uncached(missing_texts)
+                self.cache.put_many(missing_texts, fresh)
+                for i, embedding in zip(missing, fresh):
+                    embeddings[i] = embedding
+            return embeddings
+        return self._embed_uncached(texts)
+
+    def _embed_uncached(self, texts):
+        chunks = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(chunks) == 1:
+            return self._embed_chunk(chunks[0])
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+            results = executor.map(self._embed_chunk, chunks)
 
+        embeddings = []
+        for chunk_embeddings in results:
+            embeddings.extend(chunk_embeddings)
+        return embeddings
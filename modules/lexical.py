@@ -0,0 +1,148 @@
+import re
+import math
+import heapq
+import threading
+from collections import Counter
+
+# 计数器ID（如 R1012_001、K1009_002）作为完整词元保留
+_COUNTER_PATTERN = re.compile(r'[KR]\d{4}_\d{3}', re.IGNORECASE)
+_TOKEN_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9_]*|\d+(?:\.\d+)?|[\u4e00-\u9fff]+')
+
+
+def tokenize(text):
+    """
+    面向中文业务文本的分词：
+    - 计数器ID 整体作为一个词元（统一为大写）
+    - 英文/数字按单词切分（小写）
+    - 连续中文取单字和相邻双字（bigram），无需外部分词词典
+    """
+    tokens = []
+    text = str(text or "")
+    for counter in _COUNTER_PATTERN.findall(text):
+        tokens.append(counter.upper())
+    text = _COUNTER_PATTERN.sub(" ", text)
+    for piece in _TOKEN_PATTERN.findall(text):
+        if '\u4e00' <= piece[0] <= '\u9fff':
+            tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece.lower())
+    return tokens
+
+
+def bm25_scores(query, documents, k1=1.5, b=0.75):
+    """在给定候选文档上计算 BM25 分数（IDF 基于候选集合），返回与 documents 对齐的分数列表"""
+    doc_tokens = [Counter(tokenize(doc)) for doc in documents]
+    if not doc_tokens:
+        return []
+    lengths = [sum(tokens.values()) for tokens in doc_tokens]
+    avg_len = sum(lengths) / len(lengths) or 1.0
+    n = len(documents)
+
+    scores = [0.0] * n
+    for term in set(tokenize(query)):
+        df = sum(1 for tokens in doc_tokens if term in tokens)
+        if df == 0:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for i, tokens in enumerate(doc_tokens):
+            tf = tokens.get(term)
+            if tf:
+                scores[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[i] / avg_len))
+    return scores
+
+
+class LexicalIndex:
+    """
+    内存倒排索引（BM25），与向量库的写入保持同步。
+    用于精确词元（指标名、计数器ID、地名）的召回，不依赖嵌入服务。
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}      # 词元 -> {文档ID: 词频}
+        self._lengths = {}       # 文档ID -> 文档长度
+        self._docs = {}          # 文档ID -> (文本, 元数据)
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, ids, texts, metadatas=None):
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            for doc_id, text, meta in zip(ids, texts, metadatas):
+                if doc_id in self._docs:
+                    self._remove(doc_id)
+                tokens = Counter(tokenize(text))
+                for term, tf in tokens.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+                length = sum(tokens.values())
+                self._lengths[doc_id] = length
+                self._total_length += length
+                self._docs[doc_id] = (text, meta or {})
+
+    def _remove(self, doc_id):
+        text, _ = self._docs.pop(doc_id)
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id, 0)
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._docs:
+                    self._remove(doc_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._docs.clear()
+            self._total_length = 0
+
+    def search(self, query, top_k=10, where=None):
+        """
+        BM25 检索，返回 [(文档ID, 文本, 元数据, 分数), ...]。
+        where: 可选的元数据等值过滤，如 {"type": "qa"}
+        """
+        with self._lock:
+            n = len(self._docs)
+            if n == 0:
+                return []
+            avg_len = self._total_length / n or 1.0
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            if where:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if all(self._docs[doc_id][1].get(k) == v for k, v in where.items())}
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [(doc_id, self._docs[doc_id][0], self._docs[doc_id][1], score) for doc_id, score in best]
+
+
+def reciprocal_rank_fusion(ranked_lists, top_k=10, k=60):
+    """
+    倒数排名融合（RRF）：ranked_lists 为若干个按相关性排好序的 [(文档ID, 文本, 元数据), ...]，
+    返回融合后的前 top_k 个 (文档ID, 文本, 元数据)。
+    """
+    fused = {}
+    items = {}
+    for ranked in ranked_lists:
+        for rank, (doc_id, text, meta) in enumerate(ranked):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+            items.setdefault(doc_id, (doc_id, text, meta))
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [items[doc_id] for doc_id in best]
@@ -1,5 +1,8 @@
+import time
 from openai import OpenAI
-from config.settings import LLM_CONFIG
+from config.settings import LLM_CONFIG, PROMPT_CONFIG
+from modules.report_stream import IncrementalReportParser
+from modules import tracing
 import os
 
 class ClaudeLLM:
@@ -7,6 +10,7 @@ class ClaudeLLM:
         self.client = OpenAI(
             api_key=LLM_CONFIG['api_key'],
             base_url=LLM_CONFIG['base_url'],
+            max_retries=LLM_CONFIG.get('max_retries', 0),
             default_headers={
                 "HTTP-Referer": "https://openrouter.ai/anthropic/claude-opus-4/api",
                 "X-Title": "NL2SQL RAG Demo",
@@ -14,26 +18,110 @@ class ClaudeLLM:
         )
         self.model = LLM_CONFIG['model']
 
+    @staticmethod
+    def _record_usage(span, usage):
+        """把接口返回的 token 用量（含命中提示词缓存的部分）记到追踪 span 上"""
+        if usage is None:
+            return
+        span.add("llm.prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        span.add("llm.completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+        if cached:
+            span.add("llm.cached_prompt_tokens", cached)
+
     def chat(self, messages, **kwargs):
+        with tracing.span("llm.chat", model=self.model) as span:
+            try:
+                completion = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **kwargs
+                )
+                content = completion.choices[0].message.content
+                self._record_usage(span, getattr(completion, "usage", None))
+                span.set("llm.response_bytes", len((content or "").encode("utf-8")))
+                return content
+            except Exception as e:
+                print(f"LLM调用失败: {e}")
+                raise e
+
+    def chat_stream(self, messages, **kwargs):
+        """流式调用，逐段产出增量文本"""
+        # 生成器会跨越调用方的多次迭代，span 不激活为当前 span，结束时显式关闭
+        span = tracing.start_span("llm.chat_stream", model=self.model)
+        first_token = True
+        response_bytes = 0
         try:
-            completion = self.client.chat.completions.create(
+            stream = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
                 **kwargs
             )
-            return completion.choices[0].message.content
+            for chunk in stream:
+                # 开启 include_usage 后，最后一个分块不含 choices，只携带 token 用量
+                self._record_usage(span, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token:
+                        span.set("llm.ttft_ms", round(span.duration_ms, 1))
+                        first_token = False
+                    response_bytes += len(delta.encode("utf-8"))
+                    yield delta
         except Exception as e:
-            print(f"LLM调用失败: {e}")
+            print(f"LLM流式调用失败: {e}")
+            span.end(error=e)
             raise e
+        finally:
+            span.set("llm.response_bytes", response_bytes)
+            span.end()
 
-    def generate_sql(self, system_prompt, user_question):
+    def _complete(self, messages, on_token=None, **kwargs):
+        """
+        on_token 为空时一次性返回完整结果；
+        否则流式调用，以当前累计文本回调 on_token，最终返回完整结果。
+        回调按 stream_callback_interval 节流（界面每次都重绘全文，逐段回调的开销随长度平方增长），
+        最后一次回调总是携带完整文本。
+        """
+        if on_token is None:
+            return self.chat(messages, **kwargs)
+        interval = LLM_CONFIG.get("stream_callback_interval", 0.05)
+        text = ""
+        last_emit = 0.0
+        emitted = True
+        for delta in self.chat_stream(messages, **kwargs):
+            text += delta
+            emitted = False
+            now = time.perf_counter()
+            if now - last_emit >= interval:
+                on_token(text)
+                last_emit, emitted = now, True
+        if not emitted:
+            on_token(text)
+        return text
+
+    def generate_sql(self, system_prompt, user_question, on_token=None, static_prefix=None):
+        """
+        static_prefix: 与问题无关的静态指令块，放在系统提示词最前面；
+        开启 prompt_cache 时标记 cache_control，使服务端（OpenRouter -> Anthropic）缓存该前缀。
+        """
+        system_content = system_prompt
+        if static_prefix:
+            prefix_block = {"type": "text", "text": static_prefix}
+            if PROMPT_CONFIG.get("prompt_cache"):
+                prefix_block["cache_control"] = {"type": "ephemeral"}
+            system_content = [prefix_block, {"type": "text", "text": system_prompt}]
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": system_content},
             {"role": "user", "content": user_question},
         ]
-        return self.chat(messages, temperature=0.1, max_tokens=2000)
+        return self._complete(messages, on_token=on_token, temperature=0.1, max_tokens=2000)
     
-    def refine_question(self, question, available_metrics=None):
+    def refine_question(self, question, available_metrics=None, on_token=None):
         """
         使用LLM解构并优化用户问题，识别维度和指标，并生成结构化的、对人和机器都友好的意图描述。
         """
@@ -96,12 +184,13 @@ You must follow this markdown format precisely.
         ]
         
         # 使用较低的 temperature 保证输出的稳定性和格式遵循度
-        return self.chat(messages, temperature=0.1, max_tokens=600)
+        return self._complete(messages, on_token=on_token, temperature=0.1, max_tokens=600)
 
     
-    def analyze_telecom_data(self, df_info, pre_analysis_summary, user_question, query_result_sample):
+    def analyze_telecom_data(self, df_info, pre_analysis_summary, user_question, query_result_sample, on_section=None):
         """
         根据高度智能化的四维分析框架，对通信数据进行结构化分析并生成可视化图表定义。
+        on_section: 流式模式回调 on_section(key, value)，每当报告中的一个顶层部分完整生成时调用。
         """
         system_prompt = """You are a world-class Chinese telecom network data analyst. Your task is to generate a highly insightful and structured analysis report based on the provided pre-computed summary.
 
@@ -159,8 +248,21 @@ Generate the structured analysis report in the specified JSON format."""
             {"role": "user", "content": user_prompt},
         ]
 
-        response = self.chat(messages, temperature=0.3, max_tokens=8000)
-
+        if on_section is None:
+            response = self.chat(messages, temperature=0.3, max_tokens=8000)
+        else:
+            parser = IncrementalReportParser()
+            parts = []
+            for delta in self.chat_stream(messages, temperature=0.3, max_tokens=8000):
+                parts.append(delta)
+                for key, value in parser.feed(delta):
+                    on_section(key, value)
+            response = "".join(parts)
+
+        return self._parse_report(response)
+
+    @staticmethod
+    def _parse_report(response):
         try:
             import json
             if "```json" in response:
@@ -0,0 +1,85 @@
+from collections import deque
+
+class MetricMatcher:
+    """
+    基于 Aho-Corasick 自动机的指标名匹配器。
+    初始化时一次性构建自动机，匹配时只需扫描问题一遍；
+    多个名称重叠时（如“数据业务流量”与“上行数据业务流量”）采用最左最长匹配。
+    """
+
+    def __init__(self, patterns):
+        """patterns: {匹配词: 对应值}，值一般为指标名称"""
+        self._goto = [{}]
+        self._fail = [0]
+        # 每个节点上以该节点结尾的匹配词 (长度, 值)，含失败链继承的输出
+        self._output = [[]]
+        for word, value in patterns.items():
+            if word:
+                self._insert(word, value)
+        self._build_fail_links()
+
+    @classmethod
+    def from_metrics(cls, metrics_definitions):
+        """由指标定义构建：指标名称及其 aliases 都映射到指标名称"""
+        patterns = {}
+        for name, definition in metrics_definitions.items():
+            patterns[name] = name
+            aliases = definition.get('aliases') or []
+            if isinstance(aliases, str):
+                aliases = [aliases]
+            for alias in aliases:
+                patterns.setdefault(str(alias), name)
+        return cls(patterns)
+
+    def _insert(self, word, value):
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append((len(word), value))
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find_all(self, text):
+        """返回所有（可能重叠的）匹配 [(起始位置, 结束位置, 值), ...]"""
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._output[node]:
+                matches.append((i - length + 1, i + 1, value))
+        return matches
+
+    def find(self, text):
+        """返回最左最长、互不重叠的匹配值列表（按出现顺序去重）"""
+        matches = sorted(self.find_all(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        result = []
+        seen = set()
+        last_end = 0
+        for start, end, value in matches:
+            if start < last_end:
+                continue
+            last_end = end
+            if value not in seen:
+                seen.add(value)
+                result.append(value)
+        return result
@@ -0,0 +1,75 @@
+import time
+import contextvars
+from modules import tracing
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+_RAISE = object()
+
+
+class StageTimeout(Exception):
+    """某个阶段超过了自身的超时时间或整体时间预算"""
+
+
+class StagePipeline:
+    """
+    在共享线程池上并发执行相互独立的阶段（如问题向量化、向量检索、指标解析）。
+    每个阶段有独立超时，整条流水线另有总时间预算；超时的阶段会被取消（尚未开始的直接取消，
+    已在运行的线程无法强制中断，结果将被丢弃），调用方可选择降级为默认值继续。
+    """
+
+    def __init__(self, executor, budget_seconds=None, stage_timeouts=None):
+        self.executor = executor
+        self.stage_timeouts = stage_timeouts or {}
+        self.deadline = time.perf_counter() + budget_seconds if budget_seconds else None
+        self.futures = {}
+        self.timings = {}
+
+    def _remaining(self, name):
+        # 分区阶段（如 "vector_search:qa"）沿用同类阶段的超时设置
+        timeout = self.stage_timeouts.get(name, self.stage_timeouts.get(name.split(":")[0]))
+        if self.deadline is not None:
+            remaining = max(self.deadline - time.perf_counter(), 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def _timed(self, name, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.span(name):
+                return fn(*args, **kwargs)
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def submit(self, name, fn, *args, **kwargs):
+        """提交一个阶段，立即返回；阶段在线程池中与调用方并发执行"""
+        # 复制当前上下文，使线程内也能访问调用方的上下文变量
+        context = contextvars.copy_context()
+        self.futures[name] = self.executor.submit(context.run, self._timed, name, fn, args, kwargs)
+        return self.futures[name]
+
+    def result(self, name, default=_RAISE):
+        """等待阶段结果；超时或失败时返回 default（未提供则抛出异常）"""
+        future = self.futures[name]
+        try:
+            return future.result(timeout=self._remaining(name))
+        except FuturesTimeoutError:
+            future.cancel()
+            message = f"阶段 {name} 超时"
+            if default is _RAISE:
+                raise StageTimeout(message)
+            print(f"[PIPELINE] {message}，降级继续")
+            return default
+        except Exception as e:
+            if default is _RAISE:
+                raise
+            print(f"[PIPELINE] 阶段 {name} 失败，降级继续: {e}")
+            return default
+
+    def run(self, name, fn, *args, default=_RAISE, **kwargs):
+        """提交并等待一个阶段"""
+        self.submit(name, fn, *args, **kwargs)
+        return self.result(name, default=default)
+
+    def cancel_pending(self):
+        for future in self.futures.values():
+            future.cancel()
@@ -0,0 +1,180 @@
+import re
+import math
+from config.settings import PROMPT_CONFIG
+
+_COUNTER_PATTERN = re.compile(r'[KR]\d{4}_\d{3}')
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+# DDL 中的单个列定义：`列名` 类型 [COMMENT '...']
+_COLUMN_PATTERN = re.compile(r"`([^`]+)`\s+\w+(?:\([^)]*\))?(?:\s+COMMENT\s+'(?:[^'\\]|\\.|'')*')?")
+
+# 静态指令块：与具体问题无关，每次请求逐字节相同，放在提示词最前面以便服务端前缀缓存命中
+STATIC_SQL_INSTRUCTIONS = """You are an expert MySQL SQL developer. Your task is to generate precise SQL queries from user questions.
+
+[Database Schema]
+- `btsbase` (alias b): Base station info (ID, station_name, 省份, 地市, frequency_band, etc.)
+- `kpibase` (alias k): KPI metrics (ID, 开始时间, R* and K* counters)
+- Join condition: `b.ID = k.ID`
+
+[SQL Generation Rules]
+1.  **Strict Formula Adherence**: If a metric is listed in [Available Metric Formulas], you **MUST** use the exact formula provided. Do not invent, simplify, or use any other field names.
+2.  **Field Validation**: All `k.` fields in the generated SQL must be from the official KPI counter list. Do not use any `k.` field not on this list.
+3.  **Aggregation First**: Always aggregate raw counters with `SUM()` before performing other operations.
+4.  **Identifier Quoting**: Enclose all Chinese identifiers in backticks (`` ` ``).
+5.  **GROUP BY Clause**: Must include all non-aggregated columns from the `SELECT` list.
+6.  **Numeric Precision**: Round all final calculated metrics to 2 decimal places using `ROUND(..., 2)`.
+7.  **Unit Conversion**: For traffic, use `/ 1e6` for GB. For rates, use `* 100` for percentage.
+8.  **No Frequency Band Grouping**: Do not group by `b.frequency_band` unless explicitly asked.
+
+[Output Requirements]
+Return only the raw SQL query text. No explanations or markdown.
+"""
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文字符按 1 个 token，其余字符按 4 个字符 1 个 token"""
+    text = text or ""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text, budget):
+    """按估算 token 数截断文本"""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "..."
+
+
+def referenced_counters(formulas):
+    """提取公式中引用的计数器字段"""
+    counters = set()
+    for formula in formulas:
+        counters.update(_COUNTER_PATTERN.findall(formula or ""))
+    return counters
+
+
+def _column_list_bounds(ddl):
+    """
+    返回列定义部分的左右括号位置 (start, end)：跳过引号（'、"、`）内的内容并按深度匹配括号，
+    表级 COMMENT='...(...)' 等列定义之后的内容不会被误认为列定义；找不到时返回 None
+    """
+    start, depth, quote = -1, 0, None
+    i = 0
+    while i < len(ddl):
+        ch = ddl[i]
+        if quote is not None:
+            if ch == "\\" and quote != "`":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in ("'", '"', "`"):
+            quote = ch
+        elif ch == "(":
+            if depth == 0 and start < 0:
+                start = i
+            depth += 1
+        elif ch == ")" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return start, i
+        i += 1
+    return None
+
+
+def prune_ddl(ddl, keep_counters):
+    """
+    精简DDL：保留所有非计数器列，计数器列只保留 keep_counters 中的，
+    被省略的计数器数量以注释形式说明。keep_counters 为空时原样返回。
+    """
+    if not keep_counters:
+        return ddl
+    bounds = _column_list_bounds(ddl)
+    if bounds is None:
+        return ddl
+    start, end = bounds
+    kept, dropped = [], 0
+    for match in _COLUMN_PATTERN.finditer(ddl[start + 1:end]):
+        name = match.group(1)
+        if _COUNTER_PATTERN.fullmatch(name) and name not in keep_counters:
+            dropped += 1
+            continue
+        kept.append(match.group(0))
+    if not dropped:
+        return ddl
+    note = f" /* 省略 {dropped} 个与本问题无关的计数器列 */"
+    return ddl[:start + 1] + ", ".join(kept) + note + ddl[end:]
+
+
+class SQLPromptBuilder:
+    """
+    按 token 预算组装SQL生成提示词。
+    静态指令块固定在最前；指标公式、检索上下文、SQL示例各有独立预算，按相关性顺序填充，
+    超出预算的条目被截断或丢弃；表结构只保留命中公式所引用的计数器列。
+    """
+
+    def __init__(self, budgets=None):
+        self.budgets = dict(PROMPT_CONFIG.get("budgets", {}))
+        self.budgets.update(budgets or {})
+
+    def _fill(self, section, items):
+        """在预算内依次放入条目；放不下的第一条按剩余预算截断，其后的全部丢弃"""
+        budget = self.budgets.get(section)
+        if budget is None:
+            return list(items), sum(estimate_tokens(item) for item in items)
+        taken, used = [], 0
+        for item in items:
+            cost = estimate_tokens(item)
+            if used + cost <= budget:
+                taken.append(item)
+                used += cost
+                continue
+            remaining = budget - used
+            if remaining >= PROMPT_CONFIG.get("min_truncated_tokens", 50):
+                item = truncate_to_tokens(item, remaining)
+                taken.append(item)
+                used += estimate_tokens(item)
+            break
+        return taken, used
+
+    def build(self, structured_question, metric_formulas, context_parts, sql_examples):
+        """
+        返回 {"static": 静态指令块, "dynamic": 与问题相关的部分, "tokens": 各部分估算 token 数}。
+        context_parts 中以 "表结构:" 开头的条目会按公式引用的计数器精简列。
+        """
+        counters = referenced_counters(metric_formulas)
+        context_parts = [prune_ddl(part, counters) if part.startswith("表结构:") else part
+                         for part in context_parts]
+
+        formulas, formula_tokens = self._fill("formulas", metric_formulas)
+        context, context_tokens = self._fill("context", context_parts)
+        examples, example_tokens = self._fill("examples", sql_examples)
+
+        dynamic = f"""
+[Available Metric Formulas]
+# THIS IS THE GROUND TRUTH. YOU MUST USE THESE FORMULAS EXACTLY AS PROVIDED.
+{chr(10).join(formulas) if formulas else "No specific formulas found for this query. Rely on your general knowledge and provided context."}
+
+[Context Information]
+{chr(10).join(context) if context else "No specific context available"}
+
+[SQL Examples]
+{chr(10).join(examples) if examples else "No examples available"}
+
+# User's structured intent (You must generate SQL based on this):
+{structured_question}
+"""
+        static_tokens = estimate_tokens(STATIC_SQL_INSTRUCTIONS)
+        tokens = {
+            "static": static_tokens,
+            "formulas": formula_tokens,
+            "context": context_tokens,
+            "examples": example_tokens,
+            "total": static_tokens + estimate_tokens(dynamic)
+        }
+        return {"static": STATIC_SQL_INSTRUCTIONS, "dynamic": dynamic, "tokens": tokens}
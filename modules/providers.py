@@ -0,0 +1,254 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import numpy as np
+from config.settings import PROVIDER_CONFIG, EMBEDDING_CONFIG
+from modules.llm_manager import ClaudeLLM
+from modules.embedding_manager import QwenEmbedding
+from modules.rerank_manager import QwenReranker
+from modules.lexical import tokenize, bm25_scores
+from modules.prompt_builder import estimate_tokens
+from modules import tracing
+
+
+class ProviderError(Exception):
+    """本地替身按配置的错误率模拟出的服务端错误；status_code 为 429 时模拟限流"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LatencyModel:
+    """
+    可配置的延迟分布（秒）：
+    - fixed:     固定 median_ms
+    - uniform:   [low_ms, high_ms] 均匀分布
+    - lognormal: 中位数 median_ms、对数标准差 sigma 的长尾分布，接近真实接口的延迟形态
+    """
+
+    def __init__(self, distribution="fixed", median_ms=0.0, sigma=0.5, low_ms=0.0, high_ms=0.0, seed=None):
+        self.distribution = distribution
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.low_ms = low_ms
+        self.high_ms = high_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, seed=None):
+        return cls(seed=seed, **(config or {}))
+
+    def sample(self):
+        with self._lock:
+            if self.distribution == "uniform":
+                value = self._rng.uniform(self.low_ms, self.high_ms)
+            elif self.distribution == "lognormal":
+                value = self.median_ms * self._rng.lognormvariate(0, self.sigma) if self.median_ms else 0.0
+            else:
+                value = self.median_ms
+        return value / 1000.0
+
+
+class _FaultInjector:
+    """按延迟分布等待，并按错误率抛出 ProviderError；随机序列由种子决定，便于复现"""
+
+    def __init__(self, name, latency=None, error_rate=0.0, seed=None, error_status=None):
+        self.name = name
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0}
+
+    def __call__(self):
+        delay = self.latency.sample()
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.stats["calls"] += 1
+            failed = self.error_rate and self._rng.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        if failed:
+            raise ProviderError(f"{self.name} 模拟错误", status_code=self.error_status)
+
+
+def hash_embedding(text, dimensions):
+    """确定性嵌入：词元特征哈希到固定维度并归一化，词面相近的文本向量相近"""
+    vec = np.zeros(dimensions, dtype=np.float32)
+    for token in tokenize(text):
+        digest = hashlib.md5(token.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        vec[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm else vec).tolist()
+
+
+def _message_text(content):
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def default_llm_response(messages, accept_sql=None):
+    """
+    LLM 替身的默认回复：
+    - SQL生成：返回提示词 [SQL Examples] 中的第一条 SQL（没有示例时返回 SELECT 1）；
+      提供 accept_sql 时跳过其判定为不可用的示例（如引用了未定义计数器、会被字段校验拒绝的SQL）
+    - 要求 JSON 报告：返回最小的合法报告
+    - 其他：原样返回最后一条用户消息
+    """
+    system = "\n".join(_message_text(m["content"]) for m in messages if m["role"] == "system")
+    user = next((_message_text(m["content"]) for m in reversed(messages) if m["role"] == "user"), "")
+    if "[SQL Examples]" in system:
+        section = system.split("[SQL Examples]", 1)[-1].split("# User's structured intent", 1)[0]
+        for match in re.finditer(r'SQL: (.*?)(?=\n问题: |\Z)', section, re.S):
+            sql = match.group(1).strip()
+            if accept_sql is None or accept_sql(sql):
+                return sql
+        return "SELECT 1"
+    if "```json" in system or "```json" in user:
+        return json.dumps({"overview_analysis": {"explanation": "本地替身生成的占位分析。"}}, ensure_ascii=False)
+    return user
+
+
+class FakeLLM(ClaudeLLM):
+    """
+    进程内 LLM 替身：复用 ClaudeLLM 的全部上层方法（生成SQL、问题润色、分析报告），
+    只替换底层 chat/chat_stream。支持延迟分布、错误率和逐段输出的流式间隔。
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, stream_chunk_chars=8, token_delay_ms=0.0,
+                 responder=None, seed=None, error_status=None):
+        self.client = None
+        self.model = "fake-llm"
+        self.responder = responder or default_llm_response
+        self.stream_chunk_chars = stream_chunk_chars
+        self.token_delay = token_delay_ms / 1000.0
+        self._fault = _FaultInjector("LLM", latency, error_rate, seed, error_status)
+
+    @staticmethod
+    def _record_estimate(span, messages, text):
+        """替身没有真实的 token 用量，按估算值记录，便于与线上追踪对照"""
+        span.add("llm.prompt_tokens", sum(estimate_tokens(_message_text(m["content"])) for m in messages))
+        span.add("llm.completion_tokens", estimate_tokens(text))
+
+    def chat(self, messages, **kwargs):
+        with tracing.span("llm.chat", model=self.model) as span:
+            self._fault()
+            text = self.responder(messages)
+            self._record_estimate(span, messages, text)
+            return text
+
+    def chat_stream(self, messages, **kwargs):
+        span = tracing.start_span("llm.chat_stream", model=self.model)
+        try:
+            self._fault()
+            text = self.responder(messages)
+            self._record_estimate(span, messages, text)
+            for start in range(0, len(text), self.stream_chunk_chars):
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+                yield text[start:start + self.stream_chunk_chars]
+        except Exception as e:
+            span.end(error=e)
+            raise
+        finally:
+            span.end()
+
+    def get_stats(self):
+        return dict(self._fault.stats)
+
+
+class FakeEmbedding(QwenEmbedding):
+    """
+    进程内嵌入替身：只替换底层接口调用 _request，批量切分、并发、重试和缓存逻辑与线上实现一致。
+    向量由文本哈希确定生成。
+    """
+
+    def __init__(self, dimensions=None, latency=None, error_rate=0.0, cache=None, seed=None):
+        self.client = None
+        self.model = "fake-hash-embedding"
+        self.dimensions = dimensions or EMBEDDING_CONFIG["dimensions"]
+        self.batch_size = EMBEDDING_CONFIG.get("batch_size", 10)
+        self.max_workers = EMBEDDING_CONFIG.get("max_workers", 4)
+        self.max_retries = EMBEDDING_CONFIG.get("max_retries", 3)
+        self.retry_backoff = PROVIDER_CONFIG.get("fake", {}).get("retry_backoff", 0.0)
+        self.cache = cache
+        self._fault = _FaultInjector("Embedding", latency, error_rate, seed)
+
+    def _request(self, inputs):
+        self._fault()
+        return [hash_embedding(text, self.dimensions) for text in inputs]
+
+    def get_stats(self):
+        return dict(self._fault.stats)
+
+
+class FakeReranker(QwenReranker):
+    """进程内重排替身：只替换底层接口调用，分数使用 BM25；分数缓存、延迟预算与降级逻辑与线上实现一致"""
+
+    def __init__(self, latency=None, error_rate=0.0, seed=None):
+        super().__init__()
+        self._fault = _FaultInjector("Rerank", latency, error_rate, seed)
+
+    def _api_available(self):
+        return True
+
+    def _call_api(self, query, documents):
+        self._fault()
+        return bm25_scores(query, documents)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["api_errors"] = self._fault.stats["errors"]
+        return stats
+
+
+def _fake_options(kind, overrides):
+    config = PROVIDER_CONFIG.get("fake", {})
+    options = dict(config.get(kind, {}))
+    options.update(overrides or {})
+    seed = config.get("seed")
+    latency = options.pop("latency", None)
+    if not isinstance(latency, LatencyModel):
+        latency = LatencyModel.from_config(latency, seed=seed)
+    options["latency"] = latency
+    options.setdefault("seed", seed)
+    return options
+
+
+def create_llm(backend=None, **overrides):
+    if (backend or PROVIDER_CONFIG.get("backend")) == "fake":
+        return FakeLLM(**_fake_options("llm", overrides))
+    return ClaudeLLM()
+
+
+def create_embedder(backend=None, **overrides):
+    if (backend or PROVIDER_CONFIG.get("backend")) == "fake":
+        return FakeEmbedding(**_fake_options("embedding", overrides))
+    return QwenEmbedding()
+
+
+def create_reranker(backend=None, **overrides):
+    if (backend or PROVIDER_CONFIG.get("backend")) == "fake":
+        return FakeReranker(**_fake_options("rerank", overrides))
+    return QwenReranker()
+
+
+def create_providers(backend=None):
+    """
+    按配置创建 LLM、嵌入、重排三个服务：backend 为 "remote" 时使用 OpenRouter / DashScope，
+    为 "fake" 时使用进程内替身（默认取 PROVIDER_CONFIG["backend"]，可用环境变量 TEXT2SQL_PROVIDER 切换）。
+    """
+    return {
+        "llm": create_llm(backend),
+        "embedder": create_embedder(backend),
+        "reranker": create_reranker(backend)
+    }
@@ -3,22 +3,59 @@ import yaml
 import pandas as pd
 import json
 import re
-from modules.llm_manager import ClaudeLLM
-from modules.embedding_manager import QwenEmbedding
-from modules.rerank_manager import QwenReranker
+import time
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config.settings import SEMANTIC_CACHE_CONFIG, PIPELINE_CONFIG, RERANK_CONFIG, RETRIEVAL_CONFIG, BATCH_CONFIG
+from modules.providers import create_llm, create_embedder, create_reranker
 from modules.vector_store import LocalChromaDB
 from modules.db_connector import MySQLConnector
+from modules.metric_matcher import MetricMatcher
+from modules.semantic_cache import SemanticSQLCache
+from modules.pipeline import StagePipeline
+from modules.prompt_builder import SQLPromptBuilder
+from modules.sql_guard import SQLCostGuard
+from modules import tracing
+
+# 当前请求使用的检索阶段线程池；ask_many 为每批问题设置独立的线程池，未设置时使用 RAGEngine.executor
+_stage_executor = contextvars.ContextVar("text2sql_stage_executor", default=None)
 
 class RAGEngine:
-    def __init__(self):
-        self.llm = ClaudeLLM()
-        self.embedder = QwenEmbedding()
-        self.reranker = QwenReranker()
-        self.vector_db = LocalChromaDB()
-        self.db = MySQLConnector()
-        self.metrics_yaml_path = r"C:\Users\Administrator\PYMo\SuperMO\Text2SQL\all_metrics.yaml"
+    def __init__(self, llm=None, embedder=None, reranker=None, vector_db=None, db=None,
+                 metrics_yaml_path=None, semantic_cache_path=None, executor=None):
+        """
+        各组件均可注入（如基准测试使用本地替身和 SQLite 夹具），未提供时按 PROVIDER_CONFIG 创建。
+        executor: 检索阶段使用的线程池；多线程并发调用时应按 stage_workers(并发数) 定容，
+        未提供时按 PIPELINE_CONFIG 的 max_workers 创建
+        """
+        self.llm = llm or create_llm()
+        self.embedder = embedder or create_embedder()
+        self.reranker = reranker or create_reranker()
+        self.vector_db = vector_db or LocalChromaDB()
+        self.db = db or MySQLConnector()
+        self.metrics_yaml_path = metrics_yaml_path or r"C:\Users\Administrator\PYMo\SuperMO\Text2SQL\all_metrics.yaml"
         self.metrics_definitions = self._load_metrics_definitions(self.metrics_yaml_path)
         self.all_kpi_fields = self._extract_all_kpi_fields()
+        self.metric_matcher = MetricMatcher.from_metrics(self.metrics_definitions)
+        self.executor = executor or ThreadPoolExecutor(max_workers=PIPELINE_CONFIG.get("max_workers", 8))
+        self.prompt_builder = SQLPromptBuilder()
+        self.sql_guard = SQLCostGuard(self.db)
+        # 并发的 LLM 调用数上限；SQL执行并发不超过连接池容量，避免排队等待连接超时
+        self._llm_gate = threading.BoundedSemaphore(BATCH_CONFIG.get("llm_concurrency", 4))
+        self._db_gate = threading.BoundedSemaphore(getattr(self.db, "max_connections", BATCH_CONFIG.get("concurrency", 8)))
+        self.semantic_cache = None
+        if SEMANTIC_CACHE_CONFIG.get("enabled"):
+            try:
+                self.semantic_cache = SemanticSQLCache(
+                    semantic_cache_path or SEMANTIC_CACHE_CONFIG["path"],
+                    similarity_threshold=SEMANTIC_CACHE_CONFIG.get("similarity_threshold", 0.97),
+                    max_entries=SEMANTIC_CACHE_CONFIG.get("max_entries", 5000),
+                    ttl_seconds=SEMANTIC_CACHE_CONFIG.get("ttl_seconds")
+                )
+            except Exception as e:
+                print(f"语义SQL缓存初始化失败，将不使用缓存: {e}")
 
     def _load_metrics_definitions(self, yaml_path):
         if not os.path.exists(yaml_path):
@@ -41,12 +78,15 @@ class RAGEngine:
         return list(fields)
 
     def _find_metrics_in_question(self, question):
-        found_metrics = []
-        for name, definition in self.metrics_definitions.items():
-            if name in question:
-                found_metrics.append(definition)
-        return found_metrics
+        return [self.metrics_definitions[name] for name in self.metric_matcher.find(question)]
     
+    def _new_pipeline(self):
+        return StagePipeline(
+            _stage_executor.get() or self.executor,
+            budget_seconds=PIPELINE_CONFIG.get("budget_seconds"),
+            stage_timeouts=PIPELINE_CONFIG.get("stage_timeouts")
+        )
+
     def _validate_sql_fields(self, sql):
         used_fields = set(re.findall(r'k\.([KR]\d{4}_\d{3})', sql))
         allowed_fields = set(self.all_kpi_fields)
@@ -79,63 +119,236 @@ class RAGEngine:
             print(f"[RAG] 问题润色失败: {e}")
             return {"structured_question": question, "error": str(e)}
 
-    def generate_sql_only(self, structured_question):
-        """根据润色后的问题生成SQL"""
-        try:
+    @staticmethod
+    def stage_workers(concurrency):
+        """
+        并发处理 concurrency 个问题时检索阶段线程池所需的线程数：
+        每个问题同时在途的阶段为向量化，以及各分区的向量检索和词法检索（重排在其后执行）
+        """
+        partitions = len(RETRIEVAL_CONFIG.get("type_quotas") or {None: 10})
+        return max(concurrency, 1) * (1 + 2 * partitions)
+
+    def _retrieval_partitions(self):
+        """
+        检索分区及配额：按文档类型分区时返回 {类型: 配额}，否则返回 {None: 10}。
+        每个分区的候选数按配额占比分摊重排的宽召回数量。
+        """
+        quotas = RETRIEVAL_CONFIG.get("type_quotas") or {None: 10}
+        total = sum(quotas.values())
+        partitions = {}
+        for doc_type, quota in quotas.items():
+            candidates = quota
+            if RERANK_CONFIG.get("enabled"):
+                candidates = max(quota, round(RERANK_CONFIG.get("candidate_k", 50) * quota / total))
+            partitions[doc_type] = (quota, candidates)
+        return partitions
+
+    @staticmethod
+    def _stage_name(stage, doc_type):
+        return f"{stage}:{doc_type}" if doc_type else stage
+
+    def _prepare_context(self, structured_question, use_cache=True, q_embed=None):
+        """
+        SQL生成前的检索流水线（Streamlit 与命令行共用）：
+        问题向量化、词法检索与指标解析并发；拿到向量后，语义缓存查找与向量检索并发，缓存命中时丢弃检索结果。
+        检索按文档类型分区（Chroma where 过滤）并发执行，各分区内向量与词法结果按 RRF 融合，
+        统一重排后按类型配额选取，得到条数固定、去重后的上下文。向量化失败时仅用词法结果继续。
+        可传入预先计算好的 q_embed 跳过向量化阶段。
+        """
+        pipeline = self._new_pipeline()
+        partitions = self._retrieval_partitions()
+        hybrid = RETRIEVAL_CONFIG.get("hybrid", True)
+        if q_embed is None:
+            # 问题向量化是网络调用，先提交到线程池，与本地的指标解析并发进行
+            pipeline.submit("embedding", self.embedder.embed, structured_question)
+        if hybrid:
+            for doc_type, (_, candidates) in partitions.items():
+                pipeline.submit(self._stage_name("lexical_search", doc_type), self.vector_db.lexical_search,
+                                structured_question, top_k=candidates,
+                                where={"type": doc_type} if doc_type else None)
+        with tracing.span("metric_match") as span:
             relevant_metrics = self._find_metrics_in_question(structured_question)
-            metric_formulas_context = []
-            if relevant_metrics:
-                for metric in relevant_metrics:
-                    metric_formulas_context.append(f"- {metric['name']}: {metric['formula']}")
-                print(f"[RAG] 找到了相关的官方公式: {metric_formulas_context}")
+            span.set("metrics.matched", len(relevant_metrics))
+        metric_formulas_context = []
+        if relevant_metrics:
+            for metric in relevant_metrics:
+                metric_formulas_context.append(f"- {metric['name']}: {metric['formula']}")
+            print(f"[RAG] 找到了相关的官方公式: {metric_formulas_context}")
+        else:
+            print("[RAG] 未在问题中找到明确的指标，将依赖RAG的泛化能力。")
+        metric_names = [metric['name'] for metric in relevant_metrics]
+        if q_embed is None:
+            q_embed = pipeline.result("embedding", default=None) if hybrid else pipeline.result("embedding")
+        # 向量化失败（EmbeddingError 或超时）时嵌入为 None，此时跳过向量检索和语义缓存
+        has_vector = q_embed is not None and any(q_embed)
+        if not has_vector and not hybrid:
+            raise RuntimeError("问题向量化失败")
+
+        if has_vector:
+            for doc_type, (_, candidates) in partitions.items():
+                pipeline.submit(self._stage_name("vector_search", doc_type), self.vector_db.search_with_metadata,
+                                q_embed, top_k=candidates, where={"type": doc_type} if doc_type else None)
+            if use_cache and self.semantic_cache is not None:
+                hit = self.semantic_cache.lookup(q_embed, metric_names, structured_question)
+                if hit:
+                    print(f"[RAG] 语义缓存命中 (相似度 {hit['similarity']:.4f}): {hit['question'][:50]}")
+                    pipeline.cancel_pending()
+                    return {"cache_hit": hit, "metric_names": metric_names, "q_embed": q_embed,
+                            "timings": pipeline.timings}
+        else:
+            print("[RAG] 问题向量化失败，仅使用词法检索结果")
+            q_embed = None
+
+        docs, metadatas = [], []
+        for doc_type, (_, candidates) in partitions.items():
+            vector_results = ([], [])
+            if has_vector:
+                vector_results = pipeline.result(self._stage_name("vector_search", doc_type), default=([], []))
+            if hybrid:
+                lexical_results = pipeline.result(self._stage_name("lexical_search", doc_type), default=([], []))
+                part_docs, part_metas = self.vector_db.hybrid_search(
+                    vector_results, lexical_results, top_k=candidates, rrf_k=RETRIEVAL_CONFIG.get("rrf_k", 60)
+                )
+            else:
+                part_docs, part_metas = vector_results
+            docs.extend(part_docs)
+            metadatas.extend(part_metas)
+        if RERANK_CONFIG.get("enabled") and docs:
+            docs, metadatas = pipeline.run(
+                "rerank", self._rerank, structured_question, docs, metadatas, default=(docs, metadatas)
+            )
+        docs, metadatas = self._apply_quotas(docs, metadatas, partitions)
+        return {
+            "cache_hit": None,
+            "relevant_metrics": relevant_metrics,
+            "metric_formulas_context": metric_formulas_context,
+            "metric_names": metric_names,
+            "q_embed": q_embed,
+            "docs": docs,
+            "metadatas": metadatas,
+            "timings": pipeline.timings
+        }
+
+    @staticmethod
+    def _apply_quotas(docs, metadatas, partitions):
+        """
+        按相关性顺序为各类型选取不超过配额的文档（文本去重）；
+        某类型不足配额时，空出的名额由其余类型的后续文档补齐，保证上下文总条数固定。
+        """
+        total = sum(quota for quota, _ in partitions.values())
+        taken, counts, seen, overflow = [], {}, set(), []
+        for doc, meta in zip(docs, metadatas):
+            if doc in seen:
+                continue
+            seen.add(doc)
+            doc_type = (meta or {}).get("type") if None not in partitions else None
+            if counts.get(doc_type, 0) < partitions.get(doc_type, (0, 0))[0]:
+                counts[doc_type] = counts.get(doc_type, 0) + 1
+                taken.append((doc, meta))
             else:
-                print("[RAG] 未在问题中找到明确的指标，将依赖RAG的泛化能力。")
-            q_embed = self.embedder.embed(structured_question)
-            docs, metadatas = self.vector_db.search_with_metadata(q_embed, top_k=10)
+                overflow.append((doc, meta))
+        taken.extend(overflow[:max(total - len(taken), 0)])
+        return [doc for doc, _ in taken], [meta for _, meta in taken]
+
+    def _rerank(self, question, docs, metadatas):
+        """对宽召回的候选统一打分并按相关性重新排序"""
+        doc_ids = [self.vector_db._generate_id(doc) for doc in docs]
+        scores, source = self.reranker.score(question, docs, doc_ids)
+        tracing.record("rerank.source", source)
+        tracing.record("rerank.candidates", len(docs))
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        print(f"[RAG] 候选重排完成 ({source}), 共 {len(docs)} 条")
+        return [docs[i] for i in order], [metadatas[i] for i in order]
+
+    def generate_sql_only(self, structured_question, use_cache=True, on_token=None, q_embed=None, feedback=None):
+        """
+        根据润色后的问题生成SQL；use_cache 为 True 时相似问题直接复用缓存的SQL。
+        on_token: 流式回调，参数为当前已生成的SQL文本。
+        q_embed: 预先计算好的问题向量（批量接口一次性向量化），为空时在检索流水线中计算。
+        feedback: 重新生成时附加给 LLM 的要求（如代价检查未通过的原因），此时不读写语义缓存。
+        返回结果中的 trace 为本次请求的追踪（各阶段耗时、字节数、token 数）。
+        """
+        with tracing.start_trace("generate_sql_only") as trace:
+            result = self._generate_sql(structured_question, use_cache=use_cache, on_token=on_token, q_embed=q_embed,
+                                        feedback=feedback)
+        result["trace"] = trace
+        return result
+
+    @staticmethod
+    def _rate_limit_delay(error, attempt):
+        """
+        判断是否为限流错误（HTTP 429），是则返回本次重试前应等待的秒数：
+        优先使用服务端的 Retry-After，否则指数退避并加随机抖动；非限流错误返回 None。
+        """
+        if getattr(error, "status_code", None) != 429:
+            return None
+        response = getattr(error, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), BATCH_CONFIG.get("backoff_max", 30.0))
+        except ValueError:
+            pass
+        delay = BATCH_CONFIG.get("backoff_base", 1.0) * (2 ** attempt)
+        return min(delay, BATCH_CONFIG.get("backoff_max", 30.0)) * random.uniform(0.5, 1.0)
+
+    def _call_llm(self, fn, *args, **kwargs):
+        """在并发上限内调用 LLM；遇到限流时按退避策略重试"""
+        max_retries = BATCH_CONFIG.get("max_retries", 5)
+        for attempt in range(max_retries + 1):
+            with self._llm_gate:
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    delay = self._rate_limit_delay(e, attempt)
+                    if delay is None or attempt == max_retries:
+                        raise
+            # 等待期间释放并发名额，让其他请求继续
+            print(f"[RAG] LLM 限流，{delay:.1f} 秒后重试（第 {attempt + 1} 次）")
+            tracing.add("llm.rate_limit_retries", 1)
+            time.sleep(delay)
+
+    def _generate_sql(self, structured_question, use_cache=True, on_token=None, q_embed=None, feedback=None):
+        try:
+            ctx = self._prepare_context(structured_question, use_cache=use_cache and not feedback, q_embed=q_embed)
+            if ctx["cache_hit"]:
+                hit = ctx["cache_hit"]
+                return {
+                    "sql": hit["sql"],
+                    "structured_question": structured_question,
+                    "cache_hit": True,
+                    "cache_id": hit["id"],
+                    "similarity": hit["similarity"],
+                    "cached_question": hit["question"],
+                    "timings": dict(ctx["timings"])
+                }
+            metric_formulas_context = ctx["metric_formulas_context"]
+            metric_names = ctx["metric_names"]
+            q_embed = ctx["q_embed"]
+            docs, metadatas = ctx["docs"], ctx["metadatas"]
             context_parts = []
             sql_examples = []
+            example_questions = []
             for doc, meta in zip(docs, metadatas):
                 if meta and meta.get('type') == 'qa' and 'sql' in meta:
                     sql_examples.append(f"问题: {doc}\nSQL: {meta['sql']}")
+                    example_questions.append(doc)
                 elif meta and meta.get('type') == 'ddl':
                     context_parts.append(f"表结构: {doc}")
                 else:
                     context_parts.append(str(doc))
-            system_prompt = f"""You are an expert MySQL SQL developer. Your task is to generate precise SQL queries from user questions.
-
-[Database Schema]
-- `btsbase` (alias b): Base station info (ID, station_name, 省份, 地市, frequency_band, etc.)
-- `kpibase` (alias k): KPI metrics (ID, 开始时间, R* and K* counters)
-- Join condition: `b.ID = k.ID`
-
-[Available Metric Formulas]
-# THIS IS THE GROUND TRUTH. YOU MUST USE THESE FORMULAS EXACTLY AS PROVIDED.
-{chr(10).join(metric_formulas_context) if metric_formulas_context else "No specific formulas found for this query. Rely on your general knowledge and provided context."}
-
-[Context Information]
-{chr(10).join(context_parts[:3]) if context_parts else "No specific context available"}
-
-[SQL Examples]
-{chr(10).join(sql_examples[:3]) if sql_examples else "No examples available"}
-
-[SQL Generation Rules]
-1.  **Strict Formula Adherence**: If a metric is listed in [Available Metric Formulas], you **MUST** use the exact formula provided. Do not invent, simplify, or use any other field names.
-2.  **Field Validation**: All `k.` fields in the generated SQL must be from the official KPI counter list. Do not use any `k.` field not on this list.
-3.  **Aggregation First**: Always aggregate raw counters with `SUM()` before performing other operations.
-4.  **Identifier Quoting**: Enclose all Chinese identifiers in backticks (`` ` ``).
-5.  **GROUP BY Clause**: Must include all non-aggregated columns from the `SELECT` list.
-6.  **Numeric Precision**: Round all final calculated metrics to 2 decimal places using `ROUND(..., 2)`.
-7.  **Unit Conversion**: For traffic, use `/ 1e6` for GB. For rates, use `* 100` for percentage.
-8.  **No Frequency Band Grouping**: Do not group by `b.frequency_band` unless explicitly asked.
-
-[Output Requirements]
-Return only the raw SQL query text. No explanations or markdown.
-
-# User's structured intent (You must generate SQL based on this):
-{structured_question}
-"""
+            question_text = f"{structured_question}\n{feedback}" if feedback else structured_question
+            with tracing.span("prompt_build") as span:
+                prompt = self.prompt_builder.build(question_text, metric_formulas_context, context_parts, sql_examples)
+                span.set("prompt.estimated_tokens", prompt["tokens"]["total"])
+            print(f"[RAG] 提示词估算 token: {prompt['tokens']}")
             print("[RAG] 生成SQL...")
-            sql = self.llm.generate_sql(system_prompt, structured_question)
+            llm_start = time.perf_counter()
+            with tracing.span("llm.generate_sql"):
+                sql = self._call_llm(self.llm.generate_sql, prompt["dynamic"], question_text,
+                                     on_token=on_token, static_prefix=prompt["static"])
+            llm_seconds = time.perf_counter() - llm_start
+            timings = dict(ctx["timings"], llm=llm_seconds)
             print(f"[RAG] 生成的SQL: {sql}")
             sql = sql.strip()
             if sql.startswith("```"):
@@ -145,28 +358,97 @@ Return only the raw SQL query text. No explanations or markdown.
             validation_error = self._validate_sql_fields(sql)
             if validation_error:
                 print(f"[VALIDATION] SQL验证失败: {validation_error}")
-                return {"sql": sql, "error": validation_error, "structured_question": structured_question}
-            return {"sql": sql, "structured_question": structured_question}
+                return {"sql": sql, "error": validation_error, "structured_question": structured_question,
+                        "prompt_tokens": prompt["tokens"], "example_questions": example_questions, "timings": timings}
+            result = {"sql": sql, "structured_question": structured_question, "prompt_tokens": prompt["tokens"],
+                      "example_questions": example_questions, "timings": timings}
+            if q_embed is not None and not feedback:
+                # SQL执行成功后才写入语义缓存（见 record_execution）
+                result["cache_entry"] = {"question": structured_question, "embedding": q_embed, "sql": sql,
+                                         "metric_names": metric_names, "llm_seconds": llm_seconds}
+            return result
         except Exception as e:
             print(f"[RAG] SQL生成错误: {str(e)}")
             import traceback
             traceback.print_exc()
             return {"sql": "-- SQL生成失败", "error": str(e), "structured_question": structured_question}
 
+    def record_execution(self, result, success):
+        """
+        SQL执行后更新语义缓存：新生成的SQL执行成功时写入；
+        复用的缓存SQL执行失败时删除该条目，避免继续命中
+        """
+        if self.semantic_cache is None:
+            return
+        try:
+            if success and result.get("cache_entry"):
+                self.semantic_cache.add(**result["cache_entry"])
+            elif not success and result.get("cache_hit") and result.get("cache_id") is not None:
+                print(f"[RAG] 缓存SQL执行失败，删除语义缓存条目 {result['cache_id']}")
+                self.semantic_cache.remove(result["cache_id"])
+        except Exception as e:
+            print(f"[RAG] 更新语义缓存失败: {e}")
+
+    def review_sql(self, sql, question=None):
+        """
+        执行前的代价检查（见 SQLCostGuard.review）；提供 question 时，
+        regenerate 策略会带上拦截原因让 LLM 重新生成
+        """
+        regenerate = None
+        if question:
+            regenerate = lambda feedback: self._regenerate_sql(question, feedback)
+        with tracing.span("sql.guard") as span:
+            review = self.sql_guard.review(sql, regenerate=regenerate)
+            span.set("guard.action", review["action"])
+            if review["estimate"] is not None:
+                span.set("guard.rows_examined", review["estimate"]["rows_examined"])
+        print(f"[RAG] SQL代价检查: {review['action']} {review['message']}")
+        return review
+
+    def _regenerate_sql(self, question, feedback):
+        with tracing.span("sql.guard.regenerate"):
+            result = self._generate_sql(question, use_cache=False, feedback=feedback)
+        if result.get("error"):
+            print(f"[RAG] 重新生成SQL失败: {result['error']}")
+            return None
+        return result["sql"]
+
     def ask(self, question):
-        """生成SQL并执行"""
+        """生成SQL并执行；返回结果中的 trace 覆盖检索、生成与执行全过程"""
+        with tracing.start_trace("ask") as trace:
+            result = self._ask(question)
+        result["trace"] = trace
+        return result
+
+    def _ask(self, question, use_cache=True, q_embed=None):
         try:
-            result = self.generate_sql_only(question)
+            result = self.generate_sql_only(question, use_cache=use_cache, q_embed=q_embed)
             if "error" in result and result["error"]:
                 return result
-            sql = result["sql"]
+            review = self.review_sql(result["sql"], question)
+            result["sql_guard"] = review
+            if review["action"] == "reject":
+                result["result"] = pd.DataFrame()
+                result["error"] = review["message"]
+                return result
+            sql = result["sql"] = review["sql"]
             print("[RAG] 执行SQL...")
             try:
-                df = self.db.execute_query(sql)
+                execute_start = time.perf_counter()
+                with self._db_gate, tracing.span("sql.execute") as span:
+                    df = self.db.execute_query(sql, stream=True, use_cache=True)
+                    span.set("sql.rows", len(df))
+                    span.set("sql.result_bytes", int(df.memory_usage(deep=True).sum()))
+                    span.set("sql.from_cache", bool(df.attrs.get("from_cache")))
+                result.setdefault("timings", {})["execute"] = time.perf_counter() - execute_start
                 result["result"] = df
+                # 代价检查改写或重新生成过的SQL不写入缓存（原SQL未通过检查）
+                if review["action"] in ("allow", "unchecked"):
+                    self.record_execution(result, success=True)
                 return result
             except Exception as e:
                 print(f"[RAG] SQL执行失败: {e}")
+                self.record_execution(result, success=False)
                 result["result"] = pd.DataFrame()
                 result["error"] = str(e)
                 return result
@@ -180,6 +462,48 @@ Return only the raw SQL query text. No explanations or markdown.
                 "error": str(e)
             }
 
+    def _ask_traced(self, index, question, q_embed, use_cache, stage_executor=None):
+        token = _stage_executor.set(stage_executor)
+        try:
+            with tracing.start_trace("ask", batch_index=index) as trace:
+                result = self._ask(question, use_cache=use_cache, q_embed=q_embed)
+        finally:
+            _stage_executor.reset(token)
+        result["trace"] = trace
+        result["index"] = index
+        result["question"] = question
+        return result
 
+    def ask_many(self, questions, concurrency=None, use_cache=True):
+        """
+        批量问答（如夜间批量生成标准报表）：
+        - 所有问题一次性批量向量化（失败时各问题在检索流水线中单独向量化）
+        - 各问题的检索、生成、执行并发进行；LLM 调用受并发上限和限流退避控制，SQL执行共享连接池
+        - 检索阶段使用本批独占、按并发数定容的线程池，不与交互请求争用 self.executor
+        - 以生成器形式按完成顺序产出结果，每个结果带 index（在输入中的位置）和 question
+        """
+        questions = list(questions)
+        if not questions:
+            return
+        concurrency = concurrency or BATCH_CONFIG.get("concurrency", 8)
+        try:
+            with tracing.span("embedding.batch"):
+                embeddings = self.embedder.embed_batch(questions)
+        except Exception as e:
+            print(f"[RAG] 批量向量化失败，改为逐个向量化: {e}")
+            embeddings = [None] * len(questions)
 
-
+        # 单独的线程池：问题级任务会等待阶段任务，与阶段线程池共用同一个池可能互相阻塞
+        batch_executor = ThreadPoolExecutor(max_workers=concurrency)
+        stage_executor = ThreadPoolExecutor(max_workers=self.stage_workers(concurrency))
+        try:
+            futures = [
+                batch_executor.submit(self._ask_traced, i, question, embeddings[i], use_cache, stage_executor)
+                for i, question in enumerate(questions)
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # 调用方提前停止迭代时，取消尚未开始的问题
+            batch_executor.shutdown(wait=False, cancel_futures=True)
+            stage_executor.shutdown(wait=False, cancel_futures=True)
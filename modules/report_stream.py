@@ -0,0 +1,63 @@
+import json
+
+class IncrementalReportParser:
+    """
+    流式JSON报告的增量解析器。
+    逐段喂入LLM输出的文本，每当顶层对象中的某个 "键": 值 完整到达时即产出 (键, 值)，
+    无需等待整个报告生成完毕。会自动跳过 ```json 代码块标记等前导文本。
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = None      # 顶层对象内下一个待解析位置；None 表示尚未找到 '{'
+        self._done = False
+
+    def _skip_whitespace(self, pos, extra=""):
+        while pos < len(self._buffer) and (self._buffer[pos].isspace() or self._buffer[pos] in extra):
+            pos += 1
+        return pos
+
+    def feed(self, text):
+        """追加文本，返回本次新完成的 [(键, 值), ...]"""
+        self._buffer += text
+        completed = []
+        if self._done:
+            return completed
+
+        if self._pos is None:
+            start = self._buffer.find("{")
+            if start < 0:
+                return completed
+            self._pos = start + 1
+
+        while True:
+            pos = self._skip_whitespace(self._pos, extra=",")
+            if pos >= len(self._buffer):
+                break
+            if self._buffer[pos] == "}":
+                self._done = True
+                break
+            try:
+                key, pos = self._decoder.raw_decode(self._buffer, pos)
+                pos = self._skip_whitespace(pos)
+                if pos >= len(self._buffer):
+                    break
+                if self._buffer[pos] != ":":
+                    # 格式异常，停止增量解析，交给最终的整体解析处理
+                    self._done = True
+                    break
+                pos = self._skip_whitespace(pos + 1)
+                if pos >= len(self._buffer):
+                    break
+                value, end = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                # 当前键或值尚未完整到达
+                break
+            # 数字可能仍未结束，需要看到分隔符才能确认
+            end_check = self._skip_whitespace(end)
+            if end_check >= len(self._buffer):
+                break
+            completed.append((key, value))
+            self._pos = end
+        return completed
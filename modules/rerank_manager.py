@@ -1,9 +1,24 @@
+import os
+import time
+import hashlib
+import threading
 import dashscope
+from collections import OrderedDict, deque
 from http import HTTPStatus
 from config.settings import RERANK_CONFIG
+from modules.lexical import bm25_scores
 from typing import List, Dict, Any
 
 class QwenReranker:
+    def __init__(self):
+        self.cache_size = RERANK_CONFIG.get("cache_size", 10000)
+        self.latency_budget_ms = RERANK_CONFIG.get("latency_budget_ms", 1500)
+        self._score_cache = OrderedDict()
+        self._latencies = deque(maxlen=RERANK_CONFIG.get("latency_window", 50))
+        self._lock = threading.Lock()
+        self._skipped_since_probe = 0
+        self.stats = {"rerank_calls": 0, "cache_hits": 0, "lexical_fallbacks": 0, "budget_skips": 0}
+
     def rerank(self, query: str, documents: List[str], top_n: int = 10) -> List[Dict[str, Any]]:
         """
         对文档进行重排序
@@ -50,3 +65,100 @@ class QwenReranker:
             print(f"Rerank异常: {str(e)}")
             # 异常时返回原始文档
             return [{"document": str(doc), "score": 1.0} for doc in documents[:top_n]]
+
+    def _call_api(self, query, documents):
+        """调用 rerank API，返回与 documents 对齐的分数；失败时抛出异常"""
+        resp = dashscope.TextReRank.call(
+            model=RERANK_CONFIG["model"],
+            query=query,
+            documents=documents,
+            top_n=len(documents),
+            return_documents=False
+        )
+        if resp.status_code != HTTPStatus.OK:
+            raise RuntimeError(f"Rerank失败: {resp.status_code}, {resp.message}")
+        scores = [0.0] * len(documents)
+        for item in resp.output.get("results", []):
+            scores[item["index"]] = item.get("relevance_score", 0.0)
+        return scores
+
+    def _api_available(self):
+        return bool(dashscope.api_key or os.getenv("DASHSCOPE_API_KEY"))
+
+    def _p95_latency_ms(self):
+        if len(self._latencies) < 10:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _over_budget(self):
+        """近期 p95 延迟超出预算时跳过在线重排；每跳过若干次放行一次探测请求，以便恢复"""
+        with self._lock:
+            if self._p95_latency_ms() <= self.latency_budget_ms:
+                return False
+            self._skipped_since_probe += 1
+            if self._skipped_since_probe >= RERANK_CONFIG.get("probe_interval", 20):
+                self._skipped_since_probe = 0
+                return False
+            self.stats["budget_skips"] += 1
+            return True
+
+    def _bump(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def score(self, query, documents, doc_ids=None):
+        """
+        计算 query 与各文档的相关性分数，返回 (与 documents 对齐的分数列表, 来源)。
+        来源为 "cache"、"rerank" 或 "lexical"：分数按 (问题哈希, 文档ID) 缓存；
+        服务不可用、调用失败或近期延迟超出预算时，使用确定性的 BM25 词法打分兜底。
+        """
+        if not documents:
+            return [], "cache"
+        doc_ids = doc_ids or [hashlib.md5(doc.encode()).hexdigest() for doc in documents]
+        query_hash = hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+        with self._lock:
+            scores = []
+            for doc_id in doc_ids:
+                key = (query_hash, doc_id)
+                if key in self._score_cache:
+                    self._score_cache.move_to_end(key)
+                    scores.append(self._score_cache[key])
+                else:
+                    scores.append(None)
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if not missing:
+            self._bump("cache_hits")
+            return scores, "cache"
+
+        if not self._api_available() or self._over_budget():
+            self._bump("lexical_fallbacks")
+            return bm25_scores(query, documents), "lexical"
+
+        start = time.perf_counter()
+        try:
+            fresh = self._call_api(query, [documents[i] for i in missing])
+        except Exception as e:
+            print(f"Rerank异常，使用词法打分兜底: {e}")
+            self._bump("lexical_fallbacks")
+            return bm25_scores(query, documents), "lexical"
+        finally:
+            with self._lock:
+                self._latencies.append((time.perf_counter() - start) * 1000)
+
+        with self._lock:
+            self.stats["rerank_calls"] += 1
+            for i, value in zip(missing, fresh):
+                scores[i] = value
+                self._score_cache[(query_hash, doc_ids[i])] = value
+            while len(self._score_cache) > self.cache_size:
+                self._score_cache.popitem(last=False)
+        return scores, "rerank"
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["p95_latency_ms"] = round(self._p95_latency_ms(), 1)
+            stats["cached_scores"] = len(self._score_cache)
+        return stats
@@ -0,0 +1,135 @@
+import io
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+
+# 字符串字面量和反引号标识符，归一化时保持原样
+_LITERAL_PATTERN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+
+
+def normalize_sql(sql):
+    """归一化SQL文本：去掉首尾空白和结尾分号，字面量以外的连续空白折叠为一个空格"""
+    parts = _LITERAL_PATTERN.split(sql.strip().rstrip(';').strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i])
+    return ''.join(parts).strip()
+
+
+class QueryResultCache:
+    """
+    查询结果缓存：以归一化SQL和参数为键，结果以 Parquet 字节存放在本地 SQLite 中。
+    条目带有数据新鲜度标记（kpibase 的最大开始时间），新数据入库后旧条目自动失效；
+    另有 TTL 过期和总字节数上限（按最近访问淘汰）。
+    """
+
+    def __init__(self, path, ttl_seconds=3600, max_bytes=1024 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stale": 0, "evictions": 0}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                freshness TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL,
+                truncated INTEGER NOT NULL,
+                payload BLOB NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(sql, params=None):
+        raw = normalize_sql(sql) + "\x00" + json.dumps(params or {}, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, sql, params=None, freshness=None):
+        """命中时返回 DataFrame，否则返回 None"""
+        key = self.make_key(sql, params)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT freshness, created_at, truncated, payload FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            entry_freshness, created_at, truncated, payload = row
+            if now - created_at > self.ttl_seconds:
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            if freshness is not None and entry_freshness != str(freshness):
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+
+            self.conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.stats["hits"] += 1
+
+        df = pd.read_parquet(io.BytesIO(payload))
+        df.attrs["truncated"] = bool(truncated)
+        df.attrs["from_cache"] = True
+        return df
+
+    def put(self, sql, df, params=None, freshness=None):
+        key = self.make_key(sql, params)
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False, compression="zstd")
+        payload = buffer.getvalue()
+        if len(payload) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, freshness, created_at, last_access, size, truncated, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, None if freshness is None else str(freshness), now, now, len(payload),
+                 int(bool(df.attrs.get("truncated"))), payload)
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        self.conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY last_access ASC").fetchall():
+            self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.stats["evictions"] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            entries, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        stats["entries"] = entries
+        stats["bytes"] = total
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM results")
+            self.conn.commit()
@@ -0,0 +1,175 @@
+import re
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+
+# 问题中决定SQL取值的字面量：引号内容、日期/数字（含 n78、700M、TOP10 等带字母的写法）、
+# 中文数量与相对时间、带行政区划后缀的地名。只差这些字面量的问题向量相似度往往很高，但SQL不同。
+_LITERAL_PATTERNS = [
+    r"'[^']*'|\"[^\"]*\"|“[^”]*”|‘[^’]*’|「[^」]*」|《[^》]*》",
+    r"[A-Za-z]*\d+(?:\.\d+)?[A-Za-z]*",
+    r"[零一二两三四五六七八九十百千万]+(?:个|名|天|日|周|月|年|小时|分钟|季度)",
+    r"[今昨前明后]天|[本上下这]个?(?:周|月|季度)|[今去前明]年",
+    r"[\u4e00-\u9fff]{1,6}?(?:省|市|区|县|镇|乡|村)"
+]
+_LITERAL_RE = re.compile("|".join(f"(?:{pattern})" for pattern in _LITERAL_PATTERNS))
+
+
+def question_literals(question):
+    """按出现顺序提取问题中的字面量（已去除空白、统一大小写），缓存命中要求与原问题完全一致"""
+    return tuple(token.lower() for token in _LITERAL_RE.findall(re.sub(r"\s+", "", question or "")))
+
+
+class SemanticSQLCache:
+    """
+    语义SQL缓存：保存 (问题向量, 执行成功的SQL, 涉及指标, 问题字面量)。
+    新问题与缓存问题的余弦相似度超过阈值、涉及的指标一致且字面量（日期、数字、地名、引号内容等）完全相同时，
+    直接复用SQL，跳过LLM调用。条目超过 ttl_seconds 后失效；复用的SQL执行失败时由调用方 remove 删除。
+    条目持久化在 SQLite 中，启动时整体载入内存矩阵做向量化检索。
+    """
+
+    def __init__(self, path, similarity_threshold=0.97, max_entries=5000, ttl_seconds=None):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0, "lookup_seconds": 0.0, "removed": 0}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sql_cache)")]
+        if columns and "literals" not in columns:
+            # 旧版本的条目未记录字面量，且写入时SQL尚未执行过，全部丢弃
+            print("语义SQL缓存格式已更新，清除旧条目")
+            self.conn.execute("DROP TABLE sql_cache")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sql_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                metrics TEXT NOT NULL,
+                literals TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                llm_seconds REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+        self._load()
+
+    def _expired(self, created_at, now=None):
+        return bool(self.ttl_seconds) and (now or time.time()) - created_at > self.ttl_seconds
+
+    def _load(self):
+        if self.ttl_seconds:
+            self.conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self.conn.commit()
+        rows = self.conn.execute(
+            "SELECT id, question, sql, metrics, literals, embedding, llm_seconds, created_at FROM sql_cache ORDER BY id"
+        ).fetchall()
+        self._entries = []
+        vectors = []
+        for row_id, question, sql, metrics, literals, blob, llm_seconds, created_at in rows:
+            self._entries.append({
+                "id": row_id, "question": question, "sql": sql,
+                "metrics": tuple(json.loads(metrics)), "literals": tuple(json.loads(literals)),
+                "llm_seconds": llm_seconds, "created_at": created_at
+            })
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        self._matrix = np.vstack(vectors) if vectors else None
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def lookup(self, embedding, metric_names, question):
+        """返回命中的条目（附带 similarity），未命中返回 None"""
+        start = time.perf_counter()
+        vector = self._normalize(embedding)
+        metrics = tuple(sorted(metric_names))
+        literals = question_literals(question)
+        now = time.time()
+        with self._lock:
+            hit = None
+            if vector is not None and self._matrix is not None and self._matrix.shape[1] == vector.shape[0]:
+                scores = self._matrix @ vector
+                for idx in np.argsort(-scores):
+                    if scores[idx] < self.similarity_threshold:
+                        break
+                    entry = self._entries[idx]
+                    if (entry["metrics"] == metrics and entry["literals"] == literals
+                            and not self._expired(entry["created_at"], now)):
+                        hit = dict(entry, similarity=float(scores[idx]))
+                        break
+            if hit:
+                self.stats["hits"] += 1
+                self.stats["saved_seconds"] += hit["llm_seconds"]
+            else:
+                self.stats["misses"] += 1
+            self.stats["lookup_seconds"] += time.perf_counter() - start
+        return hit
+
+    def add(self, question, embedding, sql, metric_names, llm_seconds):
+        """写入一条SQL（应在SQL执行成功后调用）"""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        metrics = json.dumps(sorted(metric_names), ensure_ascii=False)
+        literals = question_literals(question)
+        created_at = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO sql_cache (question, sql, metrics, literals, embedding, llm_seconds, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (question, sql, metrics, json.dumps(literals, ensure_ascii=False), vector.tobytes(), llm_seconds,
+                 created_at)
+            )
+            if len(self._entries) >= self.max_entries:
+                # 超出上限时淘汰最早的条目并重新载入
+                self.conn.execute(
+                    "DELETE FROM sql_cache WHERE id NOT IN (SELECT id FROM sql_cache ORDER BY id DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+                self.conn.commit()
+                self._load()
+                return
+            self.conn.commit()
+            self._entries.append({
+                "id": cursor.lastrowid, "question": question, "sql": sql,
+                "metrics": tuple(sorted(metric_names)), "literals": literals,
+                "llm_seconds": llm_seconds, "created_at": created_at
+            })
+            self._matrix = vector[None, :] if self._matrix is None else np.vstack([self._matrix, vector])
+
+    def remove(self, entry_id):
+        """删除一条条目（复用的SQL执行失败时调用）"""
+        with self._lock:
+            positions = [i for i, entry in enumerate(self._entries) if entry["id"] == entry_id]
+            if not positions:
+                return
+            self.conn.execute("DELETE FROM sql_cache WHERE id = ?", (entry_id,))
+            self.conn.commit()
+            del self._entries[positions[0]]
+            self._matrix = np.delete(self._matrix, positions[0], axis=0) if self._entries else None
+            self.stats["removed"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["avg_lookup_ms"] = round(stats["lookup_seconds"] / lookups * 1000, 3) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 2)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM sql_cache")
+            self.conn.commit()
+            self._load()
@@ -0,0 +1,365 @@
+"""
+SQL执行前的代价检查：
+- EXPLAIN FORMAT=JSON 取得执行计划，按嵌套循环逐表累计预计扫描行数（每次扫描行数 × 前序连接产出行数）
+- 对 kpibase 等大表的全表扫描（且未按开始时间过滤）、或预计扫描行数超限的语句，
+  按配置自动注入时间窗口（全表扫描时另加 LIMIT）、让 LLM 重新生成，或直接拒绝
+"""
+import re
+from config.settings import SQL_GUARD_CONFIG
+
+# 执行计划中表示全表扫描（ALL）或全索引扫描（index）的访问类型
+FULL_SCAN_ACCESS = ("ALL", "index")
+
+_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?', re.IGNORECASE)
+# 顶层的连接子句：连接类型（LEFT / RIGHT / NATURAL 等）、表名、别名
+_JOIN_RE = re.compile(
+    r'\b((?:NATURAL\s+)?(?:(?:LEFT|RIGHT)(?:\s+OUTER)?\s+|INNER\s+|CROSS\s+)?)(?:JOIN|STRAIGHT_JOIN)\s+'
+    r'`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?',
+    re.IGNORECASE
+)
+# ON 条件的结束位置：下一个连接子句、WHERE 或其后的子句
+_ON_END_RE = re.compile(
+    r'\b(?:(?:NATURAL|LEFT|RIGHT|INNER|CROSS)\b|JOIN\b|STRAIGHT_JOIN\b|WHERE\b|GROUP\s+BY\b|HAVING\b|WINDOW\b|'
+    r'ORDER\s+BY\b|LIMIT\b)',
+    re.IGNORECASE
+)
+_CLAUSE_RE = re.compile(r'\b(?:GROUP\s+BY|HAVING|WINDOW|ORDER\s+BY|LIMIT)\b', re.IGNORECASE)
+_KEYWORDS = {
+    "where", "on", "using", "join", "inner", "left", "right", "outer", "cross", "natural", "straight_join",
+    "group", "order", "having", "limit", "union", "window", "force", "use", "ignore", "for", "lock"
+}
+
+
+def _number(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _mask_nested(sql):
+    """
+    将括号内（子查询、函数参数）和字符串常量替换为等长空格，只保留顶层结构，
+    在结果上做正则匹配得到的位置可直接用于原SQL
+    """
+    chars = []
+    depth, quote = 0, None
+    for ch in sql:
+        if quote is not None:
+            visible = depth == 0 and quote == '`'
+            if ch == quote:
+                quote = None
+            chars.append(ch if visible else ' ')
+        elif ch in ("'", '"', '`'):
+            quote = ch
+            chars.append(ch if depth == 0 and ch == '`' else ' ')
+        elif ch == '(':
+            depth += 1
+            chars.append(' ')
+        elif ch == ')':
+            depth = max(depth - 1, 0)
+            chars.append(' ')
+        else:
+            chars.append(ch if depth == 0 else ' ')
+    return ''.join(chars)
+
+
+def _table_aliases(sql):
+    """FROM / JOIN 后的表名与别名，返回 {别名或表名(小写): 表名(小写)}（逗号连接的表不识别）"""
+    aliases = {}
+    for table, alias in _TABLE_RE.findall(sql):
+        table = table.lower()
+        if table in _KEYWORDS:
+            continue
+        aliases[table] = table
+        if alias and alias.lower() not in _KEYWORDS:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def _collect_tables(node, tables):
+    """遍历执行计划，收集各表的访问方式与预计扫描行数（含物化子查询、UNION 各分支）"""
+    if isinstance(node, list):
+        for item in node:
+            _collect_tables(item, tables)
+        return
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        if key == "nested_loop" and isinstance(value, list):
+            # 嵌套循环连接：后一张表的扫描次数为前序连接的产出行数
+            prefix_rows = 1.0
+            for item in value:
+                if isinstance(item, dict) and isinstance(item.get("table"), dict):
+                    prefix_rows = _add_table(item["table"], prefix_rows, tables)
+                else:
+                    _collect_tables(item, tables)
+        elif key == "table" and isinstance(value, dict):
+            _add_table(value, 1.0, tables)
+        else:
+            _collect_tables(value, tables)
+
+
+def _add_table(table, prefix_rows, tables):
+    per_scan = _number(table.get("rows_examined_per_scan"))
+    tables.append({
+        "table": str(table.get("table_name", "")),
+        "access_type": table.get("access_type", ""),
+        "key": table.get("key"),
+        "rows_per_scan": int(per_scan),
+        "rows_examined": int(per_scan * prefix_rows)
+    })
+    for key, value in table.items():
+        if isinstance(value, (dict, list)):
+            _collect_tables(value, tables)
+    # rows_produced_per_join 已包含前序连接的行数
+    return _number(table.get("rows_produced_per_join"), per_scan * prefix_rows)
+
+
+class SQLCostGuard:
+    """
+    SQL执行前的代价检查。数据源需提供 explain(sql)（返回 EXPLAIN FORMAT=JSON 的 dict），
+    没有该方法（如基准测试的 SQLite 夹具）或 EXPLAIN 失败时不拦截，只在结果中注明未检查。
+    """
+
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = dict(SQL_GUARD_CONFIG, **(config or {}))
+        self.guarded_tables = {t.lower() for t in self.config.get("guarded_tables", [])}
+        self.time_column = self.config.get("time_column", "开始时间")
+        col = re.escape(self.time_column)
+        self._time_filter_res = [
+            re.compile(rf'{col}`?\s*\)?\s*(?:>=|<=|<>|!=|=|>|<|BETWEEN\b|IN\s*\()', re.IGNORECASE),
+            re.compile(rf'(?:>=|<=|=|>|<)\s*[\w.`]*{col}', re.IGNORECASE)
+        ]
+
+    def estimate(self, sql):
+        """
+        估算语句的扫描代价，数据源不支持 EXPLAIN 时返回 None：
+        {"rows_examined": 预计扫描总行数, "query_cost": 优化器代价, "tables": 各表访问情况, "full_scans": 全表扫描的表}
+        """
+        explain = getattr(self.db, "explain", None)
+        if explain is None:
+            return None
+        plan = explain(sql)
+        tables = []
+        _collect_tables(plan, tables)
+        aliases = _table_aliases(sql)
+        for table in tables:
+            table["source"] = aliases.get(table["table"].lower(), table["table"].lower())
+        cost_info = plan.get("query_block", {}).get("cost_info", {})
+        return {
+            "rows_examined": sum(t["rows_examined"] for t in tables),
+            "query_cost": _number(cost_info.get("query_cost"), None),
+            "tables": tables,
+            "full_scans": [t for t in tables if t["access_type"] in FULL_SCAN_ACCESS]
+        }
+
+    def has_time_filter(self, sql):
+        """语句中是否对时间列有比较条件（=、>=、BETWEEN、IN 等）"""
+        return any(pattern.search(sql) for pattern in self._time_filter_res)
+
+    def unfiltered_scans(self, sql, estimate):
+        """受保护表（kpibase）的全表扫描且语句未按时间列过滤时，返回这些扫描；否则返回空列表"""
+        scans = [t for t in estimate["full_scans"] if t["source"] in self.guarded_tables]
+        return scans if scans and not self.has_time_filter(sql) else []
+
+    def assess(self, sql, estimate):
+        """按估算结果判断是否需要拦截，返回原因列表（为空表示放行）"""
+        reasons = []
+        scans = self.unfiltered_scans(sql, estimate)
+        if scans:
+            names = "、".join(sorted({t["source"] for t in scans}))
+            rows = sum(t["rows_examined"] for t in scans)
+            reasons.append(f"全表扫描 {names}（约 {rows:,} 行）且未按 `{self.time_column}` 过滤")
+        max_rows = self.config.get("max_rows_examined")
+        if max_rows and estimate["rows_examined"] > max_rows:
+            reasons.append(f"预计扫描 {estimate['rows_examined']:,} 行，超过上限 {max_rows:,}")
+        return reasons
+
+    def feedback(self, reasons):
+        """让 LLM 重新生成时附加的要求"""
+        days = self.config.get("default_window_days", 7)
+        return (f"（注意：上一次生成的SQL{'；'.join(reasons)}。请在 kpibase 的 `{self.time_column}` 上加时间范围条件，"
+                f"问题未指定时间时默认取最近 {days} 天，避免全表扫描）")
+
+    def _time_anchor(self):
+        """时间窗口的终点：kpibase 的最大开始时间（数据可能滞后于当前时间），取不到时用 NOW()"""
+        latest = getattr(self.db, "latest_data_time", None)
+        value = None
+        if latest is not None:
+            try:
+                value = latest()
+            except Exception as e:
+                print(f"获取最新数据时间失败，时间窗口以当前时间为准: {e}")
+        if value and re.fullmatch(r'[\d\-: .]+', str(value)):
+            return f"'{value}'"
+        return "NOW()"
+
+    def rewrite(self, sql, add_limit=True):
+        """
+        为顶层查询注入时间窗口（最近 default_window_days 天），add_limit 为 True（kpibase 全表扫描）时另加 LIMIT。
+        kpibase 在外连接的可空一侧时（LEFT JOIN kpibase），条件加在该连接的 ON 中，避免外连接退化为内连接；
+        kpibase 在 RIGHT JOIN 左侧、用 USING / NATURAL 连接、只出现在子查询中、语句含 UNION，或无需改动时返回 None。
+        返回 {"sql": 改写后的SQL, "changes": 改动说明列表}
+        """
+        sql = sql.strip().rstrip(';').rstrip()
+        masked = _mask_nested(sql)
+        if re.search(r'\bUNION\b', masked, re.IGNORECASE):
+            return None
+        rewritten, changes = sql, []
+        if not self.has_time_filter(sql):
+            target = self._guarded_source(masked)
+            if target is None:
+                return None
+            alias, join = target
+            days = int(self.config.get("default_window_days", 7))
+            condition = f"`{alias}`.`{self.time_column}` >= DATE_SUB({self._time_anchor()}, INTERVAL {days} DAY)"
+            if join is None:
+                rewritten = self._add_condition(sql, masked, condition)
+                changes.append(f"注入最近 {days} 天的时间窗口")
+            else:
+                rewritten = self._add_join_condition(sql, masked, join, condition)
+                if rewritten is None:
+                    return None
+                changes.append(f"在 LEFT JOIN {alias} 的 ON 条件中注入最近 {days} 天的时间窗口")
+        if add_limit and not re.search(r'\bLIMIT\b', masked, re.IGNORECASE):
+            limit = int(self.config.get('default_limit', 100000))
+            rewritten += f"\nLIMIT {limit}"
+            changes.append(f"因 {'、'.join(sorted(self.guarded_tables))} 全表扫描追加 LIMIT {limit}")
+        if not changes:
+            return None
+        return {"sql": rewritten, "changes": changes}
+
+    def _guarded_source(self, masked):
+        """
+        定位顶层查询中的受保护表，返回 (引用名, 连接子句匹配)：在 FROM 或内连接中时连接子句为 None，
+        由 LEFT JOIN 引入时为该连接；在外连接的可空一侧但无法改写 ON 条件时返回 None
+        """
+        joins = list(_JOIN_RE.finditer(masked))
+        for match in joins:
+            kind, table, alias = match.group(1).upper().split(), match.group(2).lower(), match.group(3)
+            if table not in self.guarded_tables:
+                continue
+            if "RIGHT" in kind:
+                # RIGHT JOIN 右侧是保留侧，但其左侧的表都成为可空一侧
+                break
+            if "LEFT" in kind:
+                name = alias if alias and alias.lower() not in _KEYWORDS else table
+                return (name, match) if "NATURAL" not in kind else None
+        # 受保护表在 FROM 或内连接中：其后任一 RIGHT JOIN 都会让它成为可空一侧
+        names = [a for a, t in _table_aliases(masked).items() if t in self.guarded_tables]
+        if not names:
+            return None
+        first = min((m.start() for m in joins if m.group(2).lower() in self.guarded_tables), default=0)
+        if any("RIGHT" in m.group(1).upper() and m.start() > first for m in joins):
+            return None
+        # 有别名时用别名引用（表名与别名同时出现在映射中，别名排在前面）
+        return sorted(names, key=lambda a: a in self.guarded_tables)[0], None
+
+    @staticmethod
+    def _add_join_condition(sql, masked, join, condition):
+        """在连接的 ON 条件中追加条件（原条件整体加括号）；使用 USING 等没有 ON 的连接返回 None"""
+        on = re.compile(r'\s+ON\b', re.IGNORECASE).match(masked, join.end())
+        if on is None:
+            return None
+        clause = _ON_END_RE.search(masked, on.end())
+        end = clause.start() if clause else len(sql)
+        tail = f"\n{sql[end:]}" if clause else ""
+        return f"{sql[:on.end()]} {condition} AND ({sql[on.end():end].strip()}){tail}"
+
+    @staticmethod
+    def _add_condition(sql, masked, condition):
+        """在顶层 WHERE 中追加条件（原条件整体加括号，避免 OR 优先级问题）；没有 WHERE 时新增"""
+        where = re.search(r'\bWHERE\b', masked, re.IGNORECASE)
+        start = where.end() if where else 0
+        clause = _CLAUSE_RE.search(masked, start)
+        end = clause.start() if clause else len(sql)
+        tail = f"\n{sql[end:]}" if clause else ""
+        if where:
+            return f"{sql[:start]} {condition} AND ({sql[start:end].strip()}){tail}"
+        return f"{sql[:end].rstrip()}\nWHERE {condition}{tail}"
+
+    def review(self, sql, regenerate=None):
+        """
+        执行前检查，返回:
+        {
+            "action": allow / rewrite / regenerate / reject / unchecked,
+            "sql": 实际应执行的SQL, "original_sql": 原SQL,
+            "estimate": 原SQL的估算, "final_estimate": 最终SQL的估算,
+            "reasons": 拦截原因, "message": 展示用的说明
+        }
+        regenerate: 可选回调，参数为给 LLM 的附加要求，返回新生成的SQL（失败时返回 None）
+        """
+        review = {"action": "allow", "sql": sql, "original_sql": sql, "estimate": None, "final_estimate": None,
+                  "reasons": [], "message": ""}
+        if not self.config.get("enabled", True):
+            return dict(review, action="unchecked", message="未启用代价检查")
+        try:
+            estimate = self.estimate(sql)
+        except Exception as e:
+            print(f"[SQLGuard] EXPLAIN 失败，跳过代价检查: {e}")
+            return dict(review, action="unchecked", message=f"无法获取执行计划，未做代价检查: {e}")
+        if estimate is None:
+            return dict(review, action="unchecked", message="数据源不支持 EXPLAIN，未做代价检查")
+
+        review["estimate"] = estimate
+        reasons = self.assess(sql, estimate)
+        if not reasons:
+            return self._finish(review, "allow", sql, estimate)
+        review["reasons"] = list(reasons)
+        print(f"[SQLGuard] 拦截: {'；'.join(reasons)}")
+
+        action = self.config.get("action", "rewrite")
+        candidate, candidate_estimate = sql, estimate
+        if action == "regenerate":
+            # 没有回调（如手动编辑的SQL）或重新生成仍不达标时，按 rewrite 处理
+            attempts = self.config.get("max_regenerations", 1) if regenerate is not None else 0
+            for attempt in range(attempts):
+                new_sql = regenerate(self.feedback(reasons))
+                if not new_sql:
+                    break
+                try:
+                    new_estimate = self.estimate(new_sql)
+                except Exception as e:
+                    print(f"[SQLGuard] 重新生成的SQL无法估算: {e}")
+                    break
+                review["regenerations"] = attempt + 1
+                candidate, candidate_estimate = new_sql, new_estimate
+                reasons = self.assess(new_sql, new_estimate)
+                if not reasons:
+                    return self._finish(review, "regenerate", new_sql, new_estimate)
+            action = "rewrite"
+
+        if action == "rewrite":
+            # LIMIT 只用于 kpibase 全表扫描；仅扫描行数超限时 LIMIT 并不减少扫描量，还会截断聚合结果
+            rewritten = self.rewrite(candidate, add_limit=bool(self.unfiltered_scans(candidate, candidate_estimate)))
+            if rewritten is None:
+                review["reasons"].append("无法自动改写")
+            else:
+                try:
+                    new_estimate = self.estimate(rewritten["sql"])
+                    remaining = self.assess(rewritten["sql"], new_estimate)
+                except Exception as e:
+                    new_estimate, remaining = None, [f"改写后的SQL无法估算: {e}"]
+                if not remaining:
+                    review["rewrites"] = rewritten["changes"]
+                    return self._finish(review, "rewrite", rewritten["sql"], new_estimate)
+                review["reasons"].extend(f"改写后仍不满足: {r}" for r in remaining)
+
+        review["action"] = "reject"
+        review["message"] = f"已拒绝执行：{'；'.join(review['reasons'])}"
+        return review
+
+    def _finish(self, review, action, sql, estimate):
+        review.update(action=action, sql=sql, final_estimate=estimate)
+        labels = {"allow": "放行", "rewrite": f"已自动改写（{'；'.join(review.get('rewrites', []))}）",
+                  "regenerate": "已重新生成SQL"}
+        message = f"预计扫描 {estimate['rows_examined']:,} 行"
+        if estimate.get("query_cost") is not None:
+            message += f"（优化器代价 {estimate['query_cost']:,.0f}）"
+        if action != "allow":
+            original = review["estimate"]["rows_examined"]
+            message = f"{labels[action]}：{'；'.join(review['reasons'])}。原SQL预计扫描 {original:,} 行，现{message}"
+        review["message"] = message
+        return review
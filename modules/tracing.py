@@ -0,0 +1,240 @@
+import json
+import time
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+from config.settings import TRACING_CONFIG
+
+# 当前请求的追踪和当前活动的 span；StagePipeline 提交任务时会复制上下文，线程池中的阶段自动挂到调用方的 span 下
+_current_trace = contextvars.ContextVar("text2sql_trace", default=None)
+_current_span = contextvars.ContextVar("text2sql_span", default=None)
+
+
+class Span:
+    """一个阶段的耗时记录，附带字节数、token 数等属性"""
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount):
+        """累加数值属性（如同一阶段内多次调用的 token 数）"""
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self, error=None):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._start
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self):
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._start
+        return duration * 1000
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start_ns - self.trace.start_ns) / 1e6, 2),
+            "duration_ms": round(self.duration_ms, 2),
+            "attributes": dict(self.attributes),
+            "error": self.error
+        }
+
+    def to_otel(self):
+        """OTLP/JSON 格式的 span"""
+        end_ns = self.start_ns + int(self.duration_ms * 1e6)
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [_otel_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """未开启追踪时使用，所有记录操作为空"""
+    name = None
+    duration_ms = 0.0
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otel_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Trace:
+    """一次请求（ask / generate_sql_only / 问题润色等）的全部 span"""
+
+    def __init__(self, name):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.spans = []
+        self._lock = threading.Lock()
+        self.root = self.start_span(name)
+
+    def start_span(self, name, parent_id=None, attributes=None):
+        span = Span(self, name, parent_id=parent_id, attributes=attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @property
+    def duration_ms(self):
+        return self.root.duration_ms
+
+    def breakdown(self):
+        """按开始时间排序的 span 列表（字典形式），用于界面展示和基准报告"""
+        with self._lock:
+            spans = list(self.spans)
+        return [span.to_dict() for span in sorted(spans, key=lambda s: s.start_ns)]
+
+    def totals(self, key):
+        """汇总所有 span 上某个数值属性，如 llm.prompt_tokens"""
+        with self._lock:
+            return sum(span.attributes.get(key, 0) for span in self.spans
+                       if isinstance(span.attributes.get(key, 0), (int, float)))
+
+    def to_otel(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otel_attribute("service.name", TRACING_CONFIG.get("service_name", "text2sql"))]},
+                "scopeSpans": [{
+                    "scope": {"name": "text2sql.tracing"},
+                    "spans": [span.to_otel() for span in spans]
+                }]
+            }]
+        }
+
+    def export(self, path):
+        """以 JSON Lines 追加写入 OTLP/JSON，可被 OpenTelemetry Collector 的 otlpjsonfile 接收器读取"""
+        line = json.dumps(self.to_otel(), ensure_ascii=False, default=str)
+        with _export_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_export_lock = threading.Lock()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def record(key, value):
+    """在当前 span 上设置属性；未开启追踪时为空操作"""
+    current_span().set(key, value)
+
+
+def add(key, amount):
+    """在当前 span 上累加数值属性；未开启追踪时为空操作"""
+    current_span().add(key, amount)
+
+
+def start_span(name, **attributes):
+    """创建但不激活一个 span（用于生成器等跨越多次调用的阶段），需显式调用 end()"""
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    return trace.start_span(name, parent_id=parent.span_id if parent else None, attributes=attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """在当前追踪中记录一个阶段；没有活动的追踪时不产生任何开销"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield NOOP_SPAN
+        return
+    active = start_span(name, **attributes)
+    token = _current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.end(error=e)
+        raise
+    finally:
+        active.end()
+        _current_span.reset(token)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """
+    开始一次追踪并返回 Trace；已处于追踪中时（如 ask 内部调用 generate_sql_only）只新建子 span，
+    返回外层的 Trace。追踪结束时若配置了 export_path，则导出为 OTLP/JSON。
+    """
+    existing = _current_trace.get()
+    if existing is not None or not TRACING_CONFIG.get("enabled", True):
+        with span(name, **attributes):
+            yield existing
+        return
+
+    trace = Trace(name)
+    trace.root.attributes.update(attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.end(error=e)
+        raise
+    finally:
+        trace.root.end()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        export_path = TRACING_CONFIG.get("export_path")
+        if export_path:
+            try:
+                trace.export(export_path)
+            except Exception as e:
+                print(f"导出追踪数据失败: {e}")
@@ -1,24 +1,44 @@
 import yaml
 import os
-from modules.embedding_manager import QwenEmbedding
+import re
+from config.settings import TRAINING_MANIFEST_PATH
+from modules.providers import create_embedder
 from modules.vector_store import LocalChromaDB
+from modules.training_manifest import TrainingManifest
 
 class BatchTrainer:
-    def __init__(self):
-        self.embedder = QwenEmbedding()
-        self.vector_db = LocalChromaDB()
+    def __init__(self, embedder=None, vector_db=None, manifest_path=None):
+        self.embedder = embedder or create_embedder()
+        self.vector_db = vector_db or LocalChromaDB()
+        self.manifest = TrainingManifest(manifest_path or TRAINING_MANIFEST_PATH)
+
+    def _sync_manifest(self):
+        """向量库被外部清空后，清单随之失效"""
+        if not self.manifest.is_empty() and self.vector_db.get_collection_info().get("count") == 0:
+            print("向量库为空，重置训练清单。")
+            self.manifest.clear()
 
     def train_from_metrics_yaml(self, yaml_path):
         """
         从指标定义YAML文件中加载并训练，优化检索精度。
         每个指标会被拆分成多个独立的、专注的文档。
+        文件未变化时直接跳过；否则只处理新增、修改、删除的指标。
         """
         try:
-            with open(yaml_path, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
+            with open(yaml_path, 'rb') as f:
+                content = f.read()
         except FileNotFoundError:
             print(f"警告: 指标定义文件未找到于 {yaml_path}")
             return 0
+
+        self._sync_manifest()
+        file_hash = TrainingManifest.hash_bytes(content)
+        if self.manifest.get_file_hash(yaml_path) == file_hash:
+            print("指标文件未发生变化，跳过训练。")
+            return 0
+
+        try:
+            data = yaml.safe_load(content.decode('utf-8'))
         except Exception as e:
             print(f"读取或解析YAML文件失败: {e}")
             return 0
@@ -27,8 +47,8 @@ class BatchTrainer:
         if not metrics:
             print("YAML文件中没有找到'metrics'列表。")
             return 0
-            
-        training_count = 0
+
+        items = {}
         for metric in metrics:
             name = metric.get('name', '')
             formula = metric.get('formula', '')
@@ -39,69 +59,115 @@ class BatchTrainer:
                 continue
 
             # 为每个指标创建多个专注的文档，并附带元数据
-            # 1. 指标名称本身
-            doc1_text = name
-            meta1 = {"type": "metric_name", "name": name, "formula": formula}
-            if not self.vector_db.has_document(doc1_text):
-                embedding1 = self.embedder.embed(doc1_text)
-                self.vector_db.add_embedding(doc1_text, embedding1, metadata=meta1)
-                training_count += 1
-
-            # 2. 指标名称 + 公式（最重要）
-            doc2_text = f"指标 {name} 的计算公式是：{formula}"
-            meta2 = {"type": "metric_formula", "name": name, "formula": formula}
-            if not self.vector_db.has_document(doc2_text):
-                embedding2 = self.embedder.embed(doc2_text)
-                self.vector_db.add_embedding(doc2_text, embedding2, metadata=meta2)
-                training_count += 1
-            
-            # 3. 指标名称 + 描述
-            doc3_text = f"指标 {name} 的含义是 {description}，单位是 {unit}。"
-            meta3 = {"type": "metric_description", "name": name}
-            if not self.vector_db.has_document(doc3_text):
-                embedding3 = self.embedder.embed(doc3_text)
-                self.vector_db.add_embedding(doc3_text, embedding3, metadata=meta3)
-                training_count += 1
-
+            items[name] = (TrainingManifest.hash_item(metric), [
+                # 1. 指标名称本身
+                (name, {"type": "metric_name", "name": name, "formula": formula}),
+                # 2. 指标名称 + 公式（最重要）
+                (f"指标 {name} 的计算公式是：{formula}", {"type": "metric_formula", "name": name, "formula": formula}),
+                # 3. 指标名称 + 描述
+                (f"指标 {name} 的含义是 {description}，单位是 {unit}。", {"type": "metric_description", "name": name}),
+            ])
+
+        source = f"metrics:{os.path.abspath(yaml_path)}"
+        training_count = self._apply_items(source, items, complete=True, label="指标")
+        if training_count is None:
+            return 0
 
+        self.manifest.set_file_hash(yaml_path, file_hash)
+        self.manifest.save()
         print(f"从YAML文件训练了 {training_count} 个新文档。")
         return training_count
 
+    def _apply_items(self, source, items, complete=False, label=""):
+        """
+        按清单差异增量同步一个来源的条目。
+        items: {条目键: (条目哈希, [(文档文本, 元数据), ...])}
+        complete: items 是否为该来源的全集（全集时清单中多出的条目会被删除）
+        返回写入的新文档数；写入失败时返回 None。
+        """
+        item_hashes = {key: digest for key, (digest, _) in items.items()}
+        added, changed, removed = self.manifest.diff(source, item_hashes, complete=complete)
+        if not (added or changed or removed):
+            return 0
+
+        # 修改和删除的条目：先移除旧向量（仍被其他条目引用的除外）
+        stale_ids = set()
+        for key in changed + removed:
+            stale_ids.update(self.manifest.remove_item(source, key))
+        stale_ids -= self.manifest.referenced_doc_ids()
+        if stale_ids:
+            self.vector_db.delete_documents(stale_ids)
+
+        pending = {}
+        for key in added + changed:
+            for text, meta in items[key][1]:
+                pending.setdefault(text, meta)
+
+        try:
+            written = self._write_new(list(pending), list(pending.values()))
+        except Exception as e:
+            print(f"训练{label}失败: {e}")
+            self.manifest.save()
+            return None
+
+        for key in added + changed:
+            doc_ids = [self.vector_db._generate_id(text) for text, _ in items[key][1]]
+            self.manifest.record_item(source, key, item_hashes[key], doc_ids)
+        self.manifest.save()
+
+        print(f"[{label}] 新增 {len(added)} 条，修改 {len(changed)} 条，删除 {len(removed)} 条，写入 {written} 个文档。")
+        return written
+
+    def _write_new(self, texts, metadatas):
+        """一次查重，只为尚未入库的文本生成向量并批量写入"""
+        metas_by_text = dict(zip(texts, metadatas))
+        new_texts = self.vector_db.filter_new_texts(texts)
+        if not new_texts:
+            return 0
+        embeddings = self.embedder.embed_batch(new_texts)
+        return self.vector_db.add_embeddings_bulk(new_texts, embeddings, [metas_by_text[text] for text in new_texts],
+                                                  known_new=True)
+
+    def _embed_and_add(self, texts, metadatas, label):
+        """批量生成向量并批量写入向量库，返回成功写入的数量"""
+        if not texts:
+            return 0
+        try:
+            embeddings = self.embedder.embed_batch(texts)
+            return self.vector_db.add_embeddings_bulk(texts, embeddings, metadatas)
+        except Exception as e:
+            print(f"训练{label}失败: {e}")
+            return 0
 
     def train_from_ddl(self, ddl_list):
-        success_count = 0
-        for ddl in ddl_list:
-            try:
-                embedding = self.embedder.embed(ddl)
-                self.vector_db.add_embedding(ddl, embedding, metadata={"type": "ddl"})
-                success_count += 1
-            except Exception as e:
-                print(f"训练DDL失败: {e}")
-        return success_count
+        return self._embed_and_add(ddl_list, [{"type": "ddl"} for _ in ddl_list], "DDL")
 
     def train_from_docs(self, doc_list):
-        success_count = 0
-        for doc in doc_list:
-            try:
-                embedding = self.embedder.embed(doc)
-                self.vector_db.add_embedding(doc, embedding, metadata={"type": "doc"})
-                success_count += 1
-            except Exception as e:
-                print(f"训练文档失败: {e}")
-        return success_count
+        return self._embed_and_add(doc_list, [{"type": "doc"} for _ in doc_list], "文档")
 
-    def train_from_qa_pairs(self, qa_pairs):
-        success_count = 0
+    @staticmethod
+    def _valid_qa_pairs(qa_pairs):
+        """
+        取出格式完整的问答对，返回 [(问题, SQL), ...]；
+        缺少字段或不是字典的条目单独跳过并打印，不影响同批其他问答对
+        """
+        valid, skipped = [], 0
         for pair in qa_pairs:
             try:
-                q = pair["question"]
-                sql = pair["sql"]
-                embedding = self.embedder.embed(q)
-                self.vector_db.add_embedding(q, embedding, metadata={"type": "qa", "sql": sql})
-                success_count += 1
-            except Exception as e:
-                print(f"训练问答对失败: {e}")
-        return success_count
+                question, sql = pair["question"], pair["sql"]
+            except (KeyError, TypeError) as e:
+                print(f"跳过格式错误的问答对 {pair!r}: {e}")
+                skipped += 1
+                continue
+            valid.append((question, sql))
+        if skipped:
+            print(f"共跳过 {skipped} 个格式错误的问答对。")
+        return valid
+
+    def train_from_qa_pairs(self, qa_pairs):
+        pairs = self._valid_qa_pairs(qa_pairs)
+        return self._embed_and_add([question for question, _ in pairs],
+                                   [{"type": "qa", "sql": sql} for _, sql in pairs], "问答对")
 
     def train_all(self, ddl_list, doc_list, qa_pairs):
         ddl_count = self.train_from_ddl(ddl_list)
@@ -113,39 +179,39 @@ class BatchTrainer:
             "qa": qa_count
         }
 
+    @staticmethod
+    def _ddl_key(ddl):
+        """DDL 以表名为条目键，表结构变化时替换旧的DDL"""
+        match = re.search(r'CREATE\s+TABLE\s+`?([\w\u4e00-\u9fff]+)`?', ddl, re.IGNORECASE)
+        return match.group(1) if match else TrainingManifest.hash_item(ddl)
+
     def train_incremental(self, ddl_list, doc_list, qa_pairs):
-        counts = {"ddl": 0, "doc": 0, "qa": 0}
-        
+        """
+        增量训练：清单中哈希未变的条目直接跳过；
+        DDL 按表名、问答对按问题识别修改，修改后旧向量会被替换；格式错误的问答对跳过。
+        """
+        self._sync_manifest()
+
+        ddl_items = {}
         for ddl in ddl_list:
-            if not self.vector_db.has_document(ddl):
-                try:
-                    embedding = self.embedder.embed(ddl)
-                    self.vector_db.add_embedding(ddl, embedding, metadata={"type": "ddl"})
-                    counts["ddl"] += 1
-                except Exception as e:
-                    print(f"训练DDL失败: {e}")
-                    
+            ddl_items[self._ddl_key(ddl)] = (TrainingManifest.hash_item(ddl), [(ddl, {"type": "ddl"})])
+
+        doc_items = {}
         for doc in doc_list:
-            if not self.vector_db.has_document(doc):
-                try:
-                    embedding = self.embedder.embed(doc)
-                    self.vector_db.add_embedding(doc, embedding, metadata={"type": "doc"})
-                    counts["doc"] += 1
-                except Exception as e:
-                    print(f"训练文档失败: {e}")
-                    
-        for pair in qa_pairs:
-            q = pair["question"]
-            sql = pair["sql"]
-            if not self.vector_db.has_document(q):
-                try:
-                    embedding = self.embedder.embed(q)
-                    self.vector_db.add_embedding(q, embedding, metadata={"type": "qa", "sql": sql})
-                    counts["qa"] += 1
-                except Exception as e:
-                    print(f"训练问答对失败: {e}")
-                    
-        return counts
+            digest = TrainingManifest.hash_item(doc)
+            doc_items[digest] = (digest, [(doc, {"type": "doc"})])
 
+        qa_items = {}
+        for q, sql in self._valid_qa_pairs(qa_pairs):
+            qa_items[q] = (TrainingManifest.hash_item(sql), [(q, {"type": "qa", "sql": sql})])
 
+        return {
+            "ddl": self._apply_items("ddl", ddl_items, label="DDL") or 0,
+            "doc": self._apply_items("doc", doc_items, label="文档") or 0,
+            "qa": self._apply_items("qa", qa_items, label="问答对") or 0
+        }
 
+    def clear_all(self):
+        """清空向量库及训练清单"""
+        self.manifest.clear()
+        return self.vector_db.clear_all()
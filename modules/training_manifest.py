@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+
+class TrainingManifest:
+    """
+    训练清单：记录每个源文件的哈希，以及每个源条目（指标、问答对、DDL）的哈希和它派生出的向量ID。
+    再次训练时只需对比清单即可得到新增、变更、删除的条目，无需访问向量库。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.data = self._load()
+
+    def _empty(self):
+        return {"version": self.VERSION, "files": {}, "items": {}}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return self._empty()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                return self._empty()
+            return data
+        except Exception as e:
+            print(f"读取训练清单失败，将重新建立: {e}")
+            return self._empty()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.data = self._empty()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_empty(self):
+        return not self.data["files"] and not self.data["items"]
+
+    @staticmethod
+    def hash_bytes(content):
+        return hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def hash_item(item):
+        """对任意可JSON序列化的条目计算稳定哈希"""
+        raw = json.dumps(item, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_file_hash(self, path):
+        return self.data["files"].get(os.path.abspath(path))
+
+    def set_file_hash(self, path, digest):
+        self.data["files"][os.path.abspath(path)] = digest
+
+    def get_item(self, source, key):
+        return self.data["items"].get(source, {}).get(key)
+
+    def diff(self, source, item_hashes, complete=True):
+        """
+        对比当前条目与清单记录。
+        item_hashes: {条目键: 哈希}
+        complete: 为 True 时表示传入的是该来源的全集，清单中多出的条目视为已删除。
+        返回 (added, changed, removed) 三个键列表。
+        """
+        recorded = self.data["items"].get(source, {})
+        added, changed = [], []
+        for key, digest in item_hashes.items():
+            entry = recorded.get(key)
+            if entry is None:
+                added.append(key)
+            elif entry["hash"] != digest:
+                changed.append(key)
+        removed = [key for key in recorded if key not in item_hashes] if complete else []
+        return added, changed, removed
+
+    def record_item(self, source, key, digest, doc_ids):
+        self.data["items"].setdefault(source, {})[key] = {"hash": digest, "doc_ids": list(doc_ids)}
+
+    def remove_item(self, source, key):
+        """删除条目记录，返回它原先派生出的向量ID"""
+        entry = self.data["items"].get(source, {}).pop(key, None)
+        return entry["doc_ids"] if entry else []
+
+    def referenced_doc_ids(self):
+        """清单中所有仍被引用的向量ID"""
+        ids = set()
+        for entries in self.data["items"].values():
+            for entry in entries.values():
+                ids.update(entry["doc_ids"])
+        return ids
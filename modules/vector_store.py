@@ -1,13 +1,25 @@
 import chromadb
 import hashlib
+import threading
 from typing import List, Dict, Any, Tuple
 from config.settings import CHROMA_DB_PATH
+from modules.lexical import LexicalIndex, reciprocal_rank_fusion
+from modules import tracing
+
+# 同一进程内指向同一库路径的实例共享词法索引（训练器写入后检索端立即可见）
+# _LEXICAL_INDEXES: {库键: (索引, 构建/同步时的版本号)}；_LEXICAL_VERSIONS: {库键: 写入版本号}，每次写入递增
+_LEXICAL_INDEXES = {}
+_LEXICAL_VERSIONS = {}
+_LEXICAL_LOCK = threading.Lock()
 
 class LocalChromaDB:
-    def __init__(self):
+    def __init__(self, path=None, collection_name="nl2sql"):
         # ChromaDB 1.0+ 版本的初始化方式
-        self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        self.collection = self.client.get_or_create_collection(name="nl2sql")
+        self.path = path or CHROMA_DB_PATH
+        self.collection_name = collection_name
+        self.client = chromadb.PersistentClient(path=self.path)
+        self.collection = self.client.get_or_create_collection(name=collection_name)
+        self._lexical_key = (self.path, collection_name)
     
     def _generate_id(self, text):
         """根据文本内容生成唯一ID（哈希）"""
@@ -33,7 +45,100 @@ class LocalChromaDB:
             embeddings=[embedding],
             metadatas=[metadata or {}]
         )
+        self._lexical_add([doc_id], [text], [metadata])
+
+    def _lexical_index(self):
+        """
+        获取词法索引：首次使用时由集合中的全部文档构建，之后只比较写入版本号（不访问 Chroma）。
+        本进程内的写入会就地同步索引；其他进程写入的文档需调用 refresh_lexical_index 后可见。
+        """
+        entry = _LEXICAL_INDEXES.get(self._lexical_key)
+        if entry is not None and entry[1] == _LEXICAL_VERSIONS.get(self._lexical_key, 0):
+            return entry[0]
+        with _LEXICAL_LOCK:
+            version = _LEXICAL_VERSIONS.get(self._lexical_key, 0)
+            entry = _LEXICAL_INDEXES.get(self._lexical_key)
+            if entry is not None and entry[1] == version:
+                return entry[0]
+            index = LexicalIndex()
+            count = self.collection.count()
+            results = self.collection.get(include=["documents", "metadatas"]) if count else None
+            if results and results.get("ids"):
+                index.add(results["ids"], results["documents"], results.get("metadatas"))
+            _LEXICAL_INDEXES[self._lexical_key] = (index, version)
+            return index
+
+    def _lexical_sync(self, update):
+        """写入后递增版本号；索引已构建时就地更新并标记为最新，未构建时首次检索会完整构建"""
+        with _LEXICAL_LOCK:
+            version = _LEXICAL_VERSIONS.get(self._lexical_key, 0) + 1
+            _LEXICAL_VERSIONS[self._lexical_key] = version
+            entry = _LEXICAL_INDEXES.get(self._lexical_key)
+            if entry is not None and entry[1] == version - 1:
+                update(entry[0])
+                _LEXICAL_INDEXES[self._lexical_key] = (entry[0], version)
+
+    def _lexical_add(self, ids, texts, metadatas):
+        self._lexical_sync(lambda index: index.add(ids, texts, metadatas))
+
+    def refresh_lexical_index(self):
+        """集合被其他进程修改后调用，下次检索时重新构建词法索引"""
+        with _LEXICAL_LOCK:
+            _LEXICAL_VERSIONS[self._lexical_key] = _LEXICAL_VERSIONS.get(self._lexical_key, 0) + 1
     
+    def get_existing_ids(self, ids, chunk_size=1000):
+        """一次性（按块）查询哪些ID已存在于集合中"""
+        existing = set()
+        ids = list(ids)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            try:
+                result = self.collection.get(ids=chunk, include=[])
+                existing.update(result.get('ids', []) if result else [])
+            except Exception as e:
+                print(f"批量查重时出错: {e}")
+        return existing
+
+    def filter_new_texts(self, texts):
+        """返回尚未入库的文本（保持原顺序并去重）"""
+        unique_texts = list(dict.fromkeys(texts))
+        existing = self.get_existing_ids(self._generate_id(text) for text in unique_texts)
+        return [text for text in unique_texts if self._generate_id(text) not in existing]
+
+    def add_embeddings_bulk(self, texts, embeddings, metadatas=None, chunk_size=500, known_new=False):
+        """
+        批量写入向量：一次查重，仅对新文档分块 upsert。
+        known_new: 调用方已用 filter_new_texts 查过重时为 True，不再重复查询集合。
+        返回实际写入的文档数量。
+        """
+        metadatas = metadatas or [None] * len(texts)
+        records = {}
+        for text, embedding, metadata in zip(texts, embeddings, metadatas):
+            records.setdefault(self._generate_id(text), (text, embedding, metadata or None))
+
+        existing = set() if known_new else self.get_existing_ids(records)
+        new_ids = [doc_id for doc_id in records if doc_id not in existing]
+
+        for start in range(0, len(new_ids), chunk_size):
+            chunk = new_ids[start:start + chunk_size]
+            self.collection.upsert(
+                ids=chunk,
+                documents=[records[doc_id][0] for doc_id in chunk],
+                embeddings=[records[doc_id][1] for doc_id in chunk],
+                metadatas=[records[doc_id][2] for doc_id in chunk]
+            )
+            self._lexical_add(chunk, [records[doc_id][0] for doc_id in chunk],
+                              [records[doc_id][2] for doc_id in chunk])
+        return len(new_ids)
+
+    def delete_documents(self, ids, chunk_size=1000):
+        """按ID批量删除文档"""
+        ids = list(ids)
+        for start in range(0, len(ids), chunk_size):
+            self.collection.delete(ids=ids[start:start + chunk_size])
+        self._lexical_sync(lambda index: index.remove(ids))
+        return len(ids)
+
     def search(self, embedding, top_k=5):
         """向量搜索（返回文档列表）"""
         try:
@@ -50,12 +155,13 @@ class LocalChromaDB:
             print(f"搜索失败: {e}")
             return []
     
-    def search_with_metadata(self, embedding, top_k=5) -> Tuple[List[str], List[Dict]]:
-        """向量搜索（返回文档和元数据）"""
+    def search_with_metadata(self, embedding, top_k=5, where=None) -> Tuple[List[str], List[Dict]]:
+        """向量搜索（返回文档和元数据）；where 为元数据过滤条件，如 {"type": "qa"}"""
         try:
             results = self.collection.query(
                 query_embeddings=[embedding],
-                n_results=top_k
+                n_results=top_k,
+                where=where
             )
             
             if results and results.get("documents") and len(results["documents"]) > 0:
@@ -64,12 +170,35 @@ class LocalChromaDB:
                 # 确保返回相同长度的列表
                 if len(metas) < len(docs):
                     metas.extend([{}] * (len(docs) - len(metas)))
+                tracing.record("vector.results", len(docs))
+                tracing.record("vector.result_bytes", sum(len(doc.encode("utf-8")) for doc in docs))
                 return docs, metas
             return [], []
         except Exception as e:
             print(f"搜索失败: {e}")
             return [], []
 
+    def lexical_search(self, query_text, top_k=5, where=None) -> Tuple[List[str], List[Dict]]:
+        """BM25 词法检索（不需要向量），返回文档和元数据"""
+        try:
+            hits = self._lexical_index().search(query_text, top_k=top_k, where=where)
+            tracing.record("lexical.results", len(hits))
+            return [hit[1] for hit in hits], [hit[2] for hit in hits]
+        except Exception as e:
+            print(f"词法检索失败: {e}")
+            return [], []
+
+    def hybrid_search(self, vector_results, lexical_results, top_k=5, rrf_k=60) -> Tuple[List[str], List[Dict]]:
+        """
+        用倒数排名融合（RRF）合并向量检索和词法检索的结果（均为 (文档列表, 元数据列表)），
+        任一路为空时即退化为另一路的结果。
+        """
+        ranked_lists = []
+        for docs, metas in (vector_results, lexical_results):
+            ranked_lists.append([(self._generate_id(doc), doc, meta or {}) for doc, meta in zip(docs, metas)])
+        fused = reciprocal_rank_fusion(ranked_lists, top_k=top_k, k=rrf_k)
+        return [item[1] for item in fused], [item[2] for item in fused]
+
     def has_document(self, text):
         """基于ID查重"""
         doc_id = self._generate_id(text)
@@ -92,8 +221,9 @@ class LocalChromaDB:
         """清空所有数据"""
         try:
             # 方法1：删除并重新创建collection
-            self.client.delete_collection("nl2sql")
-            self.collection = self.client.create_collection("nl2sql")
+            self.client.delete_collection(self.collection_name)
+            self.collection = self.client.create_collection(self.collection_name)
+            self._lexical_sync(lambda index: index.clear())
             print("ChromaDB已清空")
             return True
         except Exception as e:
@@ -0,0 +1,62 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from modules.analysis import STATS, grouped_stats, summarize_frame, to_categorical
+
+
+def make_frame(rows=20_000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "省份": rng.choice(["广东", "江苏", "浙江", "四川"], rows),
+        "地市": rng.choice([f"地市{i}" for i in range(30)], rows),
+        "frequency_band": rng.choice(["band28", "band41", "n78"], rows),
+        "流量": rng.gamma(2.0, 100.0, rows),
+        "掉线率": rng.random(rows),
+        "用户数": rng.integers(0, 500, rows)
+    })
+    # 指标列和维度列中都有空值
+    df.loc[rng.random(rows) < 0.05, "流量"] = np.nan
+    df.loc[rng.random(rows) < 0.02, "地市"] = None
+    return df
+
+
+def test_analysis():
+    print("测试预分析摘要...")
+    df = make_frame()
+    metrics = ["流量", "掉线率", "用户数"]
+
+    # 1. grouped_stats 与 groupby().agg 一致
+    for dims in (["省份"], ["省份", "地市"], ["省份", "地市", "frequency_band"]):
+        print(f"\n1. 按 {dims} 分组...")
+        frame = to_categorical(df, dims)
+        actual = grouped_stats(frame, dims, metrics)
+        expected = frame.groupby(dims, observed=True, sort=True)[metrics].agg(STATS)
+        pd.testing.assert_frame_equal(actual, expected.astype(np.float64), check_exact=False, rtol=1e-9,
+                                      check_index_type=False)
+        print(f"✅ {len(actual)} 个分组，与 groupby().agg 结果一致")
+
+    # 2. 整体统计包含维度为空值的行
+    print("\n2. 整体统计...")
+    summary = summarize_frame(df, dimension_cols=["省份", "地市"])
+    expected = df[metrics].agg(STATS).T
+    overall = summary["overall"]
+    for metric in metrics:
+        for stat in STATS:
+            assert np.isclose(float(overall.loc[metric, stat]), float(expected.loc[metric, stat])), (metric, stat)
+    grouped_count = summary["grouped"][("流量", "count")].sum()
+    assert grouped_count < overall.loc["流量", "count"]
+    print(f"✅ 整体统计与全列计算一致（分组覆盖 {int(grouped_count)} 行，整体 {int(overall.loc['流量', 'count'])} 行）")
+
+    # 3. 文本列词表
+    print("\n3. 文本列词表...")
+    assert summary["categories"]["省份"]["nunique"] == 4
+    print(f"✅ 省份取值: {dict(summary['categories']['省份']['top'])}")
+
+    print("\n所有测试完成！")
+
+
+if __name__ == "__main__":
+    test_analysis()
@@ -0,0 +1,71 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from utils.downsample import lttb_indices, minmax_indices, downsample_indices, downsample_for_plot
+
+
+def test_downsample():
+    print("测试时间序列降采样...")
+    rng = np.random.default_rng(0)
+    n = 100_000
+    x = np.arange(n, dtype=np.float64)
+    y = np.sin(x / 2000) + rng.normal(0, 0.05, n)
+    # 单点尖峰和低谷（如话务突增、掉线率异常）
+    peak, dip = 31_337, 77_777
+    y[peak], y[dip] = 50.0, -50.0
+
+    # 1. LTTB：点数固定、含首尾点、升序、保留尖峰
+    print("\n1. LTTB 选点...")
+    idx = lttb_indices(x, y, 500)
+    assert len(idx) == 500 and idx[0] == 0 and idx[-1] == n - 1
+    assert np.all(np.diff(idx) > 0)
+    assert peak in idx and dip in idx
+    print(f"✅ 保留 {len(idx)} 个点，尖峰与低谷均保留")
+
+    # 2. min-max：每桶最小值和最大值一定保留
+    print("\n2. min-max 选点...")
+    idx = minmax_indices(y, 250)
+    assert len(idx) <= 2 * 250 + 2 and idx[0] == 0 and idx[-1] == n - 1
+    assert peak in idx and dip in idx
+    size = -(-n // 250)
+    for start in range(0, n, size):
+        block = y[start:start + size]
+        assert start + int(block.argmax()) in idx and start + int(block.argmin()) in idx
+    print(f"✅ 保留 {len(idx)} 个点，每桶极值均保留")
+
+    # 3. 含空值的序列
+    print("\n3. 含空值的序列...")
+    y_nan = y.copy()
+    y_nan[1000:5000] = np.nan
+    for method in ("lttb", "minmax", "minmaxlttb"):
+        idx = downsample_indices(x, y_nan, 500, method)
+        assert len(idx) <= 502 and peak in idx, method
+    print("✅ 三种方法均正常选点并保留尖峰")
+
+    # 4. 数据框：按维度分组、按时间排序后降采样
+    print("\n4. 数据框降采样...")
+    times = pd.date_range("2025-01-01", periods=n // 2, freq="min")
+    df = pd.DataFrame({
+        "开始时间": np.tile(times, 2),
+        "小区": ["小区A"] * (n // 2) + ["小区B"] * (n // 2),
+        "流量": y
+    }).sample(frac=1.0, random_state=0)
+    sampled, info = downsample_for_plot(df, max_points=2000)
+    assert info is not None and len(sampled) <= 2100, info
+    assert sampled["开始时间"].is_monotonic_increasing
+    assert sampled["流量"].max() == 50.0 and sampled["流量"].min() == -50.0
+    assert set(sampled["小区"]) == {"小区A", "小区B"}
+    print(f"✅ {info['original_rows']} 行降为 {info['rows']} 行，峰值保留")
+
+    small = df.head(100)
+    assert downsample_for_plot(small, max_points=2000)[0] is small
+    print("✅ 未超过预算时原样返回")
+
+    print("\n所有测试完成！")
+
+
+if __name__ == "__main__":
+    test_downsample()
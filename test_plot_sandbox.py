@@ -0,0 +1,51 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from utils.plot_sandbox import PlotSandboxPool
+
+CHART_CODE = """
+chart = Bar().add_xaxis(df['省份'].tolist()).add_yaxis('基站数量', df['基站数量'].tolist())
+"""
+
+
+def test_plot_sandbox():
+    print("测试作图沙箱进程池...")
+    df = pd.DataFrame({"省份": ["广东", "江苏", "浙江"], "基站数量": [120, 80, 95]})
+    pool = PlotSandboxPool(workers=1, timeout=10)
+    try:
+        # 1. 正常作图
+        print("\n1. 正常作图...")
+        result = pool.run(CHART_CODE, df)
+        assert result["success"], result
+        assert result["html"]
+        print(f"✅ 作图成功，HTML 长度: {len(result['html'])}")
+
+        # 2. 死循环在墙钟超时后被终止
+        print("\n2. 作图超时...")
+        result = pool.run("while True:\n    pass", df, timeout=2)
+        assert not result["success"] and "超时" in result["error"], result
+        print(f"✅ 超时被终止: {result['error']}")
+
+        # 3. 子进程崩溃
+        print("\n3. 子进程崩溃...")
+        result = pool.run("import os\nos._exit(1)", df)
+        assert not result["success"], result
+        print(f"✅ 崩溃被捕获: {result['error']}")
+
+        # 4. 超时和崩溃的进程被替换，后续作图不受影响
+        print("\n4. 重启后的进程继续作图...")
+        result = pool.run(CHART_CODE, df)
+        assert result["success"], result
+        stats = pool.get_stats()
+        assert stats["timeouts"] == 1 and stats["crashes"] == 1 and stats["respawns"] == 2, stats
+        print(f"✅ 作图成功，进程池统计: {stats}")
+    finally:
+        pool.shutdown()
+
+    print("\n所有测试完成！")
+
+
+if __name__ == "__main__":
+    test_plot_sandbox()
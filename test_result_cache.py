@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import tempfile
+import threading
+import pandas as pd
+from sqlalchemy import create_engine
+from modules.db_connector import MySQLConnector
+from modules.result_cache import QueryResultCache
+
+
+def make_connector(workdir, rows=1000):
+    """用 SQLite 文件库代替 MySQL 构造连接器，只测试流式读取与结果缓存的配合"""
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'fixture.sqlite3')}")
+    pd.DataFrame({"ID": range(rows), "value": range(rows)}).to_sql("kpibase", engine, index=False)
+    connector = MySQLConnector.__new__(MySQLConnector)
+    connector.engine = engine
+    connector.query_timeout_ms = 0
+    connector.max_connections = 5
+    connector._stats_lock = threading.Lock()
+    connector._pool_stats = {"connects": 0, "checkouts": 0, "waits": 0, "wait_seconds": 0.0,
+                             "pool_timeouts": 0, "query_timeouts": 0}
+    connector._schema_cache = {}
+    connector.result_cache = QueryResultCache(os.path.join(workdir, "result_cache.sqlite3"))
+    # 新鲜度标记设为刚检查过，避免在夹具库上执行 kpibase 的新鲜度查询
+    connector._freshness = (None, time.time() + 3600)
+    return connector
+
+
+def test_result_cache():
+    print("测试查询结果缓存与流式上限...")
+    workdir = tempfile.mkdtemp(prefix="result_cache_test_")
+    db = make_connector(workdir)
+    sql = "SELECT * FROM kpibase"
+
+    # 1. 被行数上限截断的结果不写入缓存
+    print("\n1. 截断的查询...")
+    truncated = db.concat_chunks(db.iter_query(sql, chunk_size=100, max_rows=250, use_cache=True))
+    assert len(truncated) == 250 and truncated.attrs["truncated"]
+    assert db.result_cache.get(sql) is None
+    print(f"✅ 截断为 {len(truncated)} 行，未写入缓存")
+
+    # 2. 之后不限制行数的查询拿到完整结果，并写入缓存
+    print("\n2. 不限制行数的查询...")
+    full = db.concat_chunks(db.iter_query(sql, chunk_size=100, max_rows=0, max_bytes=0, use_cache=True))
+    assert len(full) == 1000 and not full.attrs["truncated"]
+    cached = db.result_cache.get(sql)
+    assert cached is not None and len(cached) == 1000
+    print(f"✅ 读取 {len(full)} 行，完整结果已写入缓存")
+
+    # 3. 再次查询命中缓存
+    print("\n3. 缓存命中...")
+    again = db.concat_chunks(db.iter_query(sql, chunk_size=100, use_cache=True))
+    assert len(again) == 1000
+    print(f"✅ 命中缓存 {len(again)} 行，统计: {db.result_cache.get_stats()}")
+
+    print("\n所有测试完成！")
+
+
+if __name__ == "__main__":
+    test_result_cache()
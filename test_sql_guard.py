@@ -0,0 +1,108 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.sql_guard import SQLCostGuard
+
+
+class FakeExplainDB:
+    """按SQL是否带时间条件返回 kpibase 全表扫描或范围扫描的执行计划"""
+
+    def __init__(self, kpi_rows=5_000_000):
+        self.kpi_rows = kpi_rows
+
+    def latest_data_time(self):
+        return "2025-01-07 00:00:00"
+
+    def explain(self, sql):
+        filtered = "开始时间" in sql
+        return {"query_block": {"cost_info": {"query_cost": "1000"}, "nested_loop": [
+            {"table": {"table_name": "b", "access_type": "ALL", "rows_examined_per_scan": 100,
+                       "rows_produced_per_join": 100}},
+            {"table": {"table_name": "k", "access_type": "range" if filtered else "ALL",
+                       "rows_examined_per_scan": 1000 if filtered else self.kpi_rows,
+                       "rows_produced_per_join": 1000}}
+        ]}}
+
+
+def test_sql_guard():
+    print("测试SQL代价检查...")
+    guard = SQLCostGuard(FakeExplainDB(), config={"max_rows_examined": 20_000_000})
+
+    # 1. 时间条件识别
+    print("\n1. has_time_filter...")
+    filtered = [
+        "SELECT * FROM kpibase WHERE `开始时间` >= '2025-01-01'",
+        "SELECT * FROM kpibase k WHERE k.`开始时间` BETWEEN '2025-01-01' AND '2025-01-07'",
+        "SELECT * FROM kpibase WHERE DATE(`开始时间`) = '2025-01-01'",
+        "SELECT * FROM kpibase WHERE '2025-01-01' <= `开始时间`",
+        "SELECT * FROM kpibase WHERE `开始时间` IN ('2025-01-01')"
+    ]
+    unfiltered = [
+        "SELECT `开始时间`, SUM(`K1001_001`) FROM kpibase GROUP BY `开始时间`",
+        "SELECT * FROM kpibase ORDER BY `开始时间` DESC"
+    ]
+    assert all(guard.has_time_filter(sql) for sql in filtered)
+    assert not any(guard.has_time_filter(sql) for sql in unfiltered)
+    print(f"✅ {len(filtered)} 条带时间条件、{len(unfiltered)} 条不带时间条件的SQL识别正确")
+
+    # 2. 内连接：条件加在 WHERE 中，全表扫描时追加 LIMIT
+    print("\n2. 内连接改写...")
+    sql = ("SELECT b.`省份`, SUM(k.`K1001_001`) FROM btsbase b JOIN kpibase k ON b.ID = k.ID "
+           "WHERE b.`省份` = '广东' OR b.`省份` = '江苏' GROUP BY b.`省份`")
+    result = guard.rewrite(sql)
+    assert "WHERE `k`.`开始时间` >= DATE_SUB('2025-01-07 00:00:00', INTERVAL 7 DAY) AND (b.`省份`" in result["sql"]
+    assert result["sql"].endswith("LIMIT 100000") and len(result["changes"]) == 2
+    print(f"✅ {result['changes']}")
+
+    # 3. LEFT JOIN kpibase：条件加在 ON 中，保持外连接语义
+    print("\n3. 外连接改写...")
+    sql = "SELECT b.`省份`, COUNT(k.ID) FROM btsbase b LEFT JOIN kpibase AS k ON b.ID = k.ID GROUP BY b.`省份`"
+    result = guard.rewrite(sql)
+    assert "ON `k`.`开始时间` >= DATE_SUB('2025-01-07 00:00:00', INTERVAL 7 DAY) AND (b.ID = k.ID)" in result["sql"]
+    assert "WHERE" not in result["sql"]
+    print("✅ 时间条件加在 LEFT JOIN 的 ON 中")
+
+    # 4. 无法安全改写的语句
+    print("\n4. 拒绝改写...")
+    refused = [
+        "SELECT * FROM kpibase k RIGHT JOIN btsbase b ON b.ID = k.ID",
+        "SELECT * FROM btsbase b LEFT JOIN kpibase k USING (ID)",
+        "SELECT * FROM btsbase WHERE ID IN (SELECT ID FROM kpibase)",
+        "SELECT ID FROM kpibase UNION SELECT ID FROM btsbase"
+    ]
+    assert all(guard.rewrite(sql) is None for sql in refused)
+    print(f"✅ {len(refused)} 条语句不做改写")
+
+    # 5. 子查询和字符串中的括号、关键字不影响顶层改写
+    print("\n5. 子查询改写...")
+    sql = "SELECT k.ID FROM kpibase k WHERE k.ID IN (SELECT ID FROM btsbase WHERE name = 'a ORDER BY b')"
+    result = guard.rewrite(sql, add_limit=False)
+    assert result["sql"].startswith("SELECT k.ID FROM kpibase k WHERE `k`.`开始时间` >=")
+    assert result["sql"].endswith("AND (k.ID IN (SELECT ID FROM btsbase WHERE name = 'a ORDER BY b'))")
+    print("✅ 子查询与字符串内容保持不变")
+
+    # 6. review：全表扫描改写后放行，消息说明追加 LIMIT 的原因
+    print("\n6. review...")
+    review = guard.review("SELECT b.`省份`, SUM(k.`K1001_001`) FROM btsbase b JOIN kpibase k ON b.ID = k.ID")
+    assert review["action"] == "rewrite", review
+    assert "全表扫描追加 LIMIT" in review["message"]
+    print(f"✅ {review['message']}")
+
+    # 7. 只是扫描行数超限（已有时间条件）时不追加 LIMIT，无法改写则拒绝
+    print("\n7. 扫描行数超限...")
+    strict = SQLCostGuard(FakeExplainDB(), config={"max_rows_examined": 10})
+    review = strict.review("SELECT * FROM btsbase b JOIN kpibase k ON b.ID = k.ID WHERE k.`开始时间` > '2025-01-01'")
+    assert review["action"] == "reject" and "LIMIT" not in review["sql"], review
+    print(f"✅ {review['message']}")
+
+    # 8. 数据源不支持 EXPLAIN 时不拦截
+    print("\n8. 不支持 EXPLAIN 的数据源...")
+    assert SQLCostGuard(object()).review("SELECT * FROM kpibase")["action"] == "unchecked"
+    print("✅ 不支持 EXPLAIN 的数据源不做检查")
+
+    print("\n所有测试完成！")
+
+
+if __name__ == "__main__":
+    test_sql_guard()
@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tempfile
+from modules.providers import FakeEmbedding
+from modules.vector_store import LocalChromaDB
+from modules.training_manager import BatchTrainer
+
+QA_PAIRS = [
+    {"question": "分省份统计基站数量", "sql": "SELECT `省份`, COUNT(DISTINCT station_name) FROM btsbase GROUP BY `省份`"},
+    {"question": "缺少SQL的问答对"},
+    "不是字典的条目",
+    None,
+    {"question": "分省份统计小区数量", "sql": "SELECT `省份`, COUNT(DISTINCT cell_name) FROM btsbase GROUP BY `省份`"}
+]
+
+
+def make_trainer(workdir):
+    return BatchTrainer(embedder=FakeEmbedding(dimensions=64), vector_db=LocalChromaDB(path=os.path.join(workdir, "chroma")),
+                        manifest_path=os.path.join(workdir, "manifest.json"))
+
+
+def test_training_manager():
+    print("测试格式错误的问答对...")
+
+    # 1. 全量训练：跳过格式错误的条目，其余问答对正常入库
+    print("\n1. train_from_qa_pairs...")
+    trainer = make_trainer(tempfile.mkdtemp(prefix="training_test_"))
+    count = trainer.train_from_qa_pairs(QA_PAIRS)
+    assert count == 2, count
+    print(f"✅ 写入 {count} 个问答对")
+
+    # 2. 增量训练：同样跳过，不中断整个增量同步
+    print("\n2. train_incremental...")
+    trainer = make_trainer(tempfile.mkdtemp(prefix="training_test_"))
+    result = trainer.train_incremental(["CREATE TABLE `btsbase` (`省份` varchar)"], ["文档"], QA_PAIRS)
+    assert result == {"ddl": 1, "doc": 1, "qa": 2}, result
+    print(f"✅ 增量训练结果: {result}")
+
+    # 3. 再次增量训练：全部跳过
+    result = trainer.train_incremental(["CREATE TABLE `btsbase` (`省份` varchar)"], ["文档"], QA_PAIRS)
+    assert result == {"ddl": 0, "doc": 0, "qa": 0}, result
+    print(f"✅ 未变化时不重复写入: {result}")
+
+    print("\n所有测试完成！")
+
+
+if __name__ == "__main__":
+    test_training_manager()
@@ -0,0 +1,104 @@
+import marshal
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from config.settings import CHART_CACHE_CONFIG
+
+
+def dataframe_fingerprint(df, sample_rows=None):
+    """
+    DataFrame 的廉价指纹：形状、列名、dtype，加上等距抽样行的内容哈希与数值列的总和。
+    大结果集上也只需毫秒级，数据不变时指纹稳定。
+    """
+    sample_rows = sample_rows or CHART_CACHE_CONFIG.get("sample_rows", 1000)
+    digest = hashlib.sha1()
+    digest.update(repr((df.shape, [str(c) for c in df.columns], [str(t) for t in df.dtypes])).encode("utf-8"))
+    if len(df):
+        step = max(1, len(df) // sample_rows)
+        sample = df.iloc[::step]
+        if len(df) > 1:
+            sample = pd.concat([sample, df.iloc[[-1]]])
+        digest.update(pd.util.hash_pandas_object(sample, index=True).values.tobytes())
+        numeric = df.select_dtypes(include="number")
+        if numeric.shape[1]:
+            # 未抽中的行被修改时，总和通常也会变化
+            digest.update(np.nan_to_num(numeric.to_numpy(dtype=np.float64, na_value=np.nan)).sum(axis=0).tobytes())
+    return digest.hexdigest()
+
+
+def code_hash(code):
+    """作图代码（字符串或函数）的哈希；函数按字节码和常量计算，代码修改后缓存自动失效"""
+    if callable(code):
+        payload = marshal.dumps(code.__code__)
+    else:
+        payload = str(code).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+class ChartCache:
+    """
+    已渲染图表的内存缓存：键为 (代码哈希, 数据指纹)，值为 HTML 或 options JSON。
+    按字节数上限 LRU 淘汰，Streamlit 重跑脚本、切换标签页时不再重复构建和渲染图表。
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or CHART_CACHE_CONFIG.get("max_bytes", 64 * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _size_of(value):
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        if isinstance(value, dict):
+            return sum(len(v.encode("utf-8")) for v in value.values() if isinstance(v, str))
+        return 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._entries[key][0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        size = self._size_of(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_chart_cache():
+    """进程级共享的图表缓存（Streamlit 各会话共用）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ChartCache()
+        return _cache
@@ -0,0 +1,175 @@
+"""
+时间序列图表的服务端降采样：数据点超过预算时，按序列挑选代表点后再交给图表，
+避免数十万个点以 JSON 形式发送到浏览器导致页面卡死。
+- lttb:       Largest-Triangle-Three-Buckets，保留曲线形状
+- minmax:     每个桶保留最小值和最大值，峰值和异常点一定保留
+- minmaxlttb: 先按 minmax 预选（预算的 minmax_ratio 倍），再做 LTTB，大数据量下兼顾速度与形状
+多条序列各自选点后取行号并集，同一时刻各列的数值保持对齐。
+"""
+import numpy as np
+import pandas as pd
+from config.settings import DOWNSAMPLE_CONFIG
+
+
+def lttb_indices(x, y, n_out):
+    """LTTB 选点，返回保留点的下标（含首尾点）；x 需已排序"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = _fill_nan(np.asarray(y, dtype=np.float64))
+    # 中间 n-2 个点均分为 n_out-2 个桶，每桶选一个点
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # 以上一个选中点、下一桶均值为另外两个顶点，取三角形面积最大的点
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y, n_buckets):
+    """按等长桶取每桶最小值和最大值的下标（含首尾点），结果不超过 2 * n_buckets + 2 个"""
+    n = len(y)
+    if n_buckets <= 0 or 2 * n_buckets >= n:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(n_buckets, size)
+    nan_mask = np.isnan(blocks)
+    offsets = np.arange(n_buckets) * size
+    argmax = np.where(nan_mask, -np.inf, blocks).argmax(axis=1) + offsets
+    argmin = np.where(nan_mask, np.inf, blocks).argmin(axis=1) + offsets
+    indices = np.concatenate(([0, n - 1], argmax, argmin))
+    return np.unique(np.clip(indices, 0, n - 1))
+
+
+def downsample_indices(x, y, n_out, method=None):
+    """按配置的方法为一条序列选点，返回下标（升序）"""
+    method = method or DOWNSAMPLE_CONFIG.get("method", "minmaxlttb")
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    if method == "minmax":
+        return minmax_indices(y, n_out // 2)
+    if method == "minmaxlttb":
+        ratio = DOWNSAMPLE_CONFIG.get("minmax_ratio", 4)
+        if n > ratio * n_out:
+            candidates = minmax_indices(y, ratio * n_out // 2)
+            return candidates[lttb_indices(np.asarray(x)[candidates], np.asarray(y)[candidates], n_out)]
+    return lttb_indices(x, y, n_out)
+
+
+def _fill_nan(values):
+    mask = np.isnan(values)
+    if not mask.any():
+        return values
+    fill = np.nanmean(values) if not mask.all() else 0.0
+    return np.where(mask, fill, values)
+
+
+def _x_values(series):
+    """横轴转为数值：时间列取纳秒整数，其他非数值列按位置编号"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(np.float64)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.arange(len(series), dtype=np.float64)
+
+
+def downsample_frame(df, x_col, y_cols, max_points=None, method=None, group_cols=None):
+    """
+    对按 x_col 排序的数据框降采样，返回 (降采样后的数据框, 统计信息)；未超过预算时原样返回，统计信息为 None。
+    - 每条数值序列（y_cols 中的每一列）分得 max_points / 序列数 个点，各序列选中的行取并集
+    - 指定 group_cols 时（如按小区展开的长表），每组按行数比例分配预算，组内单独选点
+    """
+    kept, info = downsample_positions(df, x_col, y_cols, max_points, method, group_cols)
+    if info is None:
+        return df, None
+    return df.iloc[kept], info
+
+
+def downsample_positions(df, x_col, y_cols, max_points=None, method=None, group_cols=None):
+    """downsample_frame 的行号版本，返回 (保留行的位置下标, 统计信息)；无需降采样时返回 (None, None)"""
+    max_points = max_points or DOWNSAMPLE_CONFIG.get("max_points", 2000)
+    y_cols = [c for c in y_cols if c in df.columns]
+    if len(df) <= max_points or not y_cols:
+        return None, None
+
+    per_series = max(3, max_points // len(y_cols))
+    if group_cols:
+        groups = list(df.groupby(group_cols, sort=False, observed=True, dropna=False).indices.values())
+    else:
+        groups = [np.arange(len(df))]
+
+    x_all = _x_values(df[x_col])
+    y_all = {col: df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in y_cols}
+    selected = []
+    for rows in groups:
+        budget = max(3, int(per_series * len(rows) / len(df)))
+        if len(rows) <= budget:
+            selected.append(rows)
+            continue
+        x = x_all[rows]
+        for col in y_cols:
+            selected.append(rows[downsample_indices(x, y_all[col][rows], budget, method)])
+
+    kept = np.unique(np.concatenate(selected))
+    info = {
+        "original_rows": len(df),
+        "rows": len(kept),
+        "ratio": len(kept) / len(df),
+        "method": method or DOWNSAMPLE_CONFIG.get("method", "minmaxlttb")
+    }
+    return kept, info
+
+
+def detect_time_column(df):
+    """与 build_simple_chart 相同的规则：datetime 类型或列名含“时间”“日期”且可解析为时间的列"""
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            return col
+    for col in df.columns:
+        if '时间' in str(col) or '日期' in str(col):
+            try:
+                pd.to_datetime(df[col].head(100))
+                return col
+            except (ValueError, TypeError):
+                pass
+    return None
+
+
+def downsample_for_plot(df, max_points=None):
+    """
+    作图前的通用降采样（用于 LLM 生成的作图代码）：识别时间列、数值列和维度列，
+    按维度分组、按时间排序后降采样；不是时间序列或行数未超预算时原样返回。
+    """
+    max_points = max_points or DOWNSAMPLE_CONFIG.get("max_points", 2000)
+    if not DOWNSAMPLE_CONFIG.get("enabled", True) or len(df) <= max_points:
+        return df, None
+    time_col = detect_time_column(df)
+    if time_col is None:
+        return df, None
+    frame = df
+    if not pd.api.types.is_datetime64_any_dtype(frame[time_col]):
+        frame = frame.assign(**{time_col: pd.to_datetime(frame[time_col], errors='coerce')})
+    value_cols = [c for c in frame.columns if c != time_col and pd.api.types.is_numeric_dtype(frame[c])]
+    group_cols = [c for c in frame.columns if c != time_col and c not in value_cols]
+    if not value_cols:
+        return df, None
+    order = np.argsort(frame[time_col].to_numpy(), kind="stable")
+    kept, info = downsample_positions(frame.iloc[order], time_col, value_cols, max_points,
+                                      group_cols=group_cols or None)
+    if info is None:
+        return df, None
+    # 返回原始数据中的行（保留原有的列类型），按时间排序
+    return df.iloc[order[kept]], info
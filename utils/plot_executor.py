@@ -9,14 +9,49 @@ import streamlit.components.v1 as components
 from datetime import datetime
 import traceback
 import re
+from config.settings import PLOT_SANDBOX_CONFIG, CHART_CACHE_CONFIG
+from utils.plot_sandbox import get_plot_pool, run_plot_code
+from utils.chart_cache import get_chart_cache, code_hash, dataframe_fingerprint
+from utils.downsample import downsample_for_plot
 
 class PlotExecutor:
-    def __init__(self):
+    def __init__(self, sandbox=None):
         # pyecharts 全局配置
         self.theme = ThemeType.LIGHT
-        
+        # 作图进程池；未传入时使用进程级共享的池（首次作图时启动）
+        self.sandbox = sandbox
+
+    def _get_sandbox(self):
+        if self.sandbox is None and PLOT_SANDBOX_CONFIG.get("enabled", True):
+            self.sandbox = get_plot_pool()
+        return self.sandbox
+
     def execute_plot_code(self, code, df):
-        """执行作图代码并返回 pyecharts HTML"""
+        """
+        执行作图代码并返回 pyecharts HTML；相同代码和数据的图表直接取缓存，不再重复执行。
+        时间序列超过点数预算时先降采样（按维度列分组、按数值列选点），统计信息放在结果的 downsample 中。
+        """
+        if not CHART_CACHE_CONFIG.get("enabled", True):
+            return self._execute_downsampled(code, df)
+        cache = get_chart_cache()
+        key = ("plot_code", code_hash(code), dataframe_fingerprint(df))
+        cached = cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+        result = self._execute_downsampled(code, df)
+        # 只缓存成功的结果，超时、资源超限等失败可重试
+        if result.get('success'):
+            cache.put(key, result)
+        return result
+
+    def _execute_downsampled(self, code, df):
+        df, downsample_info = downsample_for_plot(df)
+        result = self._execute(code, df)
+        result['downsample'] = downsample_info
+        return result
+
+    def _execute(self, code, df):
+        """执行作图代码并返回 pyecharts HTML（在作图进程池中执行，带超时和资源限制）"""
         
         # 修复常见的 pyecharts 参数错误
         code = self._fix_common_errors(code)
@@ -37,70 +72,38 @@ class PlotExecutor:
                         if not code.rstrip().endswith(')'):
                             code = code.rstrip() + ')'
                         break
-        
-        # 准备执行环境
-        namespace = {
-            'df': df,
-            'pd': pd,
-            'np': np,
-            'opts': opts,
-            'Bar': Bar,
-            'Line': Line,
-            'Pie': Pie,
-            'Scatter': Scatter,
-            'HeatMap': HeatMap,
-            'Grid': Grid,
-            'JsCode': JsCode,
-            'datetime': datetime
-        }
-        
-        try:
-            # 执行代码
-            exec(code, namespace)
-            
-            # 获取生成的图表对象
-            if 'chart' in namespace:
-                chart = namespace['chart']
-                
-                # 设置图表宽度为响应式
-                chart.width = "100%"
-                
-                # 渲染为 HTML
-                html = chart.render_embed()
-                
-                return {
-                    'success': True,
-                    'html': html,
-                    'error': None,
-                    'fixed_code': code  # 返回修复后的代码
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': "代码执行完成，但未找到 'chart' 变量。请确保将图表对象赋值给 'chart'。",
-                    'html': None
-                }
-                
-        except SyntaxError as e:
-            # 尝试自动修复语法错误
-            fixed_code = self._auto_fix_syntax(code, str(e))
-            if fixed_code != code:
-                # 递归调用，尝试执行修复后的代码
-                return self.execute_plot_code(fixed_code, df)
-            else:
-                return {
-                    'success': False,
-                    'error': f"语法错误: {str(e)}",
-                    'traceback': traceback.format_exc(),
-                    'html': None
-                }
-        except Exception as e:
+
+        # 在当前进程中只做编译检查，语法错误的自动修复次数有上限，不会反复执行代码
+        code, syntax_error = self._compile_with_fixes(code)
+        if syntax_error is not None:
             return {
                 'success': False,
-                'error': str(e),
-                'traceback': traceback.format_exc(),
+                'error': f"语法错误: {syntax_error}",
+                'traceback': ''.join(traceback.format_exception_only(type(syntax_error), syntax_error)),
                 'html': None
             }
+
+        sandbox = self._get_sandbox()
+        if sandbox is not None:
+            result = sandbox.run(code, df)
+        else:
+            result = run_plot_code(code, df)
+        if result.get('success'):
+            result['fixed_code'] = code  # 返回修复后的代码
+        return result
+
+    def _compile_with_fixes(self, code):
+        """编译检查作图代码，遇到语法错误时尝试自动修复；返回 (代码, 未能修复的 SyntaxError 或 None)"""
+        max_fixes = PLOT_SANDBOX_CONFIG.get("max_syntax_fixes", 3)
+        for attempt in range(max_fixes + 1):
+            try:
+                compile(code, "<plot>", "exec")
+                return code, None
+            except SyntaxError as e:
+                fixed_code = self._auto_fix_syntax(code, str(e)) if attempt < max_fixes else code
+                if fixed_code == code:
+                    return code, e
+                code = fixed_code
     
     def _fix_common_errors(self, code):
         """修复常见的 pyecharts 代码错误"""
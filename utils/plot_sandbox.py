@@ -0,0 +1,313 @@
+"""
+作图沙箱：LLM 生成的 pyecharts 代码在预启动的子进程中执行，与 Streamlit 进程隔离。
+- 子进程启动时即导入 pandas / pyecharts，作图任务无需等待导入
+- 每个任务限制 CPU 时间与内存（依赖 resource 模块，Windows 下跳过），并由父进程控制墙钟超时
+- 超时或崩溃的进程直接终止并补充新进程，不影响其他用户的作图
+- DataFrame 以 Arrow IPC 格式写入共享内存交给子进程，不经过 pickle
+"""
+import gc
+import queue
+import atexit
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyecharts import options as opts
+from pyecharts.charts import Bar, Line, Pie, Scatter, HeatMap, Grid
+from pyecharts.commons.utils import JsCode
+
+from config.settings import PLOT_SANDBOX_CONFIG
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def plot_namespace(df):
+    """作图代码的执行环境"""
+    return {
+        'df': df,
+        'pd': pd,
+        'np': np,
+        'opts': opts,
+        'Bar': Bar,
+        'Line': Line,
+        'Pie': Pie,
+        'Scatter': Scatter,
+        'HeatMap': HeatMap,
+        'Grid': Grid,
+        'JsCode': JsCode,
+        'datetime': datetime
+    }
+
+
+def run_plot_code(code, df):
+    """执行作图代码并渲染为 HTML；子进程和不启用沙箱时的进程内执行共用"""
+    namespace = plot_namespace(df)
+    try:
+        exec(code, namespace)
+        if 'chart' not in namespace:
+            return {
+                'success': False,
+                'error': "代码执行完成，但未找到 'chart' 变量。请确保将图表对象赋值给 'chart'。",
+                'html': None
+            }
+        chart = namespace['chart']
+        # 设置图表宽度为响应式
+        chart.width = "100%"
+        return {'success': True, 'html': chart.render_embed(), 'error': None}
+    except MemoryError:
+        return {'success': False, 'error': "作图代码超出内存限制", 'traceback': traceback.format_exc(), 'html': None}
+    except Exception as e:
+        return {'success': False, 'error': str(e), 'traceback': traceback.format_exc(), 'html': None}
+
+
+# ---------------- 共享内存传递 DataFrame ----------------
+
+def _write_stream(sink, table):
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def share_dataframe(df):
+    """
+    将 DataFrame 以 Arrow IPC 流写入新建的共享内存，返回 (SharedMemory, 字节数)。
+    先用 MockOutputStream 计算大小，再直接写入共享内存，不产生中间副本。调用方负责 close/unlink。
+    """
+    table = pa.Table.from_pandas(df)
+    mock = pa.MockOutputStream()
+    _write_stream(mock, table)
+    size = mock.size()
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        _write_stream(pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf)), table)
+    except Exception:
+        shm.close()
+        shm.unlink()
+        raise
+    return shm, size
+
+
+def _run_shared(job):
+    """
+    直接在共享内存上解码 DataFrame 并执行作图（数值列和 Arrow 字符串列不复制），
+    任务结束、DataFrame 释放后再关闭映射
+    """
+    shm = shared_memory.SharedMemory(name=job["shm_name"])
+    try:
+        return _run_on_buffer(shm.buf, job)
+    finally:
+        # 作图代码中的闭包可能形成循环引用，先回收再关闭
+        gc.collect()
+        try:
+            shm.close()
+        except BufferError:
+            # 作图代码仍持有数据引用（如写入了模块全局变量），保留映射直到进程重启
+            print("[作图沙箱] 共享内存仍被引用，暂不释放")
+            _pinned.append(shm)
+
+
+def _run_on_buffer(buf, job):
+    with pa.ipc.open_stream(pa.py_buffer(buf)[:job["size"]]) as reader:
+        df = reader.read_pandas()
+    return run_plot_code(job["code"], df)
+
+
+_pinned = []
+
+
+# ---------------- 子进程 ----------------
+
+def _set_cpu_limit(seconds):
+    """本任务最多再使用 seconds 秒 CPU 时间，超出时内核发送 SIGXCPU 终止进程"""
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _set_memory_limit(memory_mb):
+    if resource is None or not memory_mb:
+        return
+    limit = int(memory_mb) * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ValueError, OSError) as e:
+        print(f"[作图沙箱] 设置内存上限失败: {e}")
+
+
+def _worker_main(conn, memory_mb):
+    """子进程主循环：模块导入完成后通知就绪，逐个执行作图任务"""
+    _set_memory_limit(memory_mb)
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        _set_cpu_limit(job.get("cpu_seconds"))
+        try:
+            if job.get("shm_name"):
+                result = _run_shared(job)
+            else:
+                result = run_plot_code(job["code"], job.pop("df"))
+        except MemoryError:
+            result = {'success': False, 'error': "作图数据超出内存限制", 'html': None}
+        except Exception as e:
+            result = {'success': False, 'error': f"读取作图数据失败: {e}", 'traceback': traceback.format_exc(),
+                      'html': None}
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, ctx, memory_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        if not self.ready:
+            if not self.conn.poll(timeout):
+                raise TimeoutError("作图进程启动超时")
+            self.conn.recv()
+            self.ready = True
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(1)
+        except Exception:
+            pass
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+
+
+class PlotSandboxPool:
+    """预启动的作图进程池；run() 线程安全，空闲进程不足时排队等待"""
+
+    def __init__(self, workers=None, timeout=None, cpu_seconds=None, memory_mb=None, start_method=None,
+                 startup_timeout=None):
+        self.workers = workers or PLOT_SANDBOX_CONFIG.get("workers", 2)
+        self.timeout = timeout or PLOT_SANDBOX_CONFIG.get("timeout_seconds", 15)
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else PLOT_SANDBOX_CONFIG.get("cpu_seconds", 15)
+        self.memory_mb = memory_mb if memory_mb is not None else PLOT_SANDBOX_CONFIG.get("memory_mb", 2048)
+        self.startup_timeout = startup_timeout or PLOT_SANDBOX_CONFIG.get("startup_timeout_seconds", 30)
+        self._ctx = multiprocessing.get_context(start_method or PLOT_SANDBOX_CONFIG.get("start_method", "spawn"))
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"jobs": 0, "timeouts": 0, "crashes": 0, "respawns": 0}
+        for _ in range(self.workers):
+            self._idle.put(_Worker(self._ctx, self.memory_mb))
+
+    def _bump(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _release(self, worker, healthy):
+        if self._closed:
+            if healthy:
+                worker.stop()
+            else:
+                worker.kill()
+            return
+        if not healthy:
+            worker.kill()
+            worker = _Worker(self._ctx, self.memory_mb)
+            self._bump("respawns")
+        self._idle.put(worker)
+
+    def run(self, code, df, timeout=None):
+        """在空闲子进程中执行作图代码，返回与 PlotExecutor.execute_plot_code 相同结构的字典"""
+        if self._closed:
+            return {'success': False, 'error': "作图进程池已关闭", 'html': None}
+        timeout = timeout or self.timeout
+        job = {"code": code, "cpu_seconds": self.cpu_seconds}
+        shm = None
+        try:
+            shm, job["size"] = share_dataframe(df)
+            job["shm_name"] = shm.name
+        except Exception as e:
+            # 含有 Arrow 无法表示的列（如混合类型的 object 列）时退回 pickle 传递
+            print(f"[作图沙箱] Arrow 转换失败，改用 pickle 传递数据: {e}")
+            job["df"] = df
+
+        try:
+            try:
+                worker = self._idle.get(timeout=self.startup_timeout + timeout)
+            except queue.Empty:
+                return {'success': False, 'error': "作图进程繁忙，请稍后重试", 'html': None}
+
+            healthy = False
+            try:
+                worker.wait_ready(self.startup_timeout)
+                self._bump("jobs")
+                worker.conn.send(job)
+                if not worker.conn.poll(timeout):
+                    self._bump("timeouts")
+                    print(f"[作图沙箱] 作图超时（{timeout} 秒），终止子进程 {worker.process.pid}")
+                    return {'success': False, 'error': f"作图超时（超过 {timeout} 秒），已终止执行", 'html': None}
+                result = worker.conn.recv()
+                healthy = True
+                return result
+            except (EOFError, OSError, TimeoutError) as e:
+                self._bump("crashes")
+                print(f"[作图沙箱] 子进程 {worker.process.pid} 异常退出: {type(e).__name__} {e}")
+                return {'success': False, 'error': "作图进程异常退出（可能超出CPU时间或内存限制）", 'html': None}
+            finally:
+                self._release(worker, healthy)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_plot_pool():
+    """进程级共享的作图进程池（Streamlit 各会话共用），首次使用时启动"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PlotSandboxPool()
+            atexit.register(_pool.shutdown)
+        return _pool